@@ -0,0 +1,325 @@
+"""
+Aggregate cube of the download records.
+
+The cube is built in a single scan of the merged Parquet data and holds everything the JSON exports and the
+HTML report need, at a size proportional to the number of distinct groups instead of the number of downloads:
+- counts.parquet: downloads per date, year, month, accession, method, country (and bot classification flags)
+- file_counts.parquet: downloads per accession and file name
+- users_by_date.parquet, users_by_country_year.parquet: HyperLogLog sketches of the distinct users per
+  date and per country and year; sketches are merged with an element-wise max, so any coarser grain
+  (eg: the distinct users of the whole dataset) is derived without the raw rows; sketches of few users are
+  stored sparse (register index and value of the non-zero registers)
+
+Distinct user counts read from the cube are estimates with a relative standard error of about
+1.04 / sqrt(2 ** precision) (1.6% with the default precision).
+"""
+import logging
+import os
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from count_aggregator import COUNT_COLUMN, CountAggregator
+from parquet_schema import SCHEMA_V1, to_pandas
+
+logger = logging.getLogger(__name__)
+
+CUBE_DIMENSIONS = ["date", "year", "month", "accession", "method", "country"]
+BOT_COLUMNS = ["is_bot", "is_hub", "is_organic"]
+FILE_DIMENSIONS = ["accession", "filename"]
+
+COUNTS_FILE = "counts.parquet"
+FILE_COUNTS_FILE = "file_counts.parquet"
+USERS_BY_DATE_FILE = "users_by_date.parquet"
+USERS_BY_COUNTRY_YEAR_FILE = "users_by_country_year.parquet"
+
+USER_COLUMN = "user"
+SKETCH_COLUMN = "sketch"
+HLL_PRECISION = 12
+# Key columns of the distinct user sketches
+USERS_BY_DATE_KEYS = ["date", "year", "month"]
+USERS_BY_COUNTRY_YEAR_KEYS = ["country", "year"]
+
+
+def is_cube(path: str) -> bool:
+    """Whether the path is an aggregate cube directory (written by AggregateCube.write)."""
+    return os.path.isfile(os.path.join(path, COUNTS_FILE))
+
+
+def column_type(name: str) -> pa.DataType:
+    """Arrow type of a cube column."""
+    if name in BOT_COLUMNS:
+        return pa.bool_()
+    if name == COUNT_COLUMN:
+        return pa.int64()
+    return SCHEMA_V1.field(name).type
+
+
+def _table(df: pd.DataFrame) -> pa.Table:
+    """Table of a cube frame, with the column types of the cube whatever the values (eg: all null)."""
+    schema = pa.schema([pa.field(name, column_type(name)) for name in df.columns])
+    return pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+
+
+def _bit_length(values: np.ndarray) -> np.ndarray:
+    """Number of significant bits of every uint64 value (0 for 0)."""
+    high = (values >> np.uint64(32)).astype(np.float64)
+    low = (values & np.uint64(0xFFFFFFFF)).astype(np.float64)
+    # frexp returns the exponent e of x = m * 2**e with 0.5 <= m < 1, which is the bit length of an integer
+    # (exact for 32-bit halves)
+    return np.where(high > 0, np.frexp(high)[1] + 32, np.frexp(low)[1])
+
+
+def hash_values(array: Union[pa.Array, pa.ChunkedArray]) -> np.ndarray:
+    """
+    64-bit hashes of the values of an array (stable across processes). Every distinct value is hashed once.
+    """
+    encoded = pc.dictionary_encode(array)
+    if isinstance(encoded, pa.ChunkedArray):
+        encoded = encoded.combine_chunks()
+    dictionary = encoded.dictionary.to_numpy(zero_copy_only=False)
+    hashes = pd.util.hash_array(dictionary.astype(object), categorize=False)
+    return hashes[encoded.indices.to_numpy(zero_copy_only=False)]
+
+
+def estimate_cardinality(registers: np.ndarray) -> np.ndarray:
+    """
+    HyperLogLog estimates of the registers (one estimate per row), with the linear counting correction for
+    small cardinalities.
+    """
+    registers = np.atleast_2d(registers)
+    m = registers.shape[1]
+    alpha = 0.7213 / (1 + 1.079 / m)
+    raw = alpha * m * m / np.sum(np.ldexp(1.0, -registers.astype(np.int64)), axis=1)
+    zeros = np.count_nonzero(registers == 0, axis=1)
+    linear = m * np.log(m / np.maximum(zeros, 1))
+    return np.rint(np.where((raw <= 2.5 * m) & (zeros > 0), linear, raw)).astype(np.int64)
+
+
+class UserSketch:
+    """
+    HyperLogLog sketches of the distinct users per group of key columns.
+    """
+
+    def __init__(self, keys: Sequence[str], precision: int = HLL_PRECISION) -> None:
+        """
+        :param keys: Columns to group by
+        :param precision: Number of hash bits used to select a register (2 ** precision registers per group)
+        """
+        self.keys: List[str] = list(keys)
+        self.precision: int = precision
+        self.groups: Dict[Tuple, int] = {}
+        self.registers: np.ndarray = np.zeros((0, 1 << precision), dtype=np.uint8)
+
+    @property
+    def relative_error(self) -> float:
+        """Relative standard error of the estimates."""
+        return float(1.04 / np.sqrt(1 << self.precision))
+
+    def _group_ids(self, keys: List[Tuple]) -> np.ndarray:
+        """Register rows of the groups, added if they are new."""
+        ids = np.empty(len(keys), dtype=np.intp)
+        for index, key in enumerate(keys):
+            group_id = self.groups.get(key)
+            if group_id is None:
+                group_id = self.groups[key] = len(self.groups)
+            ids[index] = group_id
+        if len(self.groups) > len(self.registers):
+            grown = np.zeros((max(len(self.groups), 2 * len(self.registers)), self.registers.shape[1]), dtype=np.uint8)
+            grown[:len(self.registers)] = self.registers
+            self.registers = grown
+        return ids
+
+    def add(self, batch: Union[pa.RecordBatch, pa.Table]) -> None:
+        """
+        Add the users of a batch. Rows with a null user or key are ignored (as in a pandas nunique).
+        """
+        table = pa.Table.from_batches([batch]) if isinstance(batch, pa.RecordBatch) else batch
+        table = table.select(self.keys + [USER_COLUMN])
+        if any(column.null_count for column in table.columns):
+            valid = pc.is_valid(table.column(0))
+            for column in table.columns[1:]:
+                valid = pc.and_(valid, pc.is_valid(column))
+            table = table.filter(valid)
+        if table.num_rows == 0:
+            return
+
+        # Group of every row: the distinct key combinations are found on the dictionary indices of the keys
+        codes = np.zeros(table.num_rows, dtype=np.int64)
+        dictionaries = []
+        for key in self.keys:
+            encoded = pc.dictionary_encode(table.column(key)).combine_chunks()
+            codes = codes * len(encoded.dictionary) + encoded.indices.to_numpy(zero_copy_only=False)
+            dictionaries.append(encoded.dictionary)
+        unique_codes, inverse = np.unique(codes, return_inverse=True)
+        group_keys = []
+        for code in unique_codes.tolist():
+            values = []
+            for dictionary in reversed(dictionaries):
+                code, index = divmod(code, len(dictionary))
+                values.append(dictionary[index].as_py())
+            group_keys.append(tuple(reversed(values)))
+        rows = self._group_ids(group_keys)[inverse.reshape(-1)]
+
+        # Register index from the first bits of the hash, rank from the position of the first 1-bit after them
+        hashes = hash_values(table.column(USER_COLUMN))
+        index = (hashes >> np.uint64(64 - self.precision)).astype(np.intp)
+        remaining = hashes << np.uint64(self.precision)
+        rank = np.minimum(64 - _bit_length(remaining) + 1, 64 - self.precision + 1).astype(np.uint8)
+        np.maximum.at(self.registers, (rows, index), rank)
+
+    def merge(self, other: "UserSketch") -> None:
+        """
+        Add the users of another sketch over the same keys (eg: one filled by another worker).
+        """
+        if not other.groups:
+            return
+        rows = self._group_ids(list(other.groups))
+        self.registers[rows] = np.maximum(self.registers[rows], other.registers[list(other.groups.values())])
+
+    def exclude(self, key: str, values: Iterable) -> "UserSketch":
+        """
+        Copy of the sketches without the groups whose key column has one of the values (eg: skipped years).
+        """
+        position = self.keys.index(key)
+        excluded = set(values)
+        sketch = UserSketch(self.keys, self.precision)
+        kept = [(group, row) for group, row in self.groups.items() if group[position] not in excluded]
+        if kept:
+            rows = sketch._group_ids([group for group, _ in kept])
+            sketch.registers[rows] = self.registers[[row for _, row in kept]]
+        return sketch
+
+    def estimates(self) -> pd.DataFrame:
+        """
+        Estimated number of distinct users per group, sorted by the keys.
+        :return: DataFrame with the key columns and the estimate in the user column
+        """
+        if not self.groups:
+            return pd.DataFrame(columns=self.keys + [USER_COLUMN])
+        df = pd.DataFrame(list(self.groups), columns=self.keys)
+        df[USER_COLUMN] = estimate_cardinality(self.registers[list(self.groups.values())])
+        return df.sort_values(self.keys, ignore_index=True)
+
+    def total(self) -> int:
+        """Estimated number of distinct users of all groups."""
+        if not self.groups:
+            return 0
+        return int(estimate_cardinality(self.registers[:len(self.groups)].max(axis=0))[0])
+
+    def to_table(self) -> pa.Table:
+        """The sketches as a table with the key columns and one binary register column."""
+        keys = list(zip(*self.groups)) if self.groups else [[] for _ in self.keys]
+        columns = [pa.array(values, column_type(key)) for values, key in zip(keys, self.keys)]
+        sketches = []
+        for row in self.registers[list(self.groups.values())]:
+            # Sparse: uint16 indices then uint8 values of the non-zero registers, if shorter than the registers
+            indices = np.flatnonzero(row)
+            if 3 * len(indices) < len(row):
+                sketches.append(indices.astype("<u2").tobytes() + row[indices].tobytes())
+            else:
+                sketches.append(row.tobytes())
+        columns.append(pa.array(sketches, pa.binary()))
+        return pa.Table.from_arrays(columns, names=self.keys + [SKETCH_COLUMN])
+
+    @classmethod
+    def from_table(cls, table: pa.Table, precision: int = HLL_PRECISION) -> "UserSketch":
+        """
+        Sketches written by to_table. Rows of the same group (eg: of tables written for different days) are merged.
+        """
+        keys = [name for name in table.column_names if name != SKETCH_COLUMN]
+        sketch = cls(keys, precision)
+        if table.num_rows == 0:
+            return sketch
+        rows = sketch._group_ids(list(zip(*(table.column(key).to_pylist() for key in keys))))
+        size = sketch.registers.shape[1]
+        for row, data in zip(rows.tolist(), table.column(SKETCH_COLUMN).to_pylist()):
+            if len(data) == size:
+                np.maximum(sketch.registers[row], np.frombuffer(data, dtype=np.uint8), out=sketch.registers[row])
+            else:
+                count = len(data) // 3
+                indices = np.frombuffer(data, dtype="<u2", count=count)
+                values = np.frombuffer(data, dtype=np.uint8, offset=2 * count)
+                sketch.registers[row, indices] = np.maximum(sketch.registers[row, indices], values)
+        return sketch
+
+
+@dataclass
+class AggregateCube:
+    """Aggregates of the download records (see the module documentation)."""
+    counts: pd.DataFrame
+    file_counts: pd.DataFrame
+    users_by_date: UserSketch
+    users_by_country_year: UserSketch
+
+    @property
+    def has_bot_columns(self) -> bool:
+        return all(column in self.counts.columns for column in BOT_COLUMNS)
+
+    def write(self, cube_dir: str) -> None:
+        """Write the cube as Parquet files into a directory."""
+        os.makedirs(cube_dir, exist_ok=True)
+        pq.write_table(_table(self.counts), os.path.join(cube_dir, COUNTS_FILE))
+        pq.write_table(_table(self.file_counts), os.path.join(cube_dir, FILE_COUNTS_FILE))
+        pq.write_table(self.users_by_date.to_table(), os.path.join(cube_dir, USERS_BY_DATE_FILE))
+        pq.write_table(self.users_by_country_year.to_table(), os.path.join(cube_dir, USERS_BY_COUNTRY_YEAR_FILE))
+        logger.info("Aggregate cube saved", extra={
+            "cube_dir": cube_dir,
+            "count_rows": len(self.counts),
+            "file_count_rows": len(self.file_counts),
+        })
+
+    @classmethod
+    def read(cls, cube_dir: str) -> "AggregateCube":
+        """Read a cube written by write."""
+        return cls(
+            counts=to_pandas(pq.read_table(os.path.join(cube_dir, COUNTS_FILE))),
+            file_counts=to_pandas(pq.read_table(os.path.join(cube_dir, FILE_COUNTS_FILE))),
+            users_by_date=UserSketch.from_table(pq.read_table(os.path.join(cube_dir, USERS_BY_DATE_FILE))),
+            users_by_country_year=UserSketch.from_table(
+                pq.read_table(os.path.join(cube_dir, USERS_BY_COUNTRY_YEAR_FILE))
+            ),
+        )
+
+
+class CubeBuilder:
+    """
+    Builds an AggregateCube from a stream of record batches (in the version 1 schema).
+    Builders filled from different parts of the data (eg: by several workers) are combined with merge.
+    """
+
+    def __init__(self, has_bot_columns: bool = False, precision: int = HLL_PRECISION) -> None:
+        """
+        :param has_bot_columns: Also group the counts by the is_bot, is_hub and is_organic flags
+        :param precision: HyperLogLog precision of the distinct user sketches
+        """
+        # Null dimensions are kept, so every download is counted at the grain of the cube
+        self.counts = CountAggregator(CUBE_DIMENSIONS + (BOT_COLUMNS if has_bot_columns else []), dropna=False)
+        self.file_counts = CountAggregator(FILE_DIMENSIONS)
+        self.users_by_date = UserSketch(USERS_BY_DATE_KEYS, precision)
+        self.users_by_country_year = UserSketch(USERS_BY_COUNTRY_YEAR_KEYS, precision)
+
+    def add(self, batch: pa.RecordBatch) -> None:
+        self.counts.add(batch)
+        self.file_counts.add(batch)
+        self.users_by_date.add(batch)
+        self.users_by_country_year.add(batch)
+
+    def merge(self, other: "CubeBuilder") -> None:
+        self.counts.merge(other.counts)
+        self.file_counts.merge(other.file_counts)
+        self.users_by_date.merge(other.users_by_date)
+        self.users_by_country_year.merge(other.users_by_country_year)
+
+    def build(self) -> AggregateCube:
+        return AggregateCube(
+            counts=self.counts.result(),
+            file_counts=self.file_counts.result(),
+            users_by_date=self.users_by_date,
+            users_by_country_year=self.users_by_country_year,
+        )
@@ -0,0 +1,220 @@
+"""
+Persistent day-partitioned aggregate store.
+
+The store holds one aggregate cube (see aggregate_cube) per day, built from the per-log parquet files of the
+parquet store (see ingestion_manifest):
+
+    <store_dir>/aggregate_index.tsv      per-log parquet file -> size, mtime and the days it has rows for
+    <store_dir>/date=YYYY-MM-DD/         cube of the day
+
+An update only rebuilds the days of the per-log parquet files that were added, replaced or removed since the
+previous update, from the rows of those days; the other days are kept as they are. A day is always rebuilt
+from all the files having rows for it, so a reprocessed log replaces its contribution instead of adding it
+twice. The cube of the whole history is assembled from the day cubes without reading any download records.
+Rows without a date are not part of any day.
+"""
+import logging
+import os
+import shutil
+from dataclasses import dataclass, field
+from datetime import date
+from typing import Dict, Iterable, List, Set
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from aggregate_cube import (
+    COUNTS_FILE,
+    CUBE_DIMENSIONS,
+    FILE_COUNTS_FILE,
+    FILE_DIMENSIONS,
+    USER_COLUMN,
+    USERS_BY_COUNTRY_YEAR_FILE,
+    USERS_BY_DATE_FILE,
+    AggregateCube,
+    CubeBuilder,
+    UserSketch,
+)
+from count_aggregator import COUNT_COLUMN
+from exceptions import ConfigurationError
+from parquet_schema import to_pandas, to_v1
+
+logger = logging.getLogger(__name__)
+
+# Columns of the per-log parquet files read to build a day cube
+CUBE_INPUT_COLUMNS = list(dict.fromkeys(CUBE_DIMENSIONS + FILE_DIMENSIONS + [USER_COLUMN]))
+
+
+@dataclass
+class StoreEntry:
+    """Per-log parquet file folded into the store."""
+    parquet_file: str
+    size: int
+    mtime_ns: int
+    dates: List[str] = field(default_factory=list)  # Days (YYYY-MM-DD) the file has rows for
+
+
+class AggregateStore:
+    """
+    Day cubes of the per-log parquet files, updated incrementally.
+    """
+
+    INDEX_NAME = "aggregate_index.tsv"
+    HEADER = "#parquet_file\tsize\tmtime_ns\tdates\n"
+    PARTITION_PREFIX = "date="
+    DEFAULT_REBUILD_CHUNK_DAYS = 31
+
+    def __init__(self, store_dir: str, rebuild_chunk_days: int = DEFAULT_REBUILD_CHUNK_DAYS) -> None:
+        """
+        :param store_dir: Directory holding the day cubes and the index
+        :param rebuild_chunk_days: Number of days rebuilt at a time. Each day being rebuilt holds its own
+        distinct user sketches (4 KiB per date and per country and year), so a rebuild of the whole history is
+        done in chunks of days, whose cubes are written before the next chunk is read.
+        """
+        if not store_dir:
+            raise ConfigurationError("store_dir is required for the aggregate store", config_key="aggregate_store_dir")
+        if rebuild_chunk_days <= 0:
+            raise ConfigurationError("rebuild_chunk_days must be positive", config_key="rebuild_chunk_days",
+                                     value=rebuild_chunk_days)
+        self.store_dir: str = store_dir
+        self.rebuild_chunk_days: int = rebuild_chunk_days
+        self.index_path: str = os.path.join(store_dir, self.INDEX_NAME)
+        self.entries: Dict[str, StoreEntry] = {}
+        self.load()
+
+    def load(self) -> None:
+        """Load the index from the store directory, if it exists."""
+        self.entries = {}
+        if not os.path.exists(self.index_path):
+            return
+        with open(self.index_path, "r") as f:
+            for line in f:
+                if line.startswith("#") or not line.strip():
+                    continue
+                parquet_file, size, mtime_ns, dates = line.rstrip("\n").split("\t")
+                self.entries[parquet_file] = StoreEntry(parquet_file, int(size), int(mtime_ns),
+                                                        dates.split(",") if dates else [])
+        logger.info("Aggregate store index loaded", extra={"index": self.index_path, "entry_count": len(self.entries)})
+
+    def save(self) -> None:
+        """Atomically write the index to the store directory."""
+        os.makedirs(self.store_dir, exist_ok=True)
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.HEADER)
+            for entry in sorted(self.entries.values(), key=lambda e: e.parquet_file):
+                f.write(f"{entry.parquet_file}\t{entry.size}\t{entry.mtime_ns}\t{','.join(entry.dates)}\n")
+        os.replace(tmp_path, self.index_path)
+
+    def partition_dir(self, day: str) -> str:
+        return os.path.join(self.store_dir, f"{self.PARTITION_PREFIX}{day}")
+
+    def dates(self) -> List[str]:
+        """Days with a cube in the store."""
+        return sorted(
+            name[len(self.PARTITION_PREFIX):] for name in os.listdir(self.store_dir)
+            if name.startswith(self.PARTITION_PREFIX) and os.path.isdir(os.path.join(self.store_dir, name))
+        ) if os.path.isdir(self.store_dir) else []
+
+    @staticmethod
+    def file_dates(parquet_file: str) -> List[str]:
+        """Days a parquet file has rows for."""
+        dates = pc.unique(pq.read_table(parquet_file, columns=["date"]).column("date")).to_pylist()
+        return sorted(day.isoformat() for day in dates if day is not None)
+
+    def update(self, parquet_files: Iterable[str]) -> List[str]:
+        """
+        Fold the per-log parquet files into the store.
+        Files not in the index or whose size or modification time changed are (re)read; indexed files that are
+        not in parquet_files any more are removed from the store.
+        :param parquet_files: All per-log parquet files of the dataset (eg: IngestionManifest.parquet_files())
+        :return: Days rebuilt
+        """
+        parquet_files = list(parquet_files)
+        affected: Set[str] = set()
+        for parquet_file in set(self.entries) - set(parquet_files):
+            affected.update(self.entries.pop(parquet_file).dates)
+
+        changed_count = 0
+        for parquet_file in parquet_files:
+            stat = os.stat(parquet_file)
+            entry = self.entries.get(parquet_file)
+            if entry is not None and entry.size == stat.st_size and entry.mtime_ns == stat.st_mtime_ns:
+                continue
+            if entry is not None:
+                affected.update(entry.dates)
+            dates = self.file_dates(parquet_file)
+            affected.update(dates)
+            self.entries[parquet_file] = StoreEntry(parquet_file, stat.st_size, stat.st_mtime_ns, dates)
+            changed_count += 1
+
+        self._rebuild(affected)
+        self.save()
+        logger.info("Aggregate store updated", extra={
+            "store_dir": self.store_dir,
+            "changed_file_count": changed_count,
+            "rebuilt_day_count": len(affected),
+        })
+        return sorted(affected)
+
+    def _rebuild(self, days: Set[str]) -> None:
+        """
+        Replace the cubes of the days with cubes built from the indexed files having rows for them.
+        The days are rebuilt in chunks of rebuild_chunk_days consecutive days, so only the builders of one
+        chunk are held in memory; a file is read once per chunk it has rows for.
+        """
+        ordered_days = sorted(days)
+        for start in range(0, len(ordered_days), self.rebuild_chunk_days):
+            self._rebuild_chunk(set(ordered_days[start:start + self.rebuild_chunk_days]))
+
+    def _rebuild_chunk(self, days: Set[str]) -> None:
+        """
+        Build the cubes of some days and write them in place of their partitions.
+        """
+        builders = {day: CubeBuilder() for day in days}
+        for entry in self.entries.values():
+            entry_days = days.intersection(entry.dates)
+            if not entry_days:
+                continue
+            columns = [c for c in CUBE_INPUT_COLUMNS if c in pq.read_schema(entry.parquet_file).names]
+            table = to_v1(pq.read_table(entry.parquet_file, columns=columns))
+            for day in entry_days:
+                day_value = pa.scalar(date.fromisoformat(day), table.schema.field("date").type)
+                builders[day].add(table.filter(pc.equal(table.column("date"), day_value)))
+
+        for day, builder in builders.items():
+            partition_dir = self.partition_dir(day)
+            cube = builder.build()
+            tmp_dir = partition_dir + ".tmp"
+            if os.path.isdir(tmp_dir):
+                shutil.rmtree(tmp_dir)
+            if not cube.counts.empty:
+                cube.write(tmp_dir)
+            if os.path.isdir(partition_dir):
+                shutil.rmtree(partition_dir)
+            if os.path.isdir(tmp_dir):
+                os.replace(tmp_dir, partition_dir)
+
+    def cube(self) -> AggregateCube:
+        """
+        Cube of all the days of the store.
+        """
+        partitions = [self.partition_dir(day) for day in self.dates()]
+        if not partitions:
+            return CubeBuilder().build()
+
+        def read(file_name: str) -> pa.Table:
+            return pa.concat_tables(pq.read_table(os.path.join(partition, file_name)) for partition in partitions)
+
+        # Days do not overlap: the day counts are the cube counts, the other aggregates are merged across days
+        file_counts = read(FILE_COUNTS_FILE).group_by(FILE_DIMENSIONS).aggregate([(COUNT_COLUMN, "sum")])
+        file_counts = file_counts.rename_columns(
+            [COUNT_COLUMN if name == f"{COUNT_COLUMN}_sum" else name for name in file_counts.column_names]
+        ).select(FILE_DIMENSIONS + [COUNT_COLUMN])
+        return AggregateCube(
+            counts=to_pandas(read(COUNTS_FILE)),
+            file_counts=to_pandas(file_counts).sort_values(FILE_DIMENSIONS, ignore_index=True),
+            users_by_date=UserSketch.from_table(read(USERS_BY_DATE_FILE)),
+            users_by_country_year=UserSketch.from_table(read(USERS_BY_COUNTRY_YEAR_FILE)),
+        )
@@ -0,0 +1,188 @@
+import logging
+from typing import Iterator, List, Dict, Any, Optional
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+
+from exceptions import ValidationError
+from log_file_parser import LogFileParser, RowFilter
+from parquet_writer import ParquetWriter
+from timestamp_decoder import TimestampDecoder
+
+logger = logging.getLogger(__name__)
+
+
+class ArrowLogFileParser:
+    """
+    Columnar parser for the log file. Streams the gzipped TSV through the Arrow CSV reader in blocks,
+    filters the relevant rows with pyarrow.compute and yields record batches in ParquetWriter.schema.
+    Lines that the CSV reader cannot split into 13 columns (eg: literal '\\t' separators) are handed over
+    to the row parser so both engines produce the same output.
+    """
+
+    COLUMN_NAMES = [
+        "timestamp", "user", "size", "path", "direction", "host", "completed", "country",
+        "geoip_region_name", "geoip_city_name", "geo_location", "method", "public_private"
+    ]
+    USED_COLUMNS = [
+        "timestamp", "user", "path", "completed", "country",
+        "geoip_region_name", "geoip_city_name", "geo_location", "method"
+    ]
+    DEFAULT_BLOCK_SIZE = 16 * 1024 * 1024
+
+    def __init__(
+        self,
+        file_path: str,
+        resource_list: List[str],
+        completeness_list: List[str],
+        accession_pattern_list: List[str],
+        block_size: int = DEFAULT_BLOCK_SIZE,
+        row_filter: Optional[RowFilter] = None
+    ) -> None:
+        """
+        :param row_filter: Date window and accession sets of the rows to keep (default: all rows)
+        """
+        self.file_path: str = file_path
+        self.block_size: int = block_size
+        self.row_filter: Optional[RowFilter] = row_filter
+        self.row_parser: LogFileParser = LogFileParser(file_path, resource_list, completeness_list, accession_pattern_list,
+                                                       row_filter=row_filter)
+        self.RESOURCE_IDENTIFIERS: List[str] = resource_list
+        self.completeness: pa.Array = pa.array(sorted(self.row_parser.completeness), type=pa.string())
+        accession_regex = self.row_parser.path_matcher.accession_regex
+        self.accession_pattern: str = f"(?P<accession>{accession_regex.pattern})" if accession_regex else ""
+        try:
+            # Arrow uses RE2, which does not support every Python regex construct
+            pc.extract_regex(pa.array([""], type=pa.string()), pattern=self.accession_pattern or "(?P<accession>)")
+        except pa.ArrowInvalid as e:
+            raise ValidationError(
+                f"Accession pattern is not supported by the arrow engine: {self.accession_pattern}",
+                field="accession_pattern_list",
+                value=accession_pattern_list,
+                original_error=str(e)
+            )
+        self._fallback_rows: List[Dict[str, Any]] = []
+
+    def _handle_invalid_row(self, invalid_row: pacsv.InvalidRow) -> str:
+        """
+        Route rows with an unexpected column count through the row parser and skip them in the Arrow reader.
+        """
+        line = invalid_row.text.replace('\\t', '\t')
+        parsed_line = self.row_parser.parse_row(line.strip().split('\t'), invalid_row.number or 0)
+        if parsed_line:
+            self._fallback_rows.append(parsed_line)
+        return 'skip'
+
+    def _open_reader(self) -> pacsv.CSVStreamingReader:
+        read_options = pacsv.ReadOptions(column_names=self.COLUMN_NAMES, block_size=self.block_size)
+        parse_options = pacsv.ParseOptions(
+            delimiter='\t',
+            quote_char=False,
+            double_quote=False,
+            escape_char=False,
+            invalid_row_handler=self._handle_invalid_row
+        )
+        convert_options = pacsv.ConvertOptions(
+            column_types={name: pa.string() for name in self.COLUMN_NAMES},
+            include_columns=self.USED_COLUMNS,
+            strings_can_be_null=False,
+            quoted_strings_can_be_null=False
+        )
+        stream = pa.input_stream(self.file_path, compression='gzip')
+        return pacsv.open_csv(stream, read_options=read_options, parse_options=parse_options,
+                              convert_options=convert_options)
+
+    @staticmethod
+    def clean_geoip_values(values: pa.Array) -> pa.Array:
+        """
+        Vectorized LogFileParser.clean_geoip_value: trims values and blanks placeholders like {geoip_region_name}.
+        """
+        trimmed = pc.utf8_trim_whitespace(values)
+        is_placeholder = pc.match_substring_regex(trimmed, pattern=r"^%?\{.*\}$")
+        return pc.if_else(is_placeholder, "", trimmed)
+
+    def parse_batch(self, batch: pa.RecordBatch) -> pa.RecordBatch:
+        """
+        Filter the relevant rows of a raw block and derive the output columns.
+        :param batch: Record batch with the raw log columns as strings
+        :return: Record batch in ParquetWriter.schema
+        """
+        if not self.RESOURCE_IDENTIFIERS:
+            # No path belongs to the resource, as with the row parser
+            return pa.RecordBatch.from_pylist([], schema=ParquetWriter.schema)
+        path = batch.column("path")
+
+        # Resource identifiers
+        mask = pc.starts_with(path, pattern=self.RESOURCE_IDENTIFIERS[0])
+        for identifier in self.RESOURCE_IDENTIFIERS[1:]:
+            mask = pc.or_(mask, pc.starts_with(path, pattern=identifier))
+
+        # Filename cannot be null
+        filename = pc.replace_substring_regex(path, pattern=r"^.*/", replacement="", max_replacements=1)
+        mask = pc.and_(mask, pc.and_(pc.match_substring(path, pattern="/"), pc.not_equal(filename, "")))
+
+        # Completeness
+        completed = pc.utf8_lower(pc.utf8_trim_whitespace(batch.column("completed")))
+        mask = pc.and_(mask, pc.is_in(completed, value_set=self.completeness))
+
+        # Accession
+        if self.accession_pattern:
+            accession = pc.struct_field(pc.extract_regex(path, pattern=self.accession_pattern), [0])
+        else:
+            accession = pa.nulls(len(batch), type=pa.string())
+        mask = pc.and_(mask, pc.is_valid(accession))
+
+        # Rows with malformed timestamps, or outside the date window and accession sets, are dropped
+        timestamp = pc.utf8_trim_whitespace(batch.column("timestamp"))
+        mask = pc.fill_null(mask, False)
+        timestamp = pc.filter(timestamp, mask)
+        date, year, month = TimestampDecoder.decode_column(timestamp)
+        valid = pc.is_valid(date)
+        kept = self.row_filter.mask(pc.filter(accession, mask), year, month) if self.row_filter is not None else None
+        if kept is not None:
+            valid = pc.fill_null(pc.and_(valid, kept), False)
+        if valid.false_count:
+            mask = pc.replace_with_mask(mask, mask, valid)
+            timestamp, date, year, month = (pc.filter(column, valid) for column in (timestamp, date, year, month))
+
+        columns = {
+            "date": date,
+            "year": year,
+            "month": month,
+            "user": pc.utf8_trim_whitespace(pc.filter(batch.column("user"), mask)),
+            "accession": pc.filter(accession, mask),
+            "filename": pc.filter(filename, mask),
+            "completed": pc.filter(completed, mask),
+            "country": pc.filter(batch.column("country"), mask),
+            "method": pc.filter(batch.column("method"), mask),
+            "timestamp": timestamp,
+            "geoip_region_name": self.clean_geoip_values(pc.filter(batch.column("geoip_region_name"), mask)),
+            "geoip_city_name": self.clean_geoip_values(pc.filter(batch.column("geoip_city_name"), mask)),
+            "geo_location": pc.utf8_trim_whitespace(pc.filter(batch.column("geo_location"), mask)),
+        }
+        return pa.RecordBatch.from_arrays(
+            [columns[field.name] for field in ParquetWriter.schema],
+            schema=ParquetWriter.schema
+        )
+
+    def _drain_fallback_rows(self) -> Iterator[pa.RecordBatch]:
+        if self._fallback_rows:
+            rows, self._fallback_rows = self._fallback_rows, []
+            yield pa.RecordBatch.from_pylist(rows, schema=ParquetWriter.schema)
+
+    def parse_record_batches(self) -> Iterator[pa.RecordBatch]:
+        """
+        Read the gzipped TSV file block by block and yield the relevant rows as record batches.
+        :return: Generator that yields record batches in ParquetWriter.schema
+        """
+        try:
+            reader = self._open_reader()
+            for raw_batch in reader:
+                parsed_batch = self.parse_batch(raw_batch)
+                if parsed_batch.num_rows:
+                    yield parsed_batch
+                yield from self._drain_fallback_rows()
+            yield from self._drain_fallback_rows()
+        except (OSError, pa.ArrowInvalid) as e:
+            logger.warning("Skipping corrupted file", extra={"file_path": self.file_path, "error": str(e)})
@@ -9,9 +9,13 @@ Classifies download traffic into three categories:
 import logging
 import os
 
+import pyarrow.parquet as pq
 from deeplogbot import run_bot_annotator
 
 from exceptions import BotClassificationError
+from parquet_dataset import is_partitioned
+from parquet_reader import ParquetReader
+from parquet_schema import schema_version
 
 logger = logging.getLogger(__name__)
 
@@ -19,6 +23,9 @@ logger = logging.getLogger(__name__)
 class BotClassifier:
     """Wraps DeepLogBot to classify download traffic in parquet files."""
 
+    COMPATIBLE_INPUT_NAME = "classifier_input_v1.parquet"
+    CONVERSION_BATCH_SIZE = 1000000
+
     def __init__(
         self,
         method: str = "rules",
@@ -29,6 +36,28 @@ class BotClassifier:
         self.contamination = contamination
         self.provider = provider
 
+    def _compatible_input(self, input_parquet: str, output_dir: str) -> str:
+        """
+        DeepLogBot reads a single file with the version 1 columns; a file in the compact schema (version 2) or a
+        partitioned dataset directory is converted first.
+        """
+        if not is_partitioned(input_parquet) and schema_version(pq.read_schema(input_parquet)) == 1:
+            return input_parquet
+
+        converted_parquet = os.path.join(output_dir, self.COMPATIBLE_INPUT_NAME)
+        logger.info("Converting compact schema parquet for bot classification",
+                    extra={"input_parquet": input_parquet, "converted_parquet": converted_parquet})
+        writer = None
+        try:
+            for batch in ParquetReader.iter_batches(input_parquet, self.CONVERSION_BATCH_SIZE):
+                if writer is None:
+                    writer = pq.ParquetWriter(converted_parquet, batch.schema)
+                writer.write_batch(batch)
+        finally:
+            if writer is not None:
+                writer.close()
+        return converted_parquet
+
     def classify(
         self,
         input_parquet: str,
@@ -70,7 +99,7 @@ class BotClassifier:
             )
 
             result_stats = run_bot_annotator(
-                input_parquet=input_parquet,
+                input_parquet=self._compatible_input(input_parquet, output_dir),
                 output_dir=output_dir,
                 output_parquet=output_parquet,
                 classification_method=self.method,
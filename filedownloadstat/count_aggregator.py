@@ -0,0 +1,110 @@
+"""
+Incremental group-by counting on Arrow record batches.
+"""
+import logging
+from typing import List, Sequence, Union
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from parquet_schema import to_pandas
+
+logger = logging.getLogger(__name__)
+
+COUNT_COLUMN = "count"
+
+
+class CountAggregator:
+    """
+    Counts rows (and sums numeric or boolean columns) per group over a stream of record batches.
+    Every batch is aggregated with Arrow's hash aggregation. The partial aggregates are re-aggregated into
+    a running total once they outgrow it, so memory is proportional to the number of groups instead of
+    the number of batches.
+    """
+
+    # Partial aggregates buffered before they are merged into the running total
+    MAX_PENDING_PARTIALS = 16
+
+    def __init__(self, keys: Sequence[str], sum_columns: Sequence[str] = (), dropna: bool = True) -> None:
+        """
+        :param keys: Columns to group by
+        :param sum_columns: Columns summed per group (output column name: <column>_sum)
+        :param dropna: Drop rows with a null key (as a pandas groupby does); otherwise null is a group of its own
+        """
+        self.keys: List[str] = list(keys)
+        self.sum_columns: List[str] = list(sum_columns)
+        self.dropna: bool = dropna
+        self.total: Union[pa.Table, None] = None
+        self.pending: List[pa.Table] = []
+        self.pending_rows: int = 0
+
+    @property
+    def value_columns(self) -> List[str]:
+        return [COUNT_COLUMN] + [f"{column}_sum" for column in self.sum_columns]
+
+    def add(self, batch: Union[pa.RecordBatch, pa.Table]) -> None:
+        """
+        Aggregate a batch and buffer the partial result.
+        Rows with a null key are not counted unless dropna is False.
+        """
+        table = pa.Table.from_batches([batch]) if isinstance(batch, pa.RecordBatch) else batch
+        table = table.select(self.keys + self.sum_columns)
+        if self.dropna and any(table.column(key).null_count for key in self.keys):
+            valid = pc.is_valid(table.column(self.keys[0]))
+            for key in self.keys[1:]:
+                valid = pc.and_(valid, pc.is_valid(table.column(key)))
+            table = table.filter(valid)
+        if table.num_rows == 0:
+            return
+
+        partial = table.group_by(self.keys).aggregate(
+            [(self.keys[0], "count", pc.CountOptions(mode="all"))]
+            + [(column, "sum", pc.ScalarAggregateOptions(min_count=0)) for column in self.sum_columns]
+        )
+        partial = partial.rename_columns(
+            [COUNT_COLUMN if name == f"{self.keys[0]}_count" else name for name in partial.column_names]
+        )
+        self._buffer(partial.select(self.keys + self.value_columns))
+
+    def merge(self, other: "CountAggregator") -> None:
+        """
+        Add the counts of another aggregator over the same columns (eg: one filled by another worker).
+        """
+        other._merge_pending()
+        if other.total is not None:
+            self._buffer(other.total)
+
+    def _buffer(self, partial: pa.Table) -> None:
+        self.pending.append(partial)
+        self.pending_rows += partial.num_rows
+        total_rows = self.total.num_rows if self.total is not None else 0
+        if len(self.pending) >= self.MAX_PENDING_PARTIALS or self.pending_rows > total_rows:
+            self._merge_pending()
+
+    def _merge_pending(self) -> None:
+        """
+        Re-aggregate the running total with the buffered partial aggregates.
+        """
+        if not self.pending:
+            return
+        tables = ([self.total] if self.total is not None else []) + self.pending
+        merged = pa.concat_tables(tables).group_by(self.keys).aggregate(
+            [(column, "sum") for column in self.value_columns]
+        )
+        summed = {f"{column}_sum": column for column in self.value_columns}
+        self.total = merged.rename_columns([summed.get(name, name) for name in merged.column_names])
+        self.total = self.total.select(self.keys + self.value_columns)
+        self.pending = []
+        self.pending_rows = 0
+
+    def result(self) -> pd.DataFrame:
+        """
+        Final aggregate, sorted by the keys (the order of a pandas groupby).
+        The sort is done in pandas, which orders multiple string keys faster than Arrow's sort_by.
+        :return: DataFrame with the key columns, count and the <column>_sum columns
+        """
+        self._merge_pending()
+        if self.total is None:
+            return pd.DataFrame(columns=self.keys + self.value_columns)
+        return to_pandas(self.total).sort_values(self.keys, ignore_index=True)
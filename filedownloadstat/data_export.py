@@ -0,0 +1,289 @@
+"""
+Export of the analyzed download records (all_data).
+
+Formats:
+- json: a single JSON array (the original all_data.json layout)
+- ndjson: one JSON object per line, so the export can be streamed and split
+- parquet: the record batches written as they are read
+
+Text formats can be gzip or zstd compressed, and every format can be split into one file per year.
+JSON is encoded with Arrow compute kernels for a whole batch at a time, which avoids converting the rows to
+pandas or Python objects.
+"""
+import json
+import logging
+import os
+from typing import Dict, List, Optional, Union
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from exceptions import ValidationError
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = ("json", "ndjson", "parquet")
+EXPORT_COMPRESSIONS = ("none", "gzip", "zstd")
+
+FILE_EXTENSIONS = {"json": ".json", "ndjson": ".ndjson", "parquet": ".parquet"}
+COMPRESSION_EXTENSIONS = {"none": "", "gzip": ".gz", "zstd": ".zst"}
+
+# Characters that have to be escaped in a JSON string
+JSON_ESCAPE_PATTERN = '[\\\\"\\x00-\\x1f]'
+# Strings that pandas to_json writes unchanged apart from escaping '/': printable ASCII without '"' and '\'
+PANDAS_PLAIN_STRING_PATTERN = '^[\\x20\\x21\\x23-\\x5b\\x5d-\\x7e]*$'
+
+
+def _json_string_values(array: pa.Array) -> pa.Array:
+    """
+    Quote and escape string values.
+    """
+    if pc.any(pc.match_substring_regex(array, JSON_ESCAPE_PATTERN)).as_py():
+        array = pc.replace_substring(array, "\\", "\\\\")
+        array = pc.replace_substring(array, '"', '\\"')
+        for code in range(0x20):
+            character = chr(code)
+            if pc.any(pc.match_substring(array, character)).as_py():
+                array = pc.replace_substring(array, character, json.dumps(character)[1:-1])
+    return pc.binary_join_element_wise('"', array, '"', "")
+
+
+def _json_values(array: pa.Array) -> Optional[pa.Array]:
+    """
+    JSON text of every value of a column, or None if the column type is not supported.
+    Dates are written as epoch milliseconds, as pandas to_json did.
+    """
+    data_type = array.type
+    if pa.types.is_dictionary(data_type):
+        array = pc.cast(array, data_type.value_type)
+        data_type = array.type
+    if pa.types.is_string(data_type) or pa.types.is_large_string(data_type):
+        values = _json_string_values(array)
+    elif pa.types.is_boolean(data_type):
+        values = pc.if_else(array, "true", "false")
+    elif pa.types.is_date(data_type):
+        values = pc.cast(pc.cast(pc.cast(array, pa.date64()), pa.int64()), pa.string())
+    elif pa.types.is_integer(data_type):
+        values = pc.cast(array, pa.string())
+    elif pa.types.is_floating(data_type):
+        # NaN and infinity are not valid JSON
+        finite = pc.is_finite(array)
+        values = pc.if_else(finite, pc.cast(array, pa.string()), pa.scalar(None, pa.string()))
+    else:
+        return None
+    return pc.fill_null(values, "null")
+
+
+def pandas_json_values(array: Union[pa.Array, pa.ChunkedArray]) -> Optional[pa.Array]:
+    """
+    JSON text of every value of a string or integer column, byte for byte as pandas to_json writes it.
+    :return: None if the column has another type or strings that pandas escapes (non-ASCII, quotes,
+    backslashes or control characters); the caller then falls back to pandas
+    """
+    if isinstance(array, pa.ChunkedArray):
+        array = array.combine_chunks()
+    data_type = array.type
+    if pa.types.is_string(data_type) or pa.types.is_large_string(data_type):
+        # Arrow-backed pandas strings are large strings: the JSON text is built as strings like the other columns
+        array = array.cast(pa.string())
+        if pc.any(pc.invert(pc.match_substring_regex(array, PANDAS_PLAIN_STRING_PATTERN))).as_py():
+            return None
+        values = pc.binary_join_element_wise('"', pc.replace_substring(array, "/", "\\/"), '"', "")
+    elif pa.types.is_integer(data_type):
+        values = pc.cast(array, pa.string())
+    else:
+        return None
+    return pc.fill_null(values, "null")
+
+
+def json_objects(names: List[str], values: List[pa.Array], prefix: str = "", suffix: str = "") -> pa.Array:
+    """
+    Join JSON values into one JSON object per row.
+    :param names: Member names
+    :param values: JSON text of the members (eg: from pandas_json_values)
+    :param prefix: Text before every object
+    :param suffix: Text after every object
+    """
+    parts = []
+    for index, (name, value) in enumerate(zip(names, values)):
+        parts.append(("{" if index == 0 else ",") + json.dumps(name) + ":")
+        parts.append(value)
+    parts[0] = prefix + parts[0]
+    parts.append("}" + suffix)
+    return pc.binary_join_element_wise(*parts, "")
+
+
+def string_data(array: pa.Array) -> pa.Buffer:
+    """
+    The concatenated values of a string array, without copying them (they are contiguous in its data buffer).
+    """
+    if len(array) == 0:
+        return pa.py_buffer(b"")
+    offset_type = np.int64 if pa.types.is_large_string(array.type) else np.int32
+    offsets = np.frombuffer(array.buffers()[1], dtype=offset_type)[array.offset:array.offset + len(array) + 1]
+    return array.buffers()[2].slice(int(offsets[0]), int(offsets[-1] - offsets[0]))
+
+
+def write_json_array(elements: pa.Array, output_file: str) -> None:
+    """
+    Write JSON elements (eg: from json_objects) as a single JSON array without whitespace.
+    """
+    with open(output_file, "wb") as f:
+        f.write(b"[")
+        if len(elements):
+            # No separator before the first element
+            f.write(string_data(pc.binary_join_element_wise(",", elements, "")).slice(1))
+        f.write(b"]")
+
+
+def encode_json_rows(batch: pa.RecordBatch, prefix: str = "", suffix: str = "\n") -> pa.Buffer:
+    """
+    Encode the rows of a record batch as JSON objects.
+    :param prefix: Text written before every row (eg: "," between the elements of an array)
+    :param suffix: Text written after every row (eg: "\\n" for NDJSON)
+    :return: Buffer with the encoded rows
+    """
+    if batch.num_rows == 0:
+        return pa.py_buffer(b"")
+
+    values = [_json_values(column) for column in batch.columns]
+    if any(value is None for value in values):
+        # Unsupported column type: encode the batch row by row
+        rows = (prefix + json.dumps(row, default=str, ensure_ascii=False) + suffix for row in batch.to_pylist())
+        return pa.py_buffer("".join(rows).encode("utf-8"))
+    return string_data(json_objects(batch.schema.names, values, prefix, suffix))
+
+
+class _ExportFile:
+    """
+    A single output file of the export.
+    """
+
+    def __init__(self, path: str, export_format: str, compression: str, schema: pa.Schema) -> None:
+        self.path: str = path
+        self.export_format: str = export_format
+        self.record_count: int = 0
+        self.parquet_writer: Optional[pq.ParquetWriter] = None
+        self.stream: Optional[pa.NativeFile] = None
+        if export_format == "parquet":
+            codec = "snappy" if compression == "none" else compression
+            self.parquet_writer = pq.ParquetWriter(path, schema, compression=codec)
+        else:
+            self.stream = pa.output_stream(path, compression=None if compression == "none" else compression)
+            if export_format == "json":
+                self.stream.write(b"[")
+
+    def write(self, batch: pa.RecordBatch) -> None:
+        if batch.num_rows == 0:
+            return
+        if self.parquet_writer is not None:
+            self.parquet_writer.write_batch(batch)
+        elif self.export_format == "json":
+            data = encode_json_rows(batch, prefix=",", suffix="")
+            # No separator before the first element of the array
+            self.stream.write(data.slice(1) if self.record_count == 0 else data)
+        else:
+            self.stream.write(encode_json_rows(batch))
+        self.record_count += batch.num_rows
+
+    def close(self) -> None:
+        if self.parquet_writer is not None:
+            self.parquet_writer.close()
+        else:
+            if self.export_format == "json":
+                self.stream.write(b"]")
+            self.stream.close()
+
+
+class DataExporter:
+    """
+    Streams record batches to the all_data export, optionally split into one file per year.
+    """
+
+    def __init__(
+        self,
+        output_path: str,
+        export_format: str = "json",
+        compression: str = "none",
+        split_by_year: bool = False
+    ) -> None:
+        """
+        :param output_path: Output file, or the output directory when split_by_year is set
+        (files are named <year><extension>, eg: 2024.ndjson.gz)
+        :param export_format: One of EXPORT_FORMATS
+        :param compression: One of EXPORT_COMPRESSIONS (the Parquet compression codec for the parquet format)
+        :param split_by_year: Write one file per year of the 'year' column
+        """
+        if export_format not in EXPORT_FORMATS:
+            raise ValidationError(f"export_format must be one of {EXPORT_FORMATS}, got: {export_format}",
+                                  field="export_format", value=export_format)
+        if compression not in EXPORT_COMPRESSIONS:
+            raise ValidationError(f"compression must be one of {EXPORT_COMPRESSIONS}, got: {compression}",
+                                  field="compression", value=compression)
+        self.output_path: str = output_path
+        self.export_format: str = export_format
+        self.compression: str = compression
+        self.split_by_year: bool = split_by_year
+        self.files: Dict[Union[int, None], _ExportFile] = {}
+        self.schema: Optional[pa.Schema] = None
+        if split_by_year:
+            os.makedirs(output_path, exist_ok=True)
+
+    @property
+    def extension(self) -> str:
+        compression = "" if self.export_format == "parquet" else COMPRESSION_EXTENSIONS[self.compression]
+        return FILE_EXTENSIONS[self.export_format] + compression
+
+    def _file(self, year: Optional[int]) -> _ExportFile:
+        export_file = self.files.get(year)
+        if export_file is None:
+            path = os.path.join(self.output_path, f"{year}{self.extension}") if self.split_by_year else self.output_path
+            export_file = _ExportFile(path, self.export_format, self.compression, self.schema)
+            self.files[year] = export_file
+        return export_file
+
+    def write(self, batch: pa.RecordBatch) -> None:
+        """
+        Append a record batch to the export.
+        """
+        if self.schema is None:
+            self.schema = batch.schema
+        if not self.split_by_year:
+            self._file(None).write(batch)
+            return
+
+        years = batch.column(batch.schema.get_field_index("year"))
+        for year in pc.unique(years).to_pylist():
+            mask = pc.is_null(years) if year is None else pc.equal(years, year)
+            self._file(year).write(batch.filter(mask))
+
+    def close(self) -> int:
+        """
+        Close the export files.
+        An export without records still produces its (empty) output file.
+        :return: Number of records written
+        """
+        if not self.files and not self.split_by_year:
+            if self.schema is None and self.export_format == "parquet":
+                self.schema = pa.schema([])
+            self._file(None)
+        record_count = 0
+        for export_file in self.files.values():
+            export_file.close()
+            record_count += export_file.record_count
+        logger.info("All data exported", extra={
+            "output_path": self.output_path,
+            "format": self.export_format,
+            "compression": self.compression,
+            "file_count": len(self.files),
+            "record_count": record_count,
+        })
+        return record_count
+
+    def __enter__(self) -> "DataExporter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
@@ -0,0 +1,100 @@
+import logging
+import os
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, FIRST_COMPLETED, wait
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ScannedFile:
+    """A log file found by the scanner, with its size and modification time (one stat call per file)."""
+    path: str
+    name: str
+    size: int
+    mtime_ns: int
+    root: str  # Root directory the file was found under
+
+
+class DirectoryScanner:
+    """
+    Concurrent directory walk built on os.scandir.
+    Every directory is listed by a worker thread and its subdirectories are fed back to the pool, so the
+    latency of a network file system is overlapped across directories instead of paid one call at a time.
+    """
+
+    DEFAULT_WORKERS = 8
+
+    def __init__(self, suffix: str = ".tsv.gz", workers: int = DEFAULT_WORKERS) -> None:
+        """
+        :param suffix: File name suffix of the files to collect
+        :param workers: Number of threads listing directories concurrently
+        """
+        self.suffix: str = suffix
+        self.workers: int = max(1, int(workers))
+
+    def _scan_directory(self, directory: str, root: str) -> Tuple[List[ScannedFile], List[str]]:
+        """
+        List a single directory.
+        :param root: Root directory the walk started from
+        :return: (matching files, subdirectories)
+        """
+        files: List[ScannedFile] = []
+        subdirectories: List[str] = []
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirectories.append(entry.path)
+                        elif entry.name.endswith(self.suffix) and entry.is_file():
+                            # is_dir/is_file use the type of the directory entry, but stat() is a stat call
+                            # per file on POSIX (only Windows returns it from the listing)
+                            stat = entry.stat()
+                            files.append(ScannedFile(entry.path, entry.name, stat.st_size, stat.st_mtime_ns, root))
+                    except OSError as e:
+                        logger.warning("Skipping unreadable directory entry", extra={"path": entry.path, "error": str(e)})
+        except FileNotFoundError:
+            logger.warning("Directory not found", extra={"directory": directory})
+        except OSError as e:
+            logger.warning("Skipping unreadable directory", extra={"directory": directory, "error": str(e)})
+        return files, subdirectories
+
+    def scan(self, root_directories: List[str]) -> List[ScannedFile]:
+        """
+        Walk all root directories concurrently.
+        :param root_directories: Directories to walk (eg: one per protocol and public/private folder)
+        :return: Matching files, grouped by root directory in the given order and sorted by path within a root
+        """
+        start_time = time.monotonic()
+        found: List[ScannedFile] = []
+        directory_count = 0
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="scandir") as executor:
+            # Future -> root directory of the listed directory
+            pending: Dict[Future, str] = {
+                executor.submit(self._scan_directory, directory, directory): directory for directory in root_directories
+            }
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    root = pending.pop(future)
+                    files, subdirectories = future.result()
+                    directory_count += 1
+                    found.extend(files)
+                    for subdirectory in subdirectories:
+                        pending[executor.submit(self._scan_directory, subdirectory, root)] = root
+
+        elapsed = time.monotonic() - start_time
+        logger.info("Directory scan completed", extra={
+            "root_directories": len(root_directories),
+            "directories_scanned": directory_count,
+            "file_count": len(found),
+            "elapsed_seconds": round(elapsed, 3),
+            "directories_per_second": round(directory_count / elapsed, 1) if elapsed > 0 else None,
+            "files_per_second": round(len(found) / elapsed, 1) if elapsed > 0 else None,
+        })
+        root_order = {root: index for index, root in enumerate(root_directories)}
+        found.sort(key=lambda scanned_file: (root_order[scanned_file.root], scanned_file.path))
+        return found
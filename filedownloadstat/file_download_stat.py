@@ -3,11 +3,17 @@ import re
 import click
 from typing import Optional
 
+from data_export import EXPORT_COMPRESSIONS, EXPORT_FORMATS
+from directory_scanner import DirectoryScanner
+from gzip_reader import PipelinedGzipReader
+from ingestion_manifest import IngestionManifest
 from log_file_analyzer import LogFileAnalyzer
+from log_file_parser import RowFilter
 from log_file_util import FileUtil
 from parquet_analyzer import ParquetAnalyzer
 from parquet_reader import ParquetReader
-from report_stat import ReportStat
+from parquet_writer import ParquetWriter
+from report_stat import DEFAULT_PARTITION_SIZE, DEFAULT_SCHEDULER, REPORT_SCHEDULERS, ReportStat
 
 
 @click.command("get_log_files",
@@ -38,14 +44,85 @@ from report_stat import ReportStat
     required=True,
     type=str
 )
-def get_log_files(root_dir: str, output: str, protocols: str, public: str) -> str:
+@click.option(
+    "-s",
+    "--store_dir",
+    help="Parquet store of a previous run; log files already ingested and unchanged are not listed",
+    required=False,
+    default=None,
+)
+@click.option(
+    "--content_hash",
+    help="Compare content hashes of log files whose modification time changed",
+    is_flag=True,
+    default=False,
+)
+@click.option(
+    "-w",
+    "--scan_workers",
+    help="Number of threads listing directories concurrently",
+    required=False,
+    default=DirectoryScanner.DEFAULT_WORKERS,
+    type=int
+)
+def get_log_files(root_dir: str, output: str, protocols: str, public: str, store_dir: str, content_hash: bool,
+                  scan_workers: int) -> str:
     protocol_list = protocols.split(",")
     public_list = public.split(",")
     fileutil = FileUtil()
-    file_paths_list = fileutil.process_access_methods(root_dir, output, protocol_list, public_list)
+    manifest = IngestionManifest(store_dir, use_content_hash=content_hash) if store_dir else None
+    file_paths_list = fileutil.process_access_methods(root_dir, output, protocol_list, public_list, manifest=manifest,
+                                                      scan_workers=scan_workers)
     return file_paths_list
 
 
+@click.command("plan_work_units",
+               short_help="Group log files into work units of similar size", )
+@click.option(
+    "-f",
+    "--file_list",
+    help="Log file manifest written by get_log_files",
+    required=True,
+)
+@click.option(
+    "-o",
+    "--output",
+    help="File to write one work unit per line (tab separated log file paths)",
+    required=True,
+)
+@click.option(
+    "-t",
+    "--target_bytes",
+    help="Target compressed bytes of log files per work unit",
+    required=False,
+    default=512 * 1024 * 1024,
+    type=int
+)
+def plan_work_units(file_list: str, output: str, target_bytes: int) -> None:
+    FileUtil.plan_work_units(file_list, output, target_bytes)
+
+
+def _row_filter(
+    skipped_years: Optional[str],
+    from_month: Optional[str],
+    to_month: Optional[str],
+    accession_allowlist: Optional[str],
+    accession_denylist: Optional[str]
+) -> Optional[RowFilter]:
+    """
+    Parse-time row filter of the process_log_file(s) options, None if no option is set.
+    """
+    if not (skipped_years or from_month or to_month or accession_allowlist or accession_denylist):
+        return None
+    return RowFilter(
+        skipped_years=list(map(int, skipped_years.split(","))) if skipped_years else None,
+        from_month=from_month,
+        to_month=to_month,
+        accession_allowlist=RowFilter.read_accession_list(accession_allowlist) if accession_allowlist else None,
+        accession_denylist=RowFilter.read_accession_list(accession_denylist) if accession_denylist else None,
+    )
+
+
 @click.command("process_log_file",
                short_help="process log_file", )
 @click.option(
@@ -79,6 +156,7 @@ def get_log_files(root_dir: str, output: str, protocols: str, public: str) -> st
     "--batch",
     help="Batch size of the TVS file to read",
     required=False,
+    default=FileUtil.DEFAULT_BATCH_SIZE,
     type=int
 )
 @click.option(
@@ -88,19 +166,297 @@ def get_log_files(root_dir: str, output: str, protocols: str, public: str) -> st
     required=True,
     type=str
 )
+@click.option(
+    "-e",
+    "--engine",
+    help="Parse engine: 'row' (line by line) or 'arrow' (columnar, streams the file through the Arrow CSV reader)",
+    required=False,
+    default="row",
+    type=click.Choice(["row", "arrow"]),
+)
+@click.option(
+    "--pipelined",
+    help="Decompress the log file on a background thread while parsing (row engine)",
+    is_flag=True,
+    default=False,
+)
+@click.option(
+    "--read_chunk_size",
+    help="Compressed bytes inflated per chunk by the pipelined reader",
+    required=False,
+    default=PipelinedGzipReader.DEFAULT_CHUNK_SIZE,
+    type=int
+)
+@click.option(
+    "--read_queue_depth",
+    help="Maximum number of decompressed chunks buffered by the pipelined reader",
+    required=False,
+    default=PipelinedGzipReader.DEFAULT_QUEUE_DEPTH,
+    type=int
+)
+@click.option(
+    "--row_group_rows",
+    help="Target number of rows per Parquet row group (independent of the parse batch size)",
+    required=False,
+    default=ParquetWriter.DEFAULT_ROW_GROUP_ROWS,
+    type=int
+)
+@click.option(
+    "--row_group_bytes",
+    help="Target in-memory bytes per Parquet row group",
+    required=False,
+    default=ParquetWriter.DEFAULT_ROW_GROUP_BYTES,
+    type=int
+)
+@click.option(
+    "--schema_version",
+    help="Parquet schema version: 1 (original) or 2 (compact: typed timestamp, lat/lon, dictionary columns)",
+    required=False,
+    default=1,
+    type=click.IntRange(1, 2)
+)
+@click.option(
+    "--skipped_years",
+    help="Comma-separated years whose rows are dropped while parsing",
+    required=False,
+    type=str
+)
+@click.option(
+    "--from_month",
+    help="First month (YYYY-MM) whose rows are kept; log files dated before it are not read",
+    required=False,
+    type=str
+)
+@click.option(
+    "--to_month",
+    help="Last month (YYYY-MM) whose rows are kept; log files dated after it are not read",
+    required=False,
+    type=str
+)
+@click.option(
+    "--accession_allowlist",
+    help="File with the accessions to keep, one per line (default: all accessions)",
+    required=False,
+    type=str
+)
+@click.option(
+    "--accession_denylist",
+    help="File with the accessions to drop, one per line",
+    required=False,
+    type=str
+)
 def process_log_file(
     tsvfilepath: str,
     output_parquet: str,
     resource: str,
     complete: str,
     batch: int,
-    accession_pattern: str
+    accession_pattern: str,
+    engine: str,
+    pipelined: bool,
+    read_chunk_size: int,
+    read_queue_depth: int,
+    row_group_rows: int,
+    row_group_bytes: int,
+    schema_version: int,
+    skipped_years: Optional[str],
+    from_month: Optional[str],
+    to_month: Optional[str],
+    accession_allowlist: Optional[str],
+    accession_denylist: Optional[str]
 ) -> None:
     resource_list = resource.split(",")
     completeness_list = complete.split(",")
     accession_pattern_list = re.split(r',(?![^{}]*\})', accession_pattern)
+    parser_options = {
+        "pipelined": pipelined,
+        "read_chunk_size": read_chunk_size,
+        "read_queue_depth": read_queue_depth,
+    }
+    writer_options = {
+        "row_group_rows": row_group_rows,
+        "row_group_bytes": row_group_bytes,
+        "schema_version": schema_version,
+    }
     fileutil = FileUtil()
-    fileutil.process_log_file(tsvfilepath, output_parquet, resource_list, completeness_list, batch, accession_pattern_list)
+    fileutil.process_log_file(tsvfilepath, output_parquet, resource_list, completeness_list, batch, accession_pattern_list,
+                              engine=engine, parser_options=parser_options, writer_options=writer_options,
+                              row_filter=_row_filter(skipped_years, from_month, to_month,
+                                                     accession_allowlist, accession_denylist))
+
+
+@click.command("process_log_files",
+               short_help="process several log files in one task", )
+@click.option(
+    "-f",
+    "--file_list",
+    help="Text file with one log file path per line (the get_log_files output format is accepted)",
+    required=True,
+)
+@click.option(
+    "-o",
+    "--output_dir",
+    help="Directory to write one parquet file per log file",
+    required=True,
+)
+@click.option(
+    "-m",
+    "--combined_output",
+    help="Write a single combined parquet file instead of one per log file",
+    required=False,
+)
+@click.option(
+    "-r",
+    "--resource",
+    help="List of identifiers(paths) in file URIs to identify resources from(Eg: /pride/data/archive)",
+    required=True,
+    type=str
+)
+@click.option(
+    "-c",
+    "--complete",
+    help="File download status can be complete or incomplete",
+    required=True,
+    type=str
+)
+@click.option(
+    "-b",
+    "--batch",
+    help="Batch size of the TVS file to read",
+    required=False,
+    default=FileUtil.DEFAULT_BATCH_SIZE,
+    type=int
+)
+@click.option(
+    "-a",
+    "--accession_pattern",
+    help="Resource accession pattern as a regular expression(Eg: PRIDE accessions '^PXD\\d{6}$'",
+    required=True,
+    type=str
+)
+@click.option(
+    "-e",
+    "--engine",
+    help="Parse engine: 'row' (line by line) or 'arrow' (columnar, streams the file through the Arrow CSV reader)",
+    required=False,
+    default="row",
+    type=click.Choice(["row", "arrow"]),
+)
+@click.option(
+    "--pipelined",
+    help="Decompress each log file on a background thread while parsing (row engine)",
+    is_flag=True,
+    default=False,
+)
+@click.option(
+    "--read_chunk_size",
+    help="Compressed bytes inflated per chunk by the pipelined reader",
+    required=False,
+    default=PipelinedGzipReader.DEFAULT_CHUNK_SIZE,
+    type=int
+)
+@click.option(
+    "--read_queue_depth",
+    help="Maximum number of decompressed chunks buffered by the pipelined reader",
+    required=False,
+    default=PipelinedGzipReader.DEFAULT_QUEUE_DEPTH,
+    type=int
+)
+@click.option(
+    "-w",
+    "--workers",
+    help="Number of worker processes parsing log files in parallel",
+    required=False,
+    default=1,
+    type=int
+)
+@click.option(
+    "--row_group_rows",
+    help="Target number of rows per Parquet row group (independent of the parse batch size)",
+    required=False,
+    default=ParquetWriter.DEFAULT_ROW_GROUP_ROWS,
+    type=int
+)
+@click.option(
+    "--row_group_bytes",
+    help="Target in-memory bytes per Parquet row group",
+    required=False,
+    default=ParquetWriter.DEFAULT_ROW_GROUP_BYTES,
+    type=int
+)
+@click.option(
+    "--schema_version",
+    help="Parquet schema version: 1 (original) or 2 (compact: typed timestamp, lat/lon, dictionary columns)",
+    required=False,
+    default=1,
+    type=click.IntRange(1, 2)
+)
+@click.option(
+    "--skipped_years",
+    help="Comma-separated years whose rows are dropped while parsing",
+    required=False,
+    type=str
+)
+@click.option(
+    "--from_month",
+    help="First month (YYYY-MM) whose rows are kept; log files dated before it are not read",
+    required=False,
+    type=str
+)
+@click.option(
+    "--to_month",
+    help="Last month (YYYY-MM) whose rows are kept; log files dated after it are not read",
+    required=False,
+    type=str
+)
+@click.option(
+    "--accession_allowlist",
+    help="File with the accessions to keep, one per line (default: all accessions)",
+    required=False,
+    type=str
+)
+@click.option(
+    "--accession_denylist",
+    help="File with the accessions to drop, one per line",
+    required=False,
+    type=str
+)
+def process_log_files(
+    file_list: str,
+    output_dir: str,
+    combined_output: Optional[str],
+    resource: str,
+    complete: str,
+    batch: int,
+    accession_pattern: str,
+    engine: str,
+    pipelined: bool,
+    read_chunk_size: int,
+    read_queue_depth: int,
+    workers: int,
+    row_group_rows: int,
+    row_group_bytes: int,
+    schema_version: int,
+    skipped_years: Optional[str],
+    from_month: Optional[str],
+    to_month: Optional[str],
+    accession_allowlist: Optional[str],
+    accession_denylist: Optional[str]
+) -> None:
+    resource_list = resource.split(",")
+    completeness_list = complete.split(",")
+    accession_pattern_list = re.split(r',(?![^{}]*\})', accession_pattern)
+    fileutil = FileUtil()
+    fileutil.process_log_files(fileutil.read_log_file_list(file_list), output_dir, resource_list, completeness_list,
+                               batch, accession_pattern_list, engine=engine,
+                               parser_options={"pipelined": pipelined, "read_chunk_size": read_chunk_size,
+                                               "read_queue_depth": read_queue_depth},
+                               writer_options={"row_group_rows": row_group_rows, "row_group_bytes": row_group_bytes,
+                                               "schema_version": schema_version},
+                               workers=workers,
+                               combined_output=combined_output,
+                               row_filter=_row_filter(skipped_years, from_month, to_month,
+                                                      accession_allowlist, accession_denylist))
 
 
 @click.command("run_log_file_stat",
@@ -161,9 +517,51 @@ def read_parquet_files(file: str) -> None:
               "--profile",
               required=True,
               )
-def merge_parquet_files(input_dir: str, output_parquet: str, profile: str) -> None:
+@click.option("-s",
+              "--store_dir",
+              help="Incremental Parquet store; new files are added to it and the whole store is merged",
+              required=False,
+              default=None,
+              )
+@click.option("-l",
+              "--file_list",
+              help="Log file manifest written by get_log_files for this run",
+              required=False,
+              default=None,
+              )
+@click.option("--content_hash",
+              help="Record content hashes of the ingested log files",
+              is_flag=True,
+              default=False,
+              )
+@click.option("--partitioned",
+              help="Write the merged data as a directory partitioned by year and month",
+              is_flag=True,
+              default=False,
+              )
+@click.option("-w",
+              "--workers",
+              help="Number of input files read ahead concurrently",
+              default=ParquetAnalyzer.DEFAULT_MERGE_WORKERS,
+              type=int,
+              )
+@click.option("--row_group_rows",
+              help="Target number of rows per row group of the merged file",
+              default=ParquetWriter.DEFAULT_ROW_GROUP_ROWS,
+              type=int,
+              )
+@click.option("--row_group_bytes",
+              help="Target in-memory bytes per row group of the merged file",
+              default=ParquetWriter.DEFAULT_ROW_GROUP_BYTES,
+              type=int,
+              )
+def merge_parquet_files(input_dir: str, output_parquet: str, profile: str, store_dir: str, file_list: str,
+                        content_hash: bool, partitioned: bool, workers: int, row_group_rows: int,
+                        row_group_bytes: int) -> None:
     stat_parquet = ParquetAnalyzer()
-    stat_parquet.merge_parquet_files(input_dir, output_parquet)
+    stat_parquet.merge_parquet_files(input_dir, output_parquet, store_dir=store_dir, processed_file_list=file_list,
+                                     use_content_hash=content_hash, partitioned=partitioned, workers=workers,
+                                     row_group_rows=row_group_rows, row_group_bytes=row_group_bytes)
 
 
 @click.command(
@@ -192,20 +590,60 @@ def merge_parquet_files(input_dir: str, output_parquet: str, profile: str) -> No
               )
 @click.option("-a",
               "--all_data",
-              required=True,
+              help="all_data export of the records (not written when the input is an aggregate cube)",
+              required=False,
+              default=None,
               )
 @click.option("-p",
               "--profile",
               required=True,
               )
+@click.option("--from_month",
+              help="First month (YYYY-MM) to include",
+              required=False,
+              default=None,
+              )
+@click.option("--to_month",
+              help="Last month (YYYY-MM) to include",
+              required=False,
+              default=None,
+              )
+@click.option("-w",
+              "--workers",
+              help="Number of row groups analyzed concurrently (default: the available CPUs)",
+              required=False,
+              default=None,
+              type=int,
+              )
+@click.option("--all_data_format",
+              help="Export format of all_data: a JSON array, newline-delimited JSON or Parquet",
+              default="json",
+              type=click.Choice(EXPORT_FORMATS),
+              )
+@click.option("--all_data_compression",
+              help="Compression of the all_data export",
+              default="none",
+              type=click.Choice(EXPORT_COMPRESSIONS),
+              )
+@click.option("--all_data_split_by_year",
+              help="Export all_data as a directory with one file per year",
+              is_flag=True,
+              default=False,
+              )
 def analyze_parquet_files(
     output_parquet: str,
     project_level_download_counts: str,
     file_level_download_counts: str,
     project_level_yearly_download_counts: str,
     project_level_top_download_counts: str,
-    all_data: str,
-    profile: str
+    all_data: Optional[str],
+    profile: str,
+    from_month: Optional[str],
+    to_month: Optional[str],
+    workers: Optional[int],
+    all_data_format: str,
+    all_data_compression: str,
+    all_data_split_by_year: bool
 ) -> None:
     stat_parquet = ParquetAnalyzer()
     stat_parquet.analyze_parquet_files(
@@ -214,16 +652,149 @@ def analyze_parquet_files(
         file_level_download_counts,
         project_level_yearly_download_counts,
         project_level_top_download_counts,
-        all_data
+        all_data,
+        from_month=from_month,
+        to_month=to_month,
+        workers=workers,
+        all_data_format=all_data_format,
+        all_data_compression=all_data_compression,
+        all_data_split_by_year=all_data_split_by_year
+    )
+
+
+@click.command(
+    "build_cube",
+    short_help="Aggregate parquet files into a cube read by the analysis and the report",
+)
+@click.option("-m",
+              "--output_parquet",
+              required=True,
+              )
+@click.option("-c",
+              "--cube_dir",
+              help="Output directory of the aggregate cube",
+              required=True,
+              )
+@click.option("-a",
+              "--all_data",
+              help="all_data export of the records, written in the same pass",
+              required=False,
+              default=None,
+              )
+@click.option("-p",
+              "--profile",
+              required=True,
+              )
+@click.option("--from_month",
+              help="First month (YYYY-MM) to include",
+              required=False,
+              default=None,
+              )
+@click.option("--to_month",
+              help="Last month (YYYY-MM) to include",
+              required=False,
+              default=None,
+              )
+@click.option("-w",
+              "--workers",
+              help="Number of row groups aggregated concurrently (default: the available CPUs)",
+              required=False,
+              default=None,
+              type=int,
+              )
+@click.option("--all_data_format",
+              help="Export format of all_data: a JSON array, newline-delimited JSON or Parquet",
+              default="json",
+              type=click.Choice(EXPORT_FORMATS),
+              )
+@click.option("--all_data_compression",
+              help="Compression of the all_data export",
+              default="none",
+              type=click.Choice(EXPORT_COMPRESSIONS),
+              )
+@click.option("--all_data_split_by_year",
+              help="Export all_data as a directory with one file per year",
+              is_flag=True,
+              default=False,
+              )
+def build_cube(
+    output_parquet: str,
+    cube_dir: str,
+    all_data: Optional[str],
+    profile: str,
+    from_month: Optional[str],
+    to_month: Optional[str],
+    workers: Optional[int],
+    all_data_format: str,
+    all_data_compression: str,
+    all_data_split_by_year: bool
+) -> None:
+    stat_parquet = ParquetAnalyzer()
+    stat_parquet.build_cube(
+        output_parquet,
+        cube_dir,
+        all_data,
+        from_month=from_month,
+        to_month=to_month,
+        workers=workers,
+        all_data_format=all_data_format,
+        all_data_compression=all_data_compression,
+        all_data_split_by_year=all_data_split_by_year
     )
 
 
+@click.command(
+    "update_aggregate_store",
+    short_help="Fold new Parquet files into the day-partitioned aggregate store and write its cube",
+)
+@click.option("-f",
+              "--input_dir",
+              help="File listing the per-log Parquet files produced in this run",
+              required=True,
+              )
+@click.option("-s",
+              "--store_dir",
+              help="Incremental Parquet store the new files are added to",
+              required=True,
+              )
+@click.option("-g",
+              "--aggregate_store_dir",
+              help="Day-partitioned aggregate store",
+              required=True,
+              )
+@click.option("-c",
+              "--cube_dir",
+              help="Output directory of the aggregate cube",
+              required=True,
+              )
+@click.option("-p",
+              "--profile",
+              required=True,
+              )
+@click.option("-l",
+              "--file_list",
+              help="Log file manifest written by get_log_files for this run",
+              required=False,
+              default=None,
+              )
+@click.option("--content_hash",
+              help="Record content hashes of the ingested log files",
+              is_flag=True,
+              default=False,
+              )
+def update_aggregate_store(input_dir: str, store_dir: str, aggregate_store_dir: str, cube_dir: str, profile: str,
+                           file_list: Optional[str], content_hash: bool) -> None:
+    stat_parquet = ParquetAnalyzer()
+    stat_parquet.update_aggregate_store(input_dir, store_dir, aggregate_store_dir, cube_dir,
+                                        processed_file_list=file_list, use_content_hash=content_hash)
+
+
 @click.command("run_file_download_stat",
                short_help="Run File Down Statistics", )
 @click.option(
     "-f",
     "--file",
-    help="Parquet file containing file download stats",
+    help="Parquet file (or aggregate cube directory) containing file download stats",
     required=True,
     type=str
 )
@@ -268,6 +839,53 @@ def analyze_parquet_files(
     is_flag=True,
     default=False,
 )
+@click.option(
+    "--from_month",
+    help="First month (YYYY-MM) to include",
+    required=False,
+    type=str
+)
+@click.option(
+    "--to_month",
+    help="Last month (YYYY-MM) to include",
+    required=False,
+    type=str
+)
+@click.option(
+    "--scheduler",
+    help="Dask scheduler computing the report aggregates",
+    default=DEFAULT_SCHEDULER,
+    type=click.Choice(REPORT_SCHEDULERS)
+)
+@click.option(
+    "-w",
+    "--workers",
+    help="Number of Dask workers (default: the number of CPUs)",
+    required=False,
+    default=None,
+    type=int
+)
+@click.option(
+    "--partition_size",
+    help="Target size of a Dask partition of the Parquet input (eg: 64MiB), made of whole row groups",
+    required=False,
+    default=DEFAULT_PARTITION_SIZE,
+    type=str
+)
+@click.option(
+    "--row_groups_per_partition",
+    help="Number of Parquet row groups per Dask partition (overrides --partition_size)",
+    required=False,
+    default=None,
+    type=click.IntRange(min=1)
+)
+@click.option(
+    "--approximate_users",
+    help="Estimate the distinct users with HyperLogLog sketches instead of counting them exactly "
+         "(required for an aggregate cube input)",
+    is_flag=True,
+    default=False,
+)
 def run_file_download_stat(
     file: str,
     output: str,
@@ -275,14 +893,26 @@ def run_file_download_stat(
     baseurl: str,
     report_copy_filepath: str,
     skipped_years: Optional[str],
-    enable_bot_classification: bool
+    enable_bot_classification: bool,
+    from_month: Optional[str],
+    to_month: Optional[str],
+    scheduler: str,
+    workers: Optional[int],
+    partition_size: str,
+    row_groups_per_partition: Optional[int],
+    approximate_users: bool
 ) -> None:
     # Convert the comma-separated string to a list of integers
     skipped_years_list = list(map(int, skipped_years.split(","))) if skipped_years else []
 
     file_download_stat = ReportStat()
     file_download_stat.run_file_download_stat(file, output, report_template, baseurl, report_copy_filepath,
-                                              skipped_years_list, enable_bot_classification)
+                                              skipped_years_list, enable_bot_classification,
+                                              from_month=from_month, to_month=to_month,
+                                              scheduler=scheduler, workers=workers,
+                                              partition_size=partition_size,
+                                              row_groups_per_partition=row_groups_per_partition,
+                                              exact_users=not approximate_users)
 
 
 @click.command(
@@ -357,10 +987,14 @@ def main():
 # =============== Features Used ===============
 
 main.add_command(get_log_files)
+main.add_command(plan_work_units)
 main.add_command(run_log_file_stat)
 main.add_command(process_log_file)
+main.add_command(process_log_files)
 main.add_command(merge_parquet_files)
 main.add_command(analyze_parquet_files)
+main.add_command(build_cube)
+main.add_command(update_aggregate_store)
 main.add_command(run_file_download_stat)
 main.add_command(classify_bots)
 
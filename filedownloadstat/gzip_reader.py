@@ -0,0 +1,139 @@
+import gzip
+import logging
+import queue
+import threading
+import zlib
+from typing import Iterable, Iterator, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+
+class PipelinedGzipReader:
+    """
+    Read a gzipped file with decompression running on a background thread.
+    The background thread reads and inflates large chunks into a bounded queue (zlib releases the GIL),
+    while the consuming thread splits the chunks into lines and parses them. A decompressed chunk is at most
+    chunk_size bytes whatever the compression ratio, so at most queue_depth * chunk_size bytes are buffered.
+    """
+
+    DEFAULT_CHUNK_SIZE = 1024 * 1024
+    DEFAULT_QUEUE_DEPTH = 8
+    _END = object()
+
+    def __init__(
+        self,
+        file_path: str,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        queue_depth: int = DEFAULT_QUEUE_DEPTH
+    ) -> None:
+        """
+        :param file_path: Path to the gzipped file
+        :param chunk_size: Number of compressed bytes read, and maximum number of decompressed bytes, per chunk
+        :param queue_depth: Maximum number of decompressed chunks waiting to be consumed
+        """
+        self.file_path: str = file_path
+        self.chunk_size: int = int(chunk_size)
+        self.queue_depth: int = int(queue_depth)
+        self._queue: Optional[queue.Queue] = None
+        self._stop: threading.Event = threading.Event()
+
+    def _put(self, item: Union[bytes, BaseException, object]) -> bool:
+        """Put an item in the queue, giving up when the consumer has stopped."""
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _decompress(self) -> None:
+        """Background thread: read compressed chunks and inflate them, handling multi-member gzip files."""
+        try:
+            decompressor = zlib.decompressobj(wbits=zlib.MAX_WBITS | 16)
+            member_pending = False
+            with open(self.file_path, "rb") as compressed_file:
+                while not self._stop.is_set():
+                    data = compressed_file.read(self.chunk_size)
+                    if not data:
+                        break
+                    member_pending = True
+                    while True:
+                        chunk = decompressor.decompress(data, self.chunk_size)
+                        if chunk and not self._put(chunk):
+                            return
+                        if decompressor.eof:
+                            # Concatenated gzip members
+                            data = decompressor.unused_data
+                            decompressor = zlib.decompressobj(wbits=zlib.MAX_WBITS | 16)
+                            member_pending = bool(data)
+                            if not data:
+                                break
+                        else:
+                            data = decompressor.unconsumed_tail
+                            # A full chunk may leave output inside zlib: drain it before reading more input
+                            if not data and len(chunk) < self.chunk_size:
+                                break
+            if member_pending:
+                self._put(EOFError("Compressed file ended before the end-of-stream marker was reached"))
+            else:
+                self._put(self._END)
+        except zlib.error as e:
+            self._put(gzip.BadGzipFile(str(e)))
+        except BaseException as e:
+            self._put(e)
+
+    def iter_chunks(self) -> Iterator[bytes]:
+        """
+        Yield decompressed chunks in file order.
+        :return: Generator of decompressed byte chunks
+        """
+        self._queue = queue.Queue(maxsize=self.queue_depth)
+        self._stop.clear()
+        worker = threading.Thread(target=self._decompress, name="gzip-decompress", daemon=True)
+        worker.start()
+        try:
+            while True:
+                item = self._queue.get()
+                if item is self._END:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            self._stop.set()
+            worker.join()
+
+    def iter_lines(self) -> Iterator[bytes]:
+        """
+        Yield decompressed lines without the line terminator.
+        :return: Generator of byte lines
+        """
+        return split_lines(self.iter_chunks())
+
+
+def split_lines(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """
+    Split a stream of byte chunks into lines without the line terminator.
+    :param chunks: Byte chunks in file order
+    :return: Generator of byte lines
+    """
+    remainder = b""
+    for chunk in chunks:
+        lines = (remainder + chunk).split(b"\n")
+        remainder = lines.pop()
+        yield from lines
+    if remainder:
+        yield remainder
+
+
+def iter_gzip_lines(file_path: str, chunk_size: int = PipelinedGzipReader.DEFAULT_CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    Read a gzipped file in large decompressed chunks on the calling thread and yield its lines.
+    :param file_path: Path to the gzipped file
+    :param chunk_size: Number of decompressed bytes read per chunk
+    :return: Generator of byte lines without the line terminator
+    """
+    with gzip.open(file_path, "rb") as gzipped_file:
+        yield from split_lines(iter(lambda: gzipped_file.read(chunk_size), b""))
+
@@ -0,0 +1,238 @@
+"""
+Persistent ingestion manifest for incremental log processing.
+
+The manifest lives in the parquet store directory next to the per-log parquet files and records, for every
+ingested log file, its size, modification time, an optional content hash and the parquet file produced from it.
+Logs whose entry is still current are not parsed again; their stored parquet files are reused by the merge.
+The size and modification time of the logs listed for parsing are kept in a scan file until the merge records them.
+"""
+import hashlib
+import logging
+import os
+import shutil
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Mapping, Optional, Tuple
+
+import pyarrow.parquet as pq
+
+from exceptions import ConfigurationError
+
+logger = logging.getLogger(__name__)
+
+# (size, mtime_ns) of a log file as seen by the directory scan of get_log_files
+Fingerprint = Tuple[int, int]
+
+
+@dataclass
+class ManifestEntry:
+    """Ingestion state of a single log file."""
+    path: str
+    size: int
+    mtime_ns: int
+    content_hash: str = ""
+    parquet_file: str = ""  # File name inside the store directory, empty if the log had no relevant rows
+
+
+class IngestionManifest:
+    """
+    Manifest of the log files already converted to parquet in a store directory.
+    """
+
+    MANIFEST_NAME = "ingestion_manifest.tsv"
+    SCAN_NAME = "ingestion_scan.tsv"
+    SOURCE_METADATA_KEY = "source_log_file"
+    ROW_FILTER_METADATA_KEY = "row_filter"  # Set on per-log files parsed with parse-time filters
+    HEADER = "#path\tsize\tmtime_ns\tcontent_hash\tparquet_file\n"
+    SCAN_HEADER = "#path\tsize\tmtime_ns\n"
+    HASH_CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, store_dir: str, use_content_hash: bool = False) -> None:
+        """
+        :param store_dir: Directory holding the stored parquet files and the manifest
+        :param use_content_hash: Also compare a content hash, so logs whose mtime changed but content did not are skipped
+        """
+        if not store_dir:
+            raise ConfigurationError("store_dir is required for the ingestion manifest", config_key="store_dir")
+        self.store_dir: str = store_dir
+        self.manifest_path: str = os.path.join(store_dir, self.MANIFEST_NAME)
+        self.scan_path: str = os.path.join(store_dir, self.SCAN_NAME)
+        self.use_content_hash: bool = use_content_hash
+        self.entries: Dict[str, ManifestEntry] = {}
+        self.load()
+
+    def load(self) -> None:
+        """Load the manifest from the store directory, if it exists."""
+        self.entries = {}
+        if not os.path.exists(self.manifest_path):
+            return
+        with open(self.manifest_path, "r") as f:
+            for line in f:
+                if line.startswith("#") or not line.strip():
+                    continue
+                path, size, mtime_ns, content_hash, parquet_file = line.rstrip("\n").split("\t")
+                self.entries[path] = ManifestEntry(path, int(size), int(mtime_ns), content_hash, parquet_file)
+        logger.info("Ingestion manifest loaded", extra={"manifest": self.manifest_path, "entry_count": len(self.entries)})
+
+    def save(self) -> None:
+        """Atomically write the manifest to the store directory."""
+        os.makedirs(self.store_dir, exist_ok=True)
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.HEADER)
+            for entry in sorted(self.entries.values(), key=lambda e: e.path):
+                f.write(f"{entry.path}\t{entry.size}\t{entry.mtime_ns}\t{entry.content_hash}\t{entry.parquet_file}\n")
+        os.replace(tmp_path, self.manifest_path)
+        logger.info("Ingestion manifest saved", extra={"manifest": self.manifest_path, "entry_count": len(self.entries)})
+
+    def save_scan(self, fingerprints: Mapping[str, Fingerprint]) -> None:
+        """
+        Atomically write the size and mtime of the log files listed for parsing (see FileUtil.process_access_methods),
+        so the merge records the state the logs had when they were listed.
+        """
+        os.makedirs(self.store_dir, exist_ok=True)
+        tmp_path = self.scan_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.SCAN_HEADER)
+            for path, (size, mtime_ns) in fingerprints.items():
+                f.write(f"{path}\t{size}\t{mtime_ns}\n")
+        os.replace(tmp_path, self.scan_path)
+
+    def load_scan(self) -> Dict[str, Fingerprint]:
+        """Fingerprints written by save_scan, empty if there is no scan file."""
+        fingerprints: Dict[str, Fingerprint] = {}
+        if not os.path.exists(self.scan_path):
+            return fingerprints
+        with open(self.scan_path, "r") as f:
+            for line in f:
+                if line.startswith("#") or not line.strip():
+                    continue
+                path, size, mtime_ns = line.rstrip("\n").split("\t")
+                fingerprints[path] = (int(size), int(mtime_ns))
+        return fingerprints
+
+    @classmethod
+    def content_hash(cls, path: str) -> str:
+        """SHA-1 of the (compressed) log file."""
+        digest = hashlib.sha1()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(cls.HASH_CHUNK_SIZE), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def is_current(self, path: str, size: int, mtime_ns: int) -> bool:
+        """
+        Check whether a log file was already ingested and has not changed since.
+        :return: True if the log file can be skipped
+        """
+        entry = self.entries.get(path)
+        if entry is None or entry.size != size:
+            return False
+        if entry.parquet_file and not os.path.exists(os.path.join(self.store_dir, entry.parquet_file)):
+            return False
+        if entry.mtime_ns == mtime_ns:
+            return True
+        return self.use_content_hash and bool(entry.content_hash) and entry.content_hash == self.content_hash(path)
+
+    @staticmethod
+    def store_file_name(log_path: str) -> str:
+        """Deterministic parquet file name in the store for a log file path."""
+        name = os.path.basename(log_path)
+        for suffix in (".log.tsv.gz", ".tsv.gz"):
+            if name.endswith(suffix):
+                name = name[:-len(suffix)]
+                break
+        return f"{name}-{hashlib.sha1(log_path.encode('utf-8')).hexdigest()[:12]}.parquet"
+
+    @staticmethod
+    def _metadata_value(parquet_file: str, key: str) -> Optional[str]:
+        metadata = pq.read_schema(parquet_file).metadata or {}
+        value = metadata.get(key.encode("utf-8"))
+        return value.decode("utf-8") if value else None
+
+    @classmethod
+    def source_log_file(cls, parquet_file: str) -> Optional[str]:
+        """Log file a per-log parquet file was produced from, as recorded in its schema metadata."""
+        return cls._metadata_value(parquet_file, cls.SOURCE_METADATA_KEY)
+
+    @classmethod
+    def is_row_filtered(cls, parquet_file: str) -> bool:
+        """Whether a per-log parquet file was parsed with parse-time filters (see log_file_parser.RowFilter)."""
+        return cls._metadata_value(parquet_file, cls.ROW_FILTER_METADATA_KEY) is not None
+
+    def record(self, log_path: str, parquet_file: Optional[str], fingerprint: Optional[Fingerprint] = None) -> None:
+        """
+        Store the parquet file produced from a log file and record the log's state.
+        :param log_path: Path of the ingested log file
+        :param parquet_file: Parquet file produced from the log, or None if the log had no relevant rows
+        :param fingerprint: Size and mtime of the log when it was listed for parsing. A log modified after the
+        scan then no longer matches its entry and is parsed again by the next run. Without it the log's
+        current state is recorded.
+        """
+        if fingerprint is None:
+            stat = os.stat(log_path)
+            fingerprint = (stat.st_size, stat.st_mtime_ns)
+        size, mtime_ns = fingerprint
+        stored_name = ""
+        if parquet_file:
+            stored_name = self.store_file_name(log_path)
+            tmp_path = os.path.join(self.store_dir, stored_name + ".tmp")
+            shutil.copyfile(parquet_file, tmp_path)
+            os.replace(tmp_path, os.path.join(self.store_dir, stored_name))
+        else:
+            previous = self.entries.get(log_path)
+            if previous and previous.parquet_file:
+                # The log no longer has relevant rows, drop its stale parquet file
+                stale_path = os.path.join(self.store_dir, previous.parquet_file)
+                if os.path.exists(stale_path):
+                    os.remove(stale_path)
+        content_hash = self.content_hash(log_path) if self.use_content_hash else ""
+        self.entries[log_path] = ManifestEntry(log_path, size, mtime_ns, content_hash, stored_name)
+
+    def ingest(
+        self,
+        parquet_files: Iterable[str],
+        processed_log_files: Iterable[str] = (),
+        fingerprints: Optional[Mapping[str, Optional[Fingerprint]]] = None
+    ) -> List[str]:
+        """
+        Add newly produced per-log parquet files to the store and update the manifest.
+        :param parquet_files: Parquet files produced in this run (their source log is read from the schema metadata)
+        :param processed_log_files: Log files parsed in this run; the ones without a parquet file had no relevant rows
+        :param fingerprints: Size and mtime of the parsed log files at scan time (default: the scan file written by
+        save_scan; logs without one are recorded in their current state)
+        :return: All parquet files in the store that make up the dataset
+        """
+        parquet_files = list(parquet_files)
+        # A stored file is reused until its log changes, so rows dropped by the filters would never come back
+        filtered = [parquet_file for parquet_file in parquet_files if self.is_row_filtered(parquet_file)]
+        if filtered:
+            raise ConfigurationError(
+                f"Parquet files parsed with parse-time filters cannot be added to the parquet store: {filtered[0]}",
+                config_key="parse_time_filters",
+                filtered_count=len(filtered)
+            )
+        if fingerprints is None:
+            fingerprints = self.load_scan()
+        os.makedirs(self.store_dir, exist_ok=True)
+        ingested = set()
+        for parquet_file in parquet_files:
+            log_path = self.source_log_file(parquet_file)
+            if log_path is None or not os.path.exists(log_path):
+                logger.warning("Parquet file without a readable source log, not stored", extra={"parquet_file": parquet_file})
+                continue
+            self.record(log_path, parquet_file, fingerprints.get(log_path))
+            ingested.add(log_path)
+
+        for log_path in processed_log_files:
+            if log_path not in ingested and os.path.exists(log_path):
+                self.record(log_path, None, fingerprints.get(log_path))
+                ingested.add(log_path)
+
+        self.save()
+        logger.info("Parquet files ingested into the store", extra={"store_dir": self.store_dir, "ingested_count": len(ingested)})
+        return self.parquet_files()
+
+    def parquet_files(self) -> List[str]:
+        """All stored parquet files recorded in the manifest."""
+        stored = (os.path.join(self.store_dir, e.parquet_file) for e in self.entries.values() if e.parquet_file)
+        return sorted(p for p in stored if os.path.exists(p))
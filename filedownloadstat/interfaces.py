@@ -19,6 +19,12 @@ class ILogParser(ABC):
         """Parse a single row and return a dictionary or None."""
         pass
 
+    def parse_gzipped_tsv_columns(self, batch_size: int) -> Iterator[Dict[str, List[Any]]]:
+        """Parse gzipped TSV file and yield batches as dicts of column lists (built from parse_gzipped_tsv)."""
+        for batch in self.parse_gzipped_tsv(batch_size):
+            if batch:
+                yield {column: [row.get(column) for row in batch] for column in batch[0]}
+
 
 class IParquetWriter(ABC):
     """Interface for Parquet file writers."""
@@ -33,6 +39,14 @@ class IParquetWriter(ABC):
         """Write a batch of data to Parquet file."""
         pass
     
+    def write_columns(self, columns: Dict[str, List[Any]]) -> bool:
+        """Write a batch given as a dict of column lists (written row by row through write_batch)."""
+        return self.write_batch([dict(zip(columns, values)) for values in zip(*columns.values())])
+
+    def write_record_batch(self, batch: Any) -> bool:
+        """Write a pyarrow RecordBatch (written row by row through write_batch)."""
+        return self.write_batch(batch.to_pylist())
+    
     @abstractmethod
     def finalize(self) -> bool:
         """Finalize writing and close the file."""
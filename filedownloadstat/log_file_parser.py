@@ -1,11 +1,18 @@
-import gzip
 import re
 import logging
-from typing import Iterator, List, Dict, Any, Optional, Set
-from datetime import datetime, date
+from datetime import date, timedelta
+from functools import reduce
+from typing import Iterable, Iterator, List, Dict, Any, Optional, Set, Tuple
 import warnings
 
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from exceptions import ValidationError
+from gzip_reader import PipelinedGzipReader, iter_gzip_lines
 from interfaces import ILogParser
+from parquet_dataset import parse_month
+from timestamp_decoder import TimestampDecoder
 
 # Suppress specific warnings
 warnings.filterwarnings("ignore", category=FutureWarning, module="dask.dataframe")
@@ -13,25 +20,242 @@ warnings.filterwarnings("ignore", category=FutureWarning, module="dask.dataframe
 logger = logging.getLogger(__name__)
 
 
+class PathMatcher:
+    """
+    Precompiled matcher for the file path column of a log line.
+    Resource identifiers are checked with a single prefix test and the accession patterns are
+    combined into one compiled alternation, so each path is scanned once per row.
+    Every pattern is validated on its own first, so an invalid pattern is reported by name.
+    """
+
+    def __init__(self, resource_list: List[str], accession_pattern_list: List[str]) -> None:
+        self.resource_prefixes: Tuple[str, ...] = tuple(resource_list)
+        corrected_patterns = [re.sub(r"\\\\", r"\\", pattern) for pattern in accession_pattern_list]  # Fix escaping issues
+        for pattern, corrected_pattern in zip(accession_pattern_list, corrected_patterns):
+            try:
+                re.compile(corrected_pattern)
+            except re.error as regex_err:
+                logger.error("Regex error in accession pattern", extra={"pattern": pattern, "error": str(regex_err)})
+                raise ValidationError(f"Invalid accession pattern: {pattern} ({regex_err})",
+                                      field="accession_pattern_list", value=pattern, original_error=str(regex_err))
+        self.accession_regex: Optional[re.Pattern] = None
+        if corrected_patterns:
+            self.accession_regex = re.compile("|".join(f"(?:{p})" for p in corrected_patterns))
+
+    def get_accession(self, path: str) -> Optional[str]:
+        """
+        Searches for an accession number in the given path.
+        :param path: The file path to check
+        :return: The matched accession or None if no match is found
+        """
+        if self.accession_regex is None:
+            return None
+        match = self.accession_regex.search(path)
+        return match.group() if match else None
+
+    def match(self, path: str) -> Optional[Tuple[str, str]]:
+        """
+        Match a resource path and extract the accession and the filename.
+        :param path: File path column of the log line (eg: /pride/data/archive/2023/03/PXD034241/file.raw)
+        :return: (accession, filename) tuple or None if the path does not belong to the resource
+        """
+        if not path.startswith(self.resource_prefixes):
+            return None
+        filename = path.rpartition('/')[2]
+        if not filename or filename == path:  # filename cannot be null
+            return None
+        accession = self.get_accession(path)
+        if accession is None:
+            return None
+        return accession, filename
+
+
+class LinePrefilter:
+    """
+    Cheap bytes test applied to raw log lines before they are decoded and split.
+    A line can only be relevant if it contains one of the resource identifiers and one of the
+    completeness tokens (case-insensitive), so every other line is rejected without decoding.
+    """
+
+    def __init__(self, resource_list: List[str], completeness: Set[str]) -> None:
+        self.resource_regex: re.Pattern = re.compile(b"|".join(re.escape(r.encode("utf-8")) for r in resource_list))
+        self.completeness_regex: Optional[re.Pattern] = None
+        # Bytes regexes only fold ASCII case, non-ASCII tokens are left to the full check
+        if completeness and all(c.isascii() and c for c in completeness):
+            self.completeness_regex = re.compile(
+                b"|".join(re.escape(c.encode("utf-8")) for c in sorted(completeness)), re.IGNORECASE
+            )
+
+    def accepts(self, line: bytes) -> bool:
+        """
+        :param line: Raw log line
+        :return: False if the line cannot be relevant, True if it needs to be parsed
+        """
+        if self.resource_regex.search(line) is None:
+            return False
+        return self.completeness_regex is None or self.completeness_regex.search(line) is not None
+
+
+class RowFilter:
+    """
+    Date window, skipped years and accession allow/deny sets applied while parsing, so rows that are never
+    reported on are not written, merged or analyzed. Log files whose date (from their path, eg:
+    http/public/2024/01/01/file.log.tsv.gz) is outside the window are not read at all.
+    """
+
+    # Date of a log file: YYYY/MM/DD directories, or YYYY-MM-DD, YYYY_MM_DD or YYYYMMDD in the file name
+    FILE_DATE_REGEX = re.compile(r"(?<!\d)(\d{4})([/_-]?)(\d{2})\2(\d{2})(?!\d)")
+
+    def __init__(
+        self,
+        skipped_years: Optional[Iterable[int]] = None,
+        from_month: Optional[str] = None,
+        to_month: Optional[str] = None,
+        accession_allowlist: Optional[Iterable[str]] = None,
+        accession_denylist: Optional[Iterable[str]] = None
+    ) -> None:
+        """
+        :param skipped_years: Years to drop
+        :param from_month: First month (YYYY-MM) to keep
+        :param to_month: Last month (YYYY-MM) to keep
+        :param accession_allowlist: If given, only these accessions are kept
+        :param accession_denylist: Accessions to drop
+        """
+        self.skipped_years: Set[int] = set(skipped_years or [])
+        self.from_month: Optional[Tuple[int, int]] = parse_month(from_month) if from_month else None
+        self.to_month: Optional[Tuple[int, int]] = parse_month(to_month) if to_month else None
+        self.accession_allowlist: Optional[Set[str]] = set(accession_allowlist) if accession_allowlist is not None else None
+        self.accession_denylist: Set[str] = set(accession_denylist or [])
+
+    @staticmethod
+    def read_accession_list(file_path: str) -> Set[str]:
+        """
+        Read an accession list file, one accession per line.
+        """
+        with open(file_path, "r") as f:
+            return {line.strip() for line in f if line.strip()}
+
+    @property
+    def has_date_window(self) -> bool:
+        return bool(self.skipped_years) or self.from_month is not None or self.to_month is not None
+
+    def accepts_month(self, year: int, month: int) -> bool:
+        if year in self.skipped_years:
+            return False
+        if self.from_month is not None and (year, month) < self.from_month:
+            return False
+        return self.to_month is None or (year, month) <= self.to_month
+
+    def accepts_accession(self, accession: str) -> bool:
+        if self.accession_allowlist is not None and accession not in self.accession_allowlist:
+            return False
+        return accession not in self.accession_denylist
+
+    def accepts(self, accession: str, year: int, month: int) -> bool:
+        """
+        :return: True if the row is kept
+        """
+        return self.accepts_month(year, month) and self.accepts_accession(accession)
+
+    def mask(self, accession: pa.Array, year: pa.Array, month: pa.Array) -> Optional[pa.Array]:
+        """
+        Vectorized accepts() for the columnar engine.
+        :return: Boolean array of the rows kept, None if every row is kept
+        """
+        conditions = []
+        if self.skipped_years:
+            skipped = pa.array(sorted(self.skipped_years), year.type)
+            conditions.append(pc.invert(pc.is_in(year, value_set=skipped)))
+        month_key = pc.add(pc.multiply(pc.cast(year, pa.int32()), 100), pc.cast(month, pa.int32()))
+        if self.from_month is not None:
+            conditions.append(pc.greater_equal(month_key, self.from_month[0] * 100 + self.from_month[1]))
+        if self.to_month is not None:
+            conditions.append(pc.less_equal(month_key, self.to_month[0] * 100 + self.to_month[1]))
+        if self.accession_allowlist is not None:
+            allowed = pa.array(sorted(self.accession_allowlist), pa.string())
+            conditions.append(pc.is_in(accession, value_set=allowed))
+        if self.accession_denylist:
+            denied = pa.array(sorted(self.accession_denylist), pa.string())
+            conditions.append(pc.invert(pc.is_in(accession, value_set=denied)))
+        return reduce(pc.and_, conditions) if conditions else None
+
+    @classmethod
+    def file_date(cls, file_path: str) -> Optional[date]:
+        """
+        Date of a log file from its path (the last date found), None if the path has no date.
+        """
+        matches = list(cls.FILE_DATE_REGEX.finditer(file_path))
+        if not matches:
+            return None
+        year, _, month, day = matches[-1].groups()
+        try:
+            return date(int(year), int(month), int(day))
+        except ValueError:
+            return None
+
+    def accepts_file(self, file_path: str) -> bool:
+        """
+        :return: False if the log file only has rows outside the date window
+        """
+        file_day = self.file_date(file_path) if self.has_date_window else None
+        if file_day is None:
+            return True
+        # A daily log may hold rows of the previous or next day around midnight
+        days = (file_day - timedelta(days=1), file_day, file_day + timedelta(days=1))
+        return any(self.accepts_month(day.year, day.month) for day in days)
+
+
 class LogFileParser(ILogParser):
     """
     Class to parse the log file into parquet format
     eg: 2024-01-01T02:26:59.000Z\tebea3f4b11d3388b6da48148eb3a39a577bdc4bf\t179163579\t/pride/data/archive/2023/03/PXD034241/20210205_QExHFX3_RSLC10_Feng_Heckmann_EXT_onbead_dig_30_per_sample_turbo_nobio_S3_5.raw\tOUT\t03dbae9a96db63fa62487cd3c134d05230858127\tPartial\tChina\tShaanxi\tXi'an\t34.3287,109.0337\thttp\tpublic
     """
 
-    DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+    DATETIME_FORMAT = TimestampDecoder.DATETIME_FORMAT
+    # Order of the values returned by parse_values (same as ParquetWriter.schema)
+    OUTPUT_COLUMNS = (
+        "date", "year", "month", "user", "accession", "filename", "completed", "country", "method",
+        "timestamp", "geoip_region_name", "geoip_city_name", "geo_location"
+    )
 
     def __init__(
         self,
         file_path: str,
         resource_list: List[str],
         completeness_list: List[str],
-        accession_pattern_list: List[str]
+        accession_pattern_list: List[str],
+        pipelined: bool = False,
+        read_chunk_size: int = PipelinedGzipReader.DEFAULT_CHUNK_SIZE,
+        read_queue_depth: int = PipelinedGzipReader.DEFAULT_QUEUE_DEPTH,
+        row_filter: Optional[RowFilter] = None
     ) -> None:
+        """
+        :param pipelined: Decompress the log file on a background thread while parsing
+        :param read_chunk_size: Bytes read per chunk from the log file
+        :param read_queue_depth: Maximum number of decompressed chunks buffered by the pipelined reader
+        :param row_filter: Date window and accession sets of the rows to keep (default: all rows)
+        """
         self.file_path: str = file_path
+        self.pipelined: bool = pipelined
+        self.read_chunk_size: int = read_chunk_size
+        self.read_queue_depth: int = read_queue_depth
         self.RESOURCE_IDENTIFIERS: List[str] = resource_list
         self.completeness: Set[str] = {c.lower().strip() for c in completeness_list}
         self.accession_pattern_list: List[str] = accession_pattern_list
+        self.path_matcher: PathMatcher = PathMatcher(resource_list, accession_pattern_list)
+        self.timestamp_decoder: TimestampDecoder = TimestampDecoder()
+        self.line_prefilter: LinePrefilter = LinePrefilter(resource_list, self.completeness)
+        self.row_filter: Optional[RowFilter] = row_filter
+
+    def _iter_lines(self) -> Iterator[bytes]:
+        """
+        Iterate over the raw (undecoded) lines of the gzipped TSV file.
+        """
+        if self.pipelined:
+            reader = PipelinedGzipReader(self.file_path, self.read_chunk_size, self.read_queue_depth)
+            yield from reader.iter_lines()
+        else:
+            yield from iter_gzip_lines(self.file_path, self.read_chunk_size)
 
     def parse_gzipped_tsv(self, batch_size: int) -> Iterator[List[Dict[str, Any]]]:
         """
@@ -41,23 +265,63 @@ class LogFileParser(ILogParser):
         """
         batch = []
         try:
-            with gzip.open(self.file_path, "rt", encoding="utf-8") as log_file:
-                for line_no, line in enumerate(log_file, start=1):
-                    line = line.replace('\\t', '\t')  # Replace literal '\t' with actual tab
-                    row = line.strip().split('\t')  # Split each line by tab
-                    parsed_line = self.parse_row(row, line_no)
-                    if parsed_line:
-                        batch.append(parsed_line)
-                        # Yield the batch when it reaches the desired size
-                        if len(batch) == batch_size:
-                            yield batch
-                            batch = []  # Reset the batch after yielding
-                if batch:
+            for values in self._iter_parsed_values():
+                batch.append(dict(zip(self.OUTPUT_COLUMNS, values)))
+                # Yield the batch when it reaches the desired size
+                if len(batch) == batch_size:
                     yield batch
-        except OSError as e:
-            logger.warning("Skipping corrupted file", extra={"file_path": self.file_path, "error": str(e)})
+                    batch = []  # Reset the batch after yielding
+            if batch:
+                yield batch
         except Exception as e:
-            logger.error("Exception while processing file", extra={"file_path": self.file_path, "error": str(e)}, exc_info=True)
+            self._log_parse_error(e)
+
+    def parse_gzipped_tsv_columns(self, batch_size: int) -> Iterator[Dict[str, List[Any]]]:
+        """
+        Same as parse_gzipped_tsv, but each batch is a dict of column lists (OUTPUT_COLUMNS),
+        so no dict is built per row.
+        :param batch_size: Number of rows to include in each batch.
+        :return: Generator that yields column batches of parsed data.
+        """
+        rows = []
+        try:
+            for values in self._iter_parsed_values():
+                rows.append(values)
+                if len(rows) == batch_size:
+                    yield dict(zip(self.OUTPUT_COLUMNS, map(list, zip(*rows))))
+                    rows = []
+            if rows:
+                yield dict(zip(self.OUTPUT_COLUMNS, map(list, zip(*rows))))
+        except Exception as e:
+            self._log_parse_error(e)
+
+    def _log_parse_error(self, error: Exception) -> None:
+        """Log the error that stopped parsing the file; the rows parsed up to the last full batch are kept."""
+        if isinstance(error, OSError):
+            logger.warning("Skipping corrupted file", extra={"file_path": self.file_path, "error": str(error)})
+        else:
+            logger.error("Exception while processing file", extra={"file_path": self.file_path, "error": str(error)}, exc_info=True)
+
+    def _iter_parsed_values(self) -> Iterator[Tuple[Any, ...]]:
+        """
+        Read the gzipped TSV file and yield the parsed values of each relevant line.
+        """
+        literal_tabs = False  # Set once the file turns out to use literal '\t' as separator
+        accepts = self.line_prefilter.accepts
+        for line_no, raw_line in enumerate(self._iter_lines(), start=1):
+            # Reject irrelevant lines before decoding them
+            if not accepts(raw_line):
+                continue
+            line = raw_line.decode("utf-8")
+            if literal_tabs:
+                line = line.replace('\\t', '\t')  # Replace literal '\t' with actual tab
+            row = line.strip().split('\t')  # Split each line by tab
+            if len(row) != 13 and '\\t' in line:
+                literal_tabs = True
+                row = line.replace('\\t', '\t').strip().split('\t')
+            values = self.parse_values(row, line_no)
+            if values:
+                yield values
 
     def is_relevant_row(self, row: List[str]) -> bool:
         """
@@ -65,23 +329,8 @@ class LogFileParser(ILogParser):
         :param row: List of row values
         :return: Boolean indicating if the row is relevant
         """
-        if  '/' in row[3]:
-
-            if any(row[3].startswith(identifier) for identifier in self.RESOURCE_IDENTIFIERS):
-                accession_field = self.get_accession(row[3])
-                if accession_field is not None:
-                    if row[3].split('/')[-1] is not None and row[3].split('/')[-1] != "":    # filename cannot be null
-                        if  row[6].lower().strip() in self.completeness:
-                            return True # all condition matched
-                    else:
-                        return False
-                else:
-                    return False
-
-            else:
-                return False
-        else:
-            return False
+        return (self.path_matcher.match(row[3]) is not None
+                and row[6].lower().strip() in self.completeness)
 
     def get_accession(self, path: str) -> Optional[str]:
         """
@@ -93,18 +342,7 @@ class LogFileParser(ILogParser):
         Returns:
             str or None: The matched accession number as a string, or None if no match is found.
         """
-        try:
-            for pattern in self.accession_pattern_list:
-                corrected_pattern = re.sub(r"\\\\", r"\\", pattern)  # Fix escaping issues
-                match = re.search(corrected_pattern, path)
-                if match:
-                    return match.group()
-        except re.error as regex_err:
-            logger.error("Regex error in get_accession", extra={"pattern": pattern, "error": str(regex_err)})
-        except Exception as e:
-            logger.error("Unexpected error in get_accession", extra={"error": str(e)}, exc_info=True)
-
-        return None  # No match found or an error occurred
+        return self.path_matcher.get_accession(path)
 
     def parse_row(self, row: List[str], line_no: int) -> Optional[Dict[str, Any]]:
         """
@@ -113,32 +351,42 @@ class LogFileParser(ILogParser):
         :param line_no:
         :return:
         """
+        values = self.parse_values(row, line_no)
+        return dict(zip(self.OUTPUT_COLUMNS, values)) if values else None
+
+    def parse_values(self, row: List[str], line_no: int) -> Optional[Tuple[Any, ...]]:
+        """
+        Parse a row into a tuple of values in OUTPUT_COLUMNS order.
+        :param row: List of row values
+        :param line_no: Line number, for logging
+        :return: Tuple of values, or None if the row is not relevant
+        """
         if len(row) == 13:
-            if self.is_relevant_row(row):
+            path_match = self.path_matcher.match(row[3])
+            completed = row[6].lower().strip()
+            if path_match is not None and completed in self.completeness:
+                accession, filename = path_match
                 try:
-                    timestamp = self.clean_timestamp(row[0])
-                    parsed_time = datetime.strptime(timestamp, self.DATETIME_FORMAT)
-
                     # Extract year, month, and date
-                    year = parsed_time.year
-                    month = parsed_time.month
-                    date = parsed_time.date()
-
-                    return {
-                        "date": date,  # Date
-                        "year": year,
-                        "month": month,
-                        "user": row[1].strip(),
-                        "accession": self.get_accession(row[3]),  # Project accession of the resource(eg: PXD accession in PRIDE)
-                        "filename": row[3].split('/')[-1],  # Files that are associate to a project(project acceesion)
-                        "completed": row[6].lower().strip(),  # Completion Status (e.g., Complete or Incomplete)
-                        "country": row[7],  # Country
-                        "method": row[11],  # Method (e.g., ftp, aspera)
-                        "timestamp": row[0].strip(),  # Original timestamp string
-                        "geoip_region_name": self.clean_geoip_value(row[8]) if row[8] else "",  # GeoIP region name (e.g., Shaanxi)
-                        "geoip_city_name": self.clean_geoip_value(row[9]) if row[9] else "",  # GeoIP city name (e.g., Xi'an)
-                        "geo_location": row[10].strip() if row[10] else "",  # Geo location coordinates (e.g., 34.3287,109.0337)
-                    }
+                    date, year, month = self.timestamp_decoder.decode(row[0])
+                    if self.row_filter is not None and not self.row_filter.accepts(accession, year, month):
+                        return None
+
+                    return (
+                        date,  # Date
+                        year,
+                        month,
+                        row[1].strip(),  # User
+                        accession,  # Project accession of the resource(eg: PXD accession in PRIDE)
+                        filename,  # Files that are associate to a project(project acceesion)
+                        completed,  # Completion Status (e.g., Complete or Incomplete)
+                        row[7],  # Country
+                        row[11],  # Method (e.g., ftp, aspera)
+                        row[0].strip(),  # Original timestamp string
+                        self.clean_geoip_value(row[8]) if row[8] else "",  # GeoIP region name (e.g., Shaanxi)
+                        self.clean_geoip_value(row[9]) if row[9] else "",  # GeoIP city name (e.g., Xi'an)
+                        row[10].strip() if row[10] else "",  # Geo location coordinates (e.g., 34.3287,109.0337)
+                    )
                 except IndexError as e:
                     logger.error("Error processing line", extra={"line_no": line_no, "row": row, "error": str(e)})
                     raise IndexError(f"IndexError: Row {line_no} with insufficient columns: {row}. Error: {e}")
@@ -156,9 +404,7 @@ class LogFileParser(ILogParser):
         :param timestamp: Raw timestamp string
         :return: Cleaned timestamp string
         """
-        if '.' in timestamp:
-            timestamp = timestamp[:26] + 'Z'  # Trim to microseconds and re-add 'Z'
-        return timestamp.rstrip('Z')  # Remove 'Z' for parsing
+        return TimestampDecoder.clean_timestamp(timestamp)
 
     @staticmethod
     def clean_geoip_value(value: str) -> str:
@@ -1,12 +1,25 @@
 import os
+import heapq
 import logging
-from typing import List, Optional, Callable
+import math
+import pickle
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Callable, Dict, Any, Tuple
 from pathlib import Path
 
-from log_file_parser import LogFileParser
+import pyarrow.parquet as pq
+
+from log_file_parser import LogFileParser, RowFilter
+from arrow_log_file_parser import ArrowLogFileParser
+from directory_scanner import DirectoryScanner, ScannedFile
+from parquet_schema import convert, schema_for_version, schema_version
 from parquet_writer import ParquetWriter
+from ingestion_manifest import Fingerprint, IngestionManifest
 from exceptions import (
     LogFileNotFoundError,
+    ValidationError,
     ParquetWriteError,
     LogFileCorruptedError
 )
@@ -15,36 +28,51 @@ from interfaces import IFileUtil
 logger = logging.getLogger(__name__)
 
 
+def _process_log_file_task(task: Dict[str, Any], factories: Dict[str, Callable]) -> None:
+    """
+    Process pool entry point: parse one log file with the parser and writer factories of the calling FileUtil.
+    """
+    FileUtil(**factories).process_log_file(**task)
+
+
 class FileUtil(IFileUtil):
     """
     File utility class for processing log files.
     Supports dependency injection for better testability.
     """
 
+    PARSE_ENGINES = ('row', 'arrow')
+    DEFAULT_BATCH_SIZE = 1000
+
     def __init__(
         self,
         parser_factory: Optional[Callable] = None,
-        writer_factory: Optional[Callable] = None
+        writer_factory: Optional[Callable] = None,
+        arrow_parser_factory: Optional[Callable] = None
     ) -> None:
         """
         Initialize FileUtil.
         
         Args:
-            parser_factory: Optional factory function for creating LogFileParser instances
-            writer_factory: Optional factory function for creating ParquetWriter instances
+            parser_factory: Optional factory function for creating LogFileParser instances (ILogParser). Called with
+                the LogFileParser arguments; row_filter is only passed when a row filter is used.
+            writer_factory: Optional factory function for creating ParquetWriter instances (IParquetWriter). Called
+                with the ParquetWriter arguments, including the metadata recorded in the file schema.
+            arrow_parser_factory: Optional factory function for creating ArrowLogFileParser instances
         """
         self._parser_factory = parser_factory or LogFileParser
         self._writer_factory = writer_factory or ParquetWriter
+        self._arrow_parser_factory = arrow_parser_factory or ArrowLogFileParser
 
-    def get_file_paths(self, root_dir: str) -> List[str]:
+    def get_file_paths(self, root_dir: str, scan_workers: int = DirectoryScanner.DEFAULT_WORKERS) -> List[str]:
         """
         Traverse the directory tree and retrieve all file paths.
-        Handles variable folder depth safely using pathlib.
+        Handles variable folder depth; subdirectories are listed concurrently with os.scandir.
         :param root_dir: Root directory to start traversal.
+        :param scan_workers: Number of threads listing directories
         :return: List of file paths.
         """
-        root_path = Path(root_dir)
-        return [str(file) for file in root_path.rglob("*.tsv.gz")]
+        return [scanned_file.path for scanned_file in DirectoryScanner(workers=scan_workers).scan([root_dir])]
 
 
     def process_access_methods(
@@ -52,35 +80,46 @@ class FileUtil(IFileUtil):
         root_directory: str,
         file_paths_list: str,
         protocols: List[str],
-        public_list: List[str]
+        public_list: List[str],
+        manifest: Optional[IngestionManifest] = None,
+        scan_workers: int = DirectoryScanner.DEFAULT_WORKERS
     ) -> str:
         """
         Process logs and generate Parquet files for each file in the specified access method directories.
+        :param manifest: Optional ingestion manifest; log files already ingested and unchanged are left out of the list
+        :param scan_workers: Number of threads listing directories
         """
 
         file_metadata = []
+        fingerprints: Dict[str, Fingerprint] = {}
+        skipped_count = 0
 
-        for protocol in protocols:
-            for public_private in public_list:
-                method_directory = Path(root_directory) / protocol.strip() / public_private.strip()
-                files = self.get_file_paths(str(method_directory))
-
-                for file_path in files:
-                    file_path_obj = Path(file_path)
+        # All protocol and public/private folders are walked by one scanner, so they are listed concurrently;
+        # the list keeps the original layout: the files of every (protocol, public/private) pair in turn
+        method_directories: List[Tuple[str, str]] = [
+            (str(Path(root_directory) / protocol.strip() / public_private.strip()), protocol)
+            for protocol in protocols for public_private in public_list
+        ]
+        files_by_directory: Dict[str, List[ScannedFile]] = {directory: [] for directory, _ in method_directories}
+        for scanned_file in DirectoryScanner(workers=scan_workers).scan(list(files_by_directory)):
+            files_by_directory[scanned_file.root].append(scanned_file)
 
-                    # Retrieve file size
-                    file_size = file_path_obj.stat().st_size
+        listed_files = [(scanned_file, protocol) for directory, protocol in method_directories
+                        for scanned_file in files_by_directory[directory]]
+        for scanned_file, protocol in listed_files:
+            # Size and modification time are taken once by the scanner (the manifest needs no other stat)
+            if manifest is not None and manifest.is_current(scanned_file.path, scanned_file.size, scanned_file.mtime_ns):
+                skipped_count += 1
+                continue
 
-                    # Count number of lines in the gzipped file
-                    # line_count = self.count_lines_in_gz(file_path)
-
-                    file_info = {
-                        "path": file_path,
-                        "filename": file_path_obj.name,
-                        "size": file_size,
-                        "protocol": protocol,
-                    }
-                    file_metadata.append(file_info)
+            file_info = {
+                "path": scanned_file.path,
+                "filename": scanned_file.name,
+                "size": scanned_file.size,
+                "protocol": protocol,
+            }
+            file_metadata.append(file_info)
+            fingerprints[scanned_file.path] = (scanned_file.size, scanned_file.mtime_ns)
 
             # Write metadata to the output file
         with open(file_paths_list, "w") as f:
@@ -89,7 +128,12 @@ class FileUtil(IFileUtil):
                     f"{metadata['path']}\t{metadata['filename']}\t{metadata['size']}\t{metadata['protocol']}\n"
                 )
 
-        logger.info("File metadata written", extra={"output_file": file_paths_list, "file_count": len(file_metadata)})
+        if manifest is not None:
+            # The merge records the logs in the state they were listed in, not the one they have by then
+            manifest.save_scan(fingerprints)
+
+        logger.info("File metadata written", extra={"output_file": file_paths_list, "file_count": len(file_metadata),
+                                                    "unchanged_skipped": skipped_count})
         return file_paths_list
 
     def process_log_file(
@@ -99,11 +143,29 @@ class FileUtil(IFileUtil):
         resource_list: List[str],
         completeness_list: List[str],
         batch_size: int,
-        accession_pattern_list: List[str]
+        accession_pattern_list: List[str],
+        engine: str = 'row',
+        parser_options: Optional[Dict[str, Any]] = None,
+        writer_options: Optional[Dict[str, Any]] = None,
+        row_filter: Optional[RowFilter] = None
     ) -> None:
+        """
+        Parse a gzipped log file and write the relevant rows to a Parquet file.
+        :param batch_size: Number of rows the parser yields at a time; row groups are sized by the writer
+        :param engine: 'row' parses line by line with LogFileParser, 'arrow' parses column-wise with ArrowLogFileParser.
+        Both produce ParquetWriter.schema.
+        :param parser_options: Extra keyword arguments for the row parser (eg: pipelined, read_chunk_size, read_queue_depth)
+        :param writer_options: Extra keyword arguments for the Parquet writer (eg: row_group_rows, row_group_bytes,
+        schema_version)
+        :param row_filter: Date window and accession sets of the rows to keep. A log file whose path date is outside
+        the window is not read and no Parquet file is written for it.
+        """
+        if engine not in self.PARSE_ENGINES:
+            raise ValidationError(f"engine must be one of {self.PARSE_ENGINES}, got: {engine}", field="engine", value=engine)
+
         data_written = False
         try:
-            logger.info("Parsing log file started", extra={"file_path": file_path, "output_file": parquet_output_file})
+            logger.info("Parsing log file started", extra={"file_path": file_path, "output_file": parquet_output_file, "engine": engine})
 
             if not os.path.exists(file_path):
                 raise LogFileNotFoundError(
@@ -111,12 +173,31 @@ class FileUtil(IFileUtil):
                     file_path=file_path
                 )
 
-            lp = self._parser_factory(file_path, resource_list, completeness_list, accession_pattern_list)
-            writer = self._writer_factory(parquet_path=parquet_output_file, write_strategy='batch', batch_size=batch_size)
+            if row_filter is not None and not row_filter.accepts_file(file_path):
+                logger.info("Log file outside the date window skipped", extra={"file_path": file_path})
+                return
+
+            metadata = {IngestionManifest.SOURCE_METADATA_KEY: file_path}
+            if row_filter is not None:
+                # Filtered files must not be reused by the parquet store (see IngestionManifest.ingest)
+                metadata[IngestionManifest.ROW_FILTER_METADATA_KEY] = "true"
+            writer = self._writer_factory(parquet_path=parquet_output_file, write_strategy='batch', batch_size=batch_size,
+                                          metadata=metadata, **(writer_options or {}))
 
-            for batch in lp.parse_gzipped_tsv(batch_size):
-                if writer.write_batch(batch):
-                    data_written = True
+            # Injected factories that predate row filtering keep working when no filter is used
+            filter_options = {"row_filter": row_filter} if row_filter is not None else {}
+            if engine == 'arrow':
+                alp = self._arrow_parser_factory(file_path, resource_list, completeness_list, accession_pattern_list,
+                                                 **filter_options)
+                for record_batch in alp.parse_record_batches():
+                    if writer.write_record_batch(record_batch):
+                        data_written = True
+            else:
+                lp = self._parser_factory(file_path, resource_list, completeness_list, accession_pattern_list,
+                                          **filter_options, **(parser_options or {}))
+                for batch in lp.parse_gzipped_tsv_columns(batch_size):
+                    if writer.write_columns(batch):
+                        data_written = True
 
             # Finalize and check if any data was written
             if writer.finalize():
@@ -126,7 +207,7 @@ class FileUtil(IFileUtil):
                 logger.info("Parquet file written successfully", extra={"file_path": file_path, "output_file": parquet_output_file})
             else:
                 logger.warning("No data found to write", extra={"file_path": file_path})
-        except LogFileNotFoundError:
+        except (LogFileNotFoundError, ValidationError):
             # Re-raise as-is - this is a fatal error
             raise
         except (LogFileCorruptedError, ParquetWriteError) as e:
@@ -142,3 +223,190 @@ class FileUtil(IFileUtil):
             )
             logger.error("Error while processing file", extra={"file_path": file_path, "error": str(e)}, exc_info=True)
             raise error
+
+
+    @staticmethod
+    def read_log_file_list(file_list: str) -> List[str]:
+        """
+        Read log file paths from a text file, one per line. Lines in the get_log_files format
+        (path, filename, size, protocol separated by tabs) are accepted as well.
+        :param file_list: Text file with the log file paths
+        :return: List of log file paths
+        """
+        with open(file_list, "r") as f:
+            return [line.split('\t')[0].strip() for line in f if line.strip()]
+
+    @staticmethod
+    def plan_work_units(file_list: str, output: str, target_bytes: int) -> List[List[str]]:
+        """
+        Bin-pack the log files of a get_log_files manifest into work units of roughly equal compressed size.
+        Files at least as large as the target get a unit of their own; the remaining files are assigned,
+        largest first, to the least loaded of ceil(remaining_bytes / target_bytes) units.
+        :param file_list: Manifest written by process_access_methods (path, filename, size, protocol)
+        :param output: File to write one work unit per line, log file paths separated by tabs
+        :param target_bytes: Target compressed bytes per work unit
+        :return: List of work units
+        """
+        if target_bytes <= 0:
+            raise ValidationError("target_bytes must be positive", field="target_bytes", value=target_bytes)
+
+        files = []
+        with open(file_list, "r") as f:
+            for line in f:
+                fields = line.rstrip("\n").split("\t")
+                if fields[0].strip():
+                    size = int(fields[2]) if len(fields) > 2 and fields[2].strip().isdigit() else 0
+                    files.append((size, fields[0].strip()))
+        files.sort(key=lambda file: file[0], reverse=True)
+
+        work_units = [[path] for size, path in files if size >= target_bytes]
+        small_files = [(size, path) for size, path in files if size < target_bytes]
+        unit_count = min(len(small_files), max(1, math.ceil(sum(size for size, _ in small_files) / target_bytes)))
+
+        # (assigned bytes, unit index) heap, so the least loaded unit is always on top
+        heap = [(0, index) for index in range(unit_count)]
+        small_units: List[List[str]] = [[] for _ in range(unit_count)]
+        for size, path in small_files:
+            assigned, index = heapq.heappop(heap)
+            small_units[index].append(path)
+            heapq.heappush(heap, (assigned + size, index))
+        work_units.extend(unit for unit in small_units if unit)
+
+        with open(output, "w") as f:
+            for unit in work_units:
+                f.write("\t".join(unit) + "\n")
+
+        logger.info("Work units planned", extra={"output_file": output, "file_count": len(files),
+                                                 "unit_count": len(work_units), "target_bytes": target_bytes})
+        return work_units
+
+    @staticmethod
+    def parquet_file_name(file_path: str) -> str:
+        """
+        Parquet file name for a log file, eg: /logs/http/public/2024/01/01/file.log.tsv.gz -> file.parquet
+        """
+        name = Path(file_path).name
+        for suffix in ('.log.tsv.gz', '.tsv.gz'):
+            if name.endswith(suffix):
+                return name[:-len(suffix)] + '.parquet'
+        return name + '.parquet'
+
+    def process_log_files(
+        self,
+        file_paths: List[str],
+        output_dir: str,
+        resource_list: List[str],
+        completeness_list: List[str],
+        batch_size: int,
+        accession_pattern_list: List[str],
+        engine: str = 'row',
+        parser_options: Optional[Dict[str, Any]] = None,
+        writer_options: Optional[Dict[str, Any]] = None,
+        workers: int = 1,
+        combined_output: Optional[str] = None,
+        row_filter: Optional[RowFilter] = None
+    ) -> List[str]:
+        """
+        Parse several log files in one interpreter, using a process pool when workers > 1.
+        :param output_dir: Directory for the per-log Parquet files (one per input, named after the log file)
+        :param workers: Number of worker processes
+        :param combined_output: If given, the per-log Parquet files are combined into this single file instead
+        :param row_filter: Date window and accession sets of the rows to keep (see process_log_file)
+        :return: Paths of the Parquet files written
+        """
+        os.makedirs(output_dir, exist_ok=True)
+        work_dir = tempfile.mkdtemp(dir=output_dir) if combined_output else output_dir
+
+        tasks = []
+        used_names = set()
+        next_suffix: Dict[str, int] = {}
+        for file_path in file_paths:
+            name = self.parquet_file_name(file_path)
+            stem = name[:-len('.parquet')]
+            while name in used_names:
+                # Same log file name under different protocol/date folders (or a log already named like a suffix)
+                next_suffix[stem] = next_suffix.get(stem, 0) + 1
+                name = f"{stem}_{next_suffix[stem]}.parquet"
+            used_names.add(name)
+            tasks.append({
+                "file_path": file_path,
+                "parquet_output_file": os.path.join(work_dir, name),
+                "resource_list": resource_list,
+                "completeness_list": completeness_list,
+                "batch_size": batch_size,
+                "accession_pattern_list": accession_pattern_list,
+                "engine": engine,
+                "parser_options": parser_options,
+                "writer_options": writer_options,
+                "row_filter": row_filter,
+            })
+
+        logger.info("Parsing log files started", extra={"file_count": len(tasks), "workers": workers})
+        try:
+            if workers > 1 and len(tasks) > 1:
+                factories = self._worker_factories()
+                with ProcessPoolExecutor(max_workers=workers) as executor:
+                    list(executor.map(_process_log_file_task, tasks, [factories] * len(tasks)))
+            else:
+                for task in tasks:
+                    self.process_log_file(**task)
+
+            written = [task["parquet_output_file"] for task in tasks if os.path.exists(task["parquet_output_file"])]
+            if combined_output:
+                written = [self._combine_parquet_files(written, combined_output, writer_options)] if written else []
+        finally:
+            if combined_output:
+                shutil.rmtree(work_dir, ignore_errors=True)
+
+        logger.info("Parsing log files completed", extra={"file_count": len(tasks), "parquet_count": len(written)})
+        return written
+
+    def _worker_factories(self) -> Dict[str, Callable]:
+        """
+        Factories of this FileUtil for the worker processes, so parallel runs parse and write like serial ones.
+        """
+        factories = {
+            "parser_factory": self._parser_factory,
+            "writer_factory": self._writer_factory,
+            "arrow_parser_factory": self._arrow_parser_factory,
+        }
+        try:
+            pickle.dumps(factories)
+        except (pickle.PicklingError, AttributeError, TypeError) as e:
+            raise ValidationError("Injected parser and writer factories must be picklable (eg: module-level "
+                                  "functions or classes) to parse with workers > 1",
+                                  field="workers", original_error=str(e))
+        return factories
+
+    def _combine_parquet_files(
+        self,
+        parquet_files: List[str],
+        output_file: str,
+        writer_options: Optional[Dict[str, Any]] = None
+    ) -> str:
+        """
+        Stream per-log Parquet files into a single Parquet file (in the schema version of the first file).
+        The rows go through ParquetWriter, so the small row groups of the per-log files are coalesced into row
+        groups of row_group_rows / row_group_bytes.
+        :param writer_options: Row group options of the Parquet writer (see process_log_file)
+        """
+        try:
+            options = {key: value for key, value in (writer_options or {}).items()
+                       if key in ("row_group_rows", "row_group_bytes")}
+            version = schema_version(pq.read_schema(parquet_files[0]))
+            schema = schema_for_version(version)
+            writer = ParquetWriter(parquet_path=output_file, write_strategy='batch', schema_version=version, **options)
+            for parquet_file in parquet_files:
+                for batch in pq.ParquetFile(parquet_file).iter_batches():
+                    # Parquet reads date64 back as date32: restore the writer schema
+                    writer.write_record_batch(convert(batch, version).cast(schema))
+            writer.finalize()
+            return output_file
+        except (IOError, OSError) as e:
+            error = ParquetWriteError(
+                f"Failed to combine Parquet files: {output_file}",
+                parquet_path=output_file,
+                original_error=str(e)
+            )
+            logger.error("Error while combining Parquet files", extra={"output_file": output_file, "error": str(e)}, exc_info=True)
+            raise error
@@ -1,23 +1,50 @@
+import itertools
 import os
 import logging
-from typing import List
+import shutil
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Deque, Iterator, List, Optional, Tuple, TypeVar
 from pathlib import Path
+import numpy as np
 import pandas as pd
 import pyarrow.parquet as pq
 import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
 from scipy.stats import rankdata
 
+from aggregate_cube import AggregateCube, CubeBuilder, is_cube
+from aggregate_store import AggregateStore
+from data_export import DataExporter, json_objects, pandas_json_values, write_json_array
 from exceptions import (
     ParquetReadError,
     ParquetMergeError,
     AnalysisError
 )
+from ingestion_manifest import IngestionManifest
 from interfaces import IParquetAnalyzer
+from parquet_dataset import canonical_columns, filter_expression, open_dataset, partition_filters, write_partitioned
+from parquet_schema import SCHEMA_V1, convert, schema_for_version, schema_version, to_v1
+from parquet_writer import ParquetWriter
 
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+def available_cpus() -> int:
+    """Number of CPUs this process may run on (the CPUs allocated to the task on a cluster)."""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
 
 class ParquetAnalyzer(IParquetAnalyzer):
+    DEFAULT_MERGE_WORKERS = 4
+    BOT_COLUMNS = ['is_bot', 'is_hub', 'is_organic']
+
     def __init__(self, batch_size: int = 100000) -> None:
         """Initialize with a batch size for processing."""
         self.batch_size: int = int(batch_size)  # Number of rows to process at a time
@@ -29,81 +56,48 @@ class ParquetAnalyzer(IParquetAnalyzer):
         file_level_download_counts: str,
         project_level_yearly_download_counts: str,
         project_level_top_download_counts: str,
-        all_data: str
+        all_data: Optional[str],
+        skipped_years: Optional[List[int]] = None,
+        from_month: Optional[str] = None,
+        to_month: Optional[str] = None,
+        workers: Optional[int] = None,
+        all_data_format: str = "json",
+        all_data_compression: str = "none",
+        all_data_split_by_year: bool = False
     ) -> None:
-        """Processes Parquet files in a single pass with batch-wise aggregation and JSON export."""
-        parquet_file = pq.ParquetFile(output_parquet)
-
-        project_counts = []
-        file_counts = []
-        yearly_counts = []
-        bot_counts = []
+        """
+        Writes the project, file, yearly and top download counts.
+        The input is an aggregate cube written by build_cube, or merged Parquet data that is scanned into a cube
+        (and exported to all_data) in a single pass.
+        :param output_parquet: Aggregate cube directory, merged Parquet file or hive-partitioned (year=/month=)
+        dataset directory
+        :param all_data: all_data export of the records (not written for a cube input: build_cube exports it)
+        :param skipped_years: Years to leave out; with a partitioned dataset their files are not read
+        :param from_month: First month (YYYY-MM) to include
+        :param to_month: Last month (YYYY-MM) to include
+        :param workers: Number of row groups analyzed concurrently (default: the available CPUs)
+        :param all_data_format: Export format of all_data (see data_export.EXPORT_FORMATS)
+        :param all_data_compression: Compression of the all_data export (see data_export.EXPORT_COMPRESSIONS)
+        :param all_data_split_by_year: Export all_data as a directory with one file per year
+        """
+        if is_cube(output_parquet):
+            if skipped_years or from_month or to_month or all_data:
+                logger.warning("Filters and the all_data export are applied by build_cube, ignored for a cube input",
+                               extra={"cube_dir": output_parquet})
+            cube = AggregateCube.read(output_parquet)
+        else:
+            exporter = DataExporter(all_data, all_data_format, all_data_compression, all_data_split_by_year) \
+                if all_data else None
+            cube = self._scan(output_parquet, skipped_years, from_month, to_month, workers, exporter)
 
-        # Check if bot classification columns exist in the schema
-        schema_names = parquet_file.schema_arrow.names
-        has_bot_columns = all(col in schema_names for col in ['is_bot', 'is_hub', 'is_organic'])
-
-        # Single pass: aggregate stats and write all_data JSON simultaneously
-        first_batch = True
-        all_data_record_count = 0
-        with open(all_data, "w") as all_data_f:
-            all_data_f.write("[")
-            for batch in parquet_file.iter_batches(batch_size=self.batch_size):
-                df = batch.to_pandas()
-
-                # Aggregate project-level counts
-                project_counts.append(df.groupby("accession").size().reset_index(name="count"))
-
-                # Aggregate file-level counts
-                file_counts.append(df.groupby(["accession", "filename"]).size().reset_index(name="count"))
-
-                # Aggregate yearly counts
-                yearly_counts.append(df.groupby(["accession", "year"]).size().reset_index(name="count"))
-
-                # Aggregate bot classification counts per project
-                if has_bot_columns:
-                    bot_batch = df.groupby("accession").agg(
-                        bot_count=("is_bot", "sum"),
-                        hub_count=("is_hub", "sum"),
-                        organic_count=("is_organic", "sum")
-                    ).reset_index()
-                    bot_counts.append(bot_batch)
-
-                # Write all_data JSON incrementally
-                json_str = df.to_json(orient="records")
-                json_str = json_str[1:-1]  # Strip outer [ ]
-                if json_str:
-                    if not first_batch:
-                        all_data_f.write(",")
-                    all_data_f.write(json_str)
-                    first_batch = False
-                all_data_record_count += len(df)
-
-            all_data_f.write("]")
-        logger.info("All data saved", extra={"output_file": all_data, "record_count": all_data_record_count})
-
-        # Combine and re-aggregate across batches
-        project_df = pd.concat(project_counts, ignore_index=True).groupby("accession")["count"].sum().reset_index()
-        file_df = pd.concat(file_counts, ignore_index=True).groupby(["accession", "filename"])["count"].sum().reset_index()
-        yearly_df = pd.concat(yearly_counts, ignore_index=True).groupby(["accession", "year"])["count"].sum().reset_index()
-
-        # Merge bot classification counts into project-level data
-        if bot_counts:
-            bot_df = pd.concat(bot_counts, ignore_index=True).groupby("accession").agg(
-                bot_count=("bot_count", "sum"),
-                hub_count=("hub_count", "sum"),
-                organic_count=("organic_count", "sum")
-            ).reset_index()
-            bot_df["bot_count"] = bot_df["bot_count"].astype(int)
-            bot_df["hub_count"] = bot_df["hub_count"].astype(int)
-            bot_df["organic_count"] = bot_df["organic_count"].astype(int)
-            project_df = project_df.merge(bot_df, on="accession", how="left")
-            project_df[["bot_count", "hub_count", "organic_count"]] = project_df[["bot_count", "hub_count", "organic_count"]].fillna(0).astype(int)
-            logger.info("Bot classification counts merged into project-level data", extra={"projects_with_bot_data": len(bot_df)})
+        project_df = self._project_download_counts(cube)
+        yearly_df = cube.counts.groupby(["accession", "year"], as_index=False)["count"].sum()
+        # Null dimensions are kept in the cube, which turns an integer year into floats
+        yearly_df["year"] = yearly_df["year"].astype(SCHEMA_V1.field("year").type.to_pandas_dtype())
 
         # Persist results
         self.persist_project_level_download_counts(project_df, project_level_download_counts)
-        self.persist_file_level_download_counts(file_df, file_level_download_counts)
+        self.persist_file_level_download_counts(cube.file_counts, file_level_download_counts)
         self.persist_project_level_yearly_download_counts(yearly_df, project_level_yearly_download_counts)
 
         # Top downloads derived from already-computed project counts (no extra parquet read)
@@ -111,6 +105,148 @@ class ParquetAnalyzer(IParquetAnalyzer):
         top_df.to_json(project_level_top_download_counts, orient="records", lines=False)
         logger.info("Top download counts saved", extra={"output_file": project_level_top_download_counts, "top_count": len(top_df)})
 
+    def build_cube(
+        self,
+        output_parquet: str,
+        cube_dir: str,
+        all_data: Optional[str] = None,
+        skipped_years: Optional[List[int]] = None,
+        from_month: Optional[str] = None,
+        to_month: Optional[str] = None,
+        workers: Optional[int] = None,
+        all_data_format: str = "json",
+        all_data_compression: str = "none",
+        all_data_split_by_year: bool = False
+    ) -> None:
+        """
+        Scans the merged Parquet data once into an aggregate cube (see aggregate_cube), which analyze_parquet_files
+        and the report read instead of the raw rows. all_data is exported in the same pass.
+        :param cube_dir: Output directory of the cube
+        :param all_data: all_data export of the records (not exported if not set)
+        The other parameters are the ones of analyze_parquet_files.
+        """
+        exporter = DataExporter(all_data, all_data_format, all_data_compression, all_data_split_by_year) \
+            if all_data else None
+        cube = self._scan(output_parquet, skipped_years, from_month, to_month, workers, exporter)
+        cube.write(cube_dir)
+
+    def update_aggregate_store(
+        self,
+        input_files: str,
+        store_dir: str,
+        aggregate_store_dir: str,
+        cube_dir: str,
+        processed_file_list: Optional[str] = None,
+        use_content_hash: bool = False
+    ) -> None:
+        """
+        Adds the per-log Parquet files of this run to the incremental Parquet store and folds the store into the
+        day-partitioned aggregate store (see aggregate_store). Only the days of new, replaced or removed log
+        files are aggregated again; the cube of the whole history is then written from the day cubes.
+        :param input_files: Text file listing the per-log Parquet files produced in this run
+        :param store_dir: Incremental Parquet store (see merge_parquet_files)
+        :param aggregate_store_dir: Directory of the aggregate store
+        :param cube_dir: Output directory of the cube, read by analyze_parquet_files and the report
+        :param processed_file_list: get_log_files manifest of the logs parsed in this run
+        """
+        manifest = IngestionManifest(store_dir, use_content_hash=use_content_hash)
+        processed_logs = self.read_processed_log_files(processed_file_list) if processed_file_list else []
+        parquet_files = manifest.ingest(self.get_all_parquet_files(input_files), processed_logs)
+
+        store = AggregateStore(aggregate_store_dir)
+        store.update(parquet_files)
+        store.cube().write(cube_dir)
+
+    def _scan(
+        self,
+        output_parquet: str,
+        skipped_years: Optional[List[int]],
+        from_month: Optional[str],
+        to_month: Optional[str],
+        workers: Optional[int],
+        exporter: Optional[DataExporter]
+    ) -> AggregateCube:
+        """
+        Aggregates the Parquet data into a cube, exporting the records to all_data in the same pass.
+        Row groups are read and aggregated by a thread pool; the partial aggregates of every row group are merged
+        and all_data is written in row group order, so the output does not depend on the number of workers.
+        """
+        dataset = open_dataset(output_parquet)
+        row_filter = filter_expression(partition_filters(skipped_years, from_month, to_month))
+
+        # Check if bot classification columns exist in the schema
+        has_bot_columns = all(col in dataset.schema.names for col in self.BOT_COLUMNS)
+        cube = CubeBuilder(has_bot_columns)
+        columns = canonical_columns(dataset.schema)
+        units = self._analysis_units(dataset, row_filter)
+        workers = workers or available_cpus()
+        logger.info("Analyzing Parquet row groups", extra={"row_group_count": len(units), "workers": workers})
+
+        def analyze_unit(unit: ds.Fragment) -> Tuple[List[pa.RecordBatch], CubeBuilder]:
+            unit_cube = CubeBuilder(has_bot_columns)
+            unit_batches = []
+            for batch in unit.to_batches(schema=dataset.schema, columns=columns, filter=row_filter,
+                                         batch_size=self.batch_size):
+                batch = to_v1(batch.replace_schema_metadata(dataset.schema.metadata))
+                unit_cube.add(batch)
+                if exporter is not None:
+                    unit_batches.append(batch)
+            return unit_batches, unit_cube
+
+        try:
+            for unit_batches, unit_cube in self._map_ordered(analyze_unit, units, workers):
+                cube.merge(unit_cube)
+                # Export all_data incrementally
+                for batch in unit_batches:
+                    exporter.write(batch)
+        finally:
+            if exporter is not None:
+                exporter.close()
+        return cube.build()
+
+    def _project_download_counts(self, cube: AggregateCube) -> pd.DataFrame:
+        """
+        Downloads per accession, with the bot, hub and organic downloads if the data is bot classified.
+        """
+        counts = cube.counts
+        project_df = counts.groupby("accession", as_index=False)["count"].sum()
+        if cube.has_bot_columns:
+            classified = pd.DataFrame({"accession": counts["accession"]})
+            for flag, column in zip(self.BOT_COLUMNS, ["bot_count", "hub_count", "organic_count"]):
+                classified[column] = counts["count"].where(counts[flag] == True, 0)  # Flags may be null
+            bot_df = classified.groupby("accession", as_index=False).sum()
+            project_df = project_df.merge(bot_df, on="accession", how="left")
+            logger.info("Bot classification counts merged into project-level data", extra={"projects_with_bot_data": len(bot_df)})
+        return project_df
+
+    @staticmethod
+    def _analysis_units(dataset: ds.Dataset, row_filter: Optional[ds.Expression]) -> List[ds.Fragment]:
+        """
+        Row groups of the dataset (of every file of a partitioned dataset) that can match the filter.
+        """
+        return [
+            row_group
+            for fragment in dataset.get_fragments(filter=row_filter)
+            for row_group in fragment.split_by_row_group(filter=row_filter, schema=dataset.schema)
+        ]
+
+    @staticmethod
+    def _map_ordered(function: Callable[[T], R], items: List[T], workers: int) -> Iterator[R]:
+        """
+        Apply a function to the items in a thread pool and yield the results in item order.
+        At most `workers` items are processed ahead of the consumer, which bounds the memory held by results.
+        """
+        workers = max(1, int(workers))
+        remaining = iter(items)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending: Deque[Future] = deque(executor.submit(function, item) for item in itertools.islice(remaining, workers))
+            while pending:
+                result = pending.popleft().result()
+                next_item = next(remaining, None)
+                if next_item is not None:
+                    pending.append(executor.submit(function, next_item))
+                yield result
+
     def persist_project_level_download_counts(self, df: pd.DataFrame, output_file: str) -> None:
         # Calculate percentiles
         df["percentile"] = (rankdata(df["count"], method="average") / len(df) * 100).astype(int)
@@ -120,12 +256,50 @@ class ParquetAnalyzer(IParquetAnalyzer):
         logger.info("Project level download counts saved", extra={"output_file": output_file, "record_count": len(df)})
 
     def persist_file_level_download_counts(self, df: pd.DataFrame, output_file: str) -> None:
-        df.to_json(output_file, orient="records", lines=False)
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        values = [pandas_json_values(column) for column in table.columns]
+        if any(value is None for value in values):
+            df.to_json(output_file, orient="records", lines=False)
+        else:
+            # Same bytes as to_json, encoded with Arrow kernels
+            write_json_array(json_objects(table.column_names, values), output_file)
         logger.info("File level download counts saved", extra={"output_file": output_file, "record_count": len(df)})
 
     def persist_project_level_yearly_download_counts(self, df: pd.DataFrame, output_file: str) -> None:
         # Nest yearly counts under each accession
-        nested = (
+        df = df[df["accession"].notna()].sort_values("accession", kind="stable")  # Order of groupby("accession")
+        if df.empty:
+            write_json_array(pa.array([], pa.string()), output_file)
+            logger.info("Project level yearly download counts saved", extra={"output_file": output_file, "record_count": 0})
+            return
+
+        table = pa.Table.from_pandas(df[["accession", "year", "count"]], preserve_index=False)
+        accessions = pandas_json_values(table.column("accession"))
+        yearly_values = [pandas_json_values(table.column(name)) for name in ("year", "count")]
+        if accessions is None or any(value is None for value in yearly_values):
+            nested = self._nest_yearly_download_counts(df)
+            pd.DataFrame(nested).to_json(output_file, orient="records", lines=False)
+            logger.info("Project level yearly download counts saved", extra={"output_file": output_file, "record_count": len(nested)})
+            return
+
+        # Accession runs of the sorted rows: a list of {"year", "count"} objects per accession
+        codes, _ = pd.factorize(df["accession"].to_numpy())
+        starts = np.flatnonzero(np.diff(codes, prepend=-1)).astype(np.int32)
+        offsets = pa.array(np.append(starts, len(df)), pa.int32())
+        yearly = pa.ListArray.from_arrays(offsets, json_objects(["year", "count"], yearly_values))
+        nested = json_objects(
+            ["accession", "yearlyDownloads"],
+            [accessions.take(pa.array(starts)), pc.binary_join_element_wise("[", pc.binary_join(yearly, ","), "]", "")]
+        )
+        write_json_array(nested, output_file)
+        logger.info("Project level yearly download counts saved", extra={"output_file": output_file, "record_count": len(nested)})
+
+    @staticmethod
+    def _nest_yearly_download_counts(df: pd.DataFrame) -> List[dict]:
+        """
+        Nesting built per accession, for accessions that pandas escapes in JSON (see pandas_json_values).
+        """
+        return (
             df
             .groupby("accession")
             .apply(lambda x: {
@@ -135,9 +309,6 @@ class ParquetAnalyzer(IParquetAnalyzer):
             .tolist()
         )
 
-        pd.DataFrame(nested).to_json(output_file, orient="records", lines=False)
-        logger.info("Project level yearly download counts saved", extra={"output_file": output_file, "record_count": len(nested)})
-
     def get_all_parquet_files(self, file_list_path: str) -> List[str]:
         """Reads file paths from a text file and validates them as Parquet files."""
         with open(file_list_path, "r") as f:
@@ -148,33 +319,79 @@ class ParquetAnalyzer(IParquetAnalyzer):
             logger.warning("No valid Parquet files found", extra={"file_list_path": file_list_path})
         return all_parquet_files
 
-    def merge_parquet_files(self, input_files: str, output_parquet: str) -> None:
-        """Merges Parquet files in batches with schema consistency."""
+    @staticmethod
+    def read_processed_log_files(file_list_path: str) -> List[str]:
+        """Reads the log file paths (first column) of a get_log_files manifest."""
+        with open(file_list_path, "r") as f:
+            return [line.split("\t")[0].strip() for line in f if line.strip()]
+
+    def _iter_input_tables(self, all_files: List[str], version: int, workers: int) -> Iterator[pa.Table]:
+        """
+        Read the input files as Arrow tables in the canonical schema of the given version, in input order.
+        Up to `workers` files are read ahead by a thread pool (Parquet decoding releases the GIL), so at most
+        that many input files are held in memory besides the one being written.
+        """
+        schema = schema_for_version(version)
+
+        def read(file: str) -> pa.Table:
+            return convert(pq.read_table(file, use_threads=False), version).cast(schema)
+
+        return self._map_ordered(read, all_files, workers)
+
+    def merge_parquet_files(
+        self,
+        input_files: str,
+        output_parquet: str,
+        store_dir: Optional[str] = None,
+        processed_file_list: Optional[str] = None,
+        use_content_hash: bool = False,
+        partitioned: bool = False,
+        workers: int = DEFAULT_MERGE_WORKERS,
+        row_group_rows: int = ParquetWriter.DEFAULT_ROW_GROUP_ROWS,
+        row_group_bytes: int = ParquetWriter.DEFAULT_ROW_GROUP_BYTES
+    ) -> None:
+        """
+        Merges Parquet files in batches with schema consistency.
+        With a store_dir, the new per-log Parquet files are first added to the incremental store and all stored
+        files (including the ones from previous runs) are merged.
+        :param processed_file_list: get_log_files manifest of the logs parsed in this run, so logs without
+        relevant rows are recorded as ingested too
+        :param partitioned: Write output_parquet as a hive-partitioned directory (year=YYYY/month=M)
+        :param workers: Number of input files read ahead concurrently
+        :param row_group_rows: Target number of rows per row group of the merged file
+        :param row_group_bytes: Target in-memory size of a row group of the merged file
+        """
         try:
             all_files = self.get_all_parquet_files(input_files)
+            if store_dir:
+                manifest = IngestionManifest(store_dir, use_content_hash=use_content_hash)
+                processed_logs = self.read_processed_log_files(processed_file_list) if processed_file_list else []
+                all_files = manifest.ingest(all_files, processed_logs)
             if not all_files:
                 raise ParquetMergeError(
                     "No valid Parquet files found to merge",
                     input_files=input_files
                 )
 
-            writer = None
-            first_schema = None
-
-            for file in all_files:
-                file_iter = pq.ParquetFile(file).iter_batches(batch_size=self.batch_size)
-                for batch in file_iter:
-                    df = batch.to_pandas()
-
-                    if writer is None:
-                        first_schema = pa.Table.from_pandas(df).schema  # Capture schema from first batch
-                        writer = pq.ParquetWriter(output_parquet, first_schema)
+            # The merged file keeps the schema version of the first file, other files are converted to it
+            version = schema_version(pq.read_schema(all_files[0]))
+            tables = self._iter_input_tables(all_files, version, workers)
 
-                    table = pa.Table.from_pandas(df, schema=first_schema)  # Ensure schema consistency
-                    writer.write_table(table)
+            if partitioned:
+                if os.path.isdir(output_parquet):
+                    shutil.rmtree(output_parquet)
+                batches = (batch for table in tables for batch in table.to_batches())
+                write_partitioned(batches, output_parquet, schema_for_version(version), max_rows_per_group=row_group_rows)
+                logger.info("Merged Parquet dataset saved", extra={"output_dir": output_parquet, "input_file_count": len(all_files)})
+                return
 
-            if writer:
-                writer.close()
+            # Small per-log inputs are coalesced into large row groups by the writer
+            writer = ParquetWriter(output_parquet, write_strategy='batch', schema_version=version,
+                                   row_group_rows=row_group_rows, row_group_bytes=row_group_bytes)
+            for table in tables:
+                for batch in table.to_batches():
+                    writer.write_record_batch(batch)
+            writer.finalize()
             logger.info("Merged Parquet dataset saved", extra={"output_file": output_parquet, "input_file_count": len(all_files)})
         except (IOError, OSError, pa.ArrowInvalid) as e:
             error = ParquetMergeError(
@@ -0,0 +1,110 @@
+"""
+Reading and writing the merged download dataset, either a single Parquet file or a hive-partitioned
+directory (year=YYYY/month=M/*.parquet).
+
+Readers pass the year and month window as partition filters, so excluded partitions are never opened
+(and row groups of a single file are skipped through their statistics).
+"""
+import itertools
+import logging
+import os
+from typing import Iterable, List, Optional, Tuple
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from exceptions import ValidationError
+from parquet_schema import SCHEMA_V1, SCHEMA_V2
+
+logger = logging.getLogger(__name__)
+
+PARTITION_COLUMNS = ("year", "month")
+PARTITIONING = ds.partitioning(pa.schema([("year", pa.int16()), ("month", pa.int8())]), flavor="hive")
+
+Filters = List[List[Tuple]]
+
+
+def is_partitioned(path: str) -> bool:
+    """A partitioned dataset is a directory, the monolithic dataset a single file."""
+    return os.path.isdir(path)
+
+
+def open_dataset(path: str) -> ds.Dataset:
+    """
+    Open a single Parquet file or a hive-partitioned directory.
+    """
+    return ds.dataset(path, format="parquet", partitioning=PARTITIONING if is_partitioned(path) else None)
+
+
+def canonical_columns(schema: pa.Schema) -> List[str]:
+    """
+    Column names in schema order: partition columns are read back at the end of a partitioned dataset,
+    this puts them back where the writer schema has them.
+    """
+    reference = SCHEMA_V2 if "lat" in schema.names else SCHEMA_V1
+    names = [name for name in reference.names if name in schema.names]
+    return names + [name for name in schema.names if name not in names]
+
+
+def parse_month(value: str) -> Tuple[int, int]:
+    """
+    Parse a YYYY-MM month.
+    """
+    try:
+        year, month = (int(part) for part in value.split("-"))
+        if not 1 <= month <= 12:
+            raise ValueError(f"month out of range: {month}")
+        return year, month
+    except ValueError as e:
+        raise ValidationError(f"Month must be in YYYY-MM format, got: {value}", field="month", value=value,
+                              original_error=str(e))
+
+
+def partition_filters(
+    skipped_years: Optional[List[int]] = None,
+    from_month: Optional[str] = None,
+    to_month: Optional[str] = None
+) -> Optional[Filters]:
+    """
+    Filters on the year and month columns in disjunctive normal form (as accepted by dask and pyarrow).
+    :param skipped_years: Years to leave out
+    :param from_month: First month to include (YYYY-MM)
+    :param to_month: Last month to include (YYYY-MM)
+    :return: List of AND-ed filter lists that are OR-ed together, or None if nothing is filtered
+    """
+    lower: List[List[Tuple]] = [[]]
+    upper: List[List[Tuple]] = [[]]
+    if from_month:
+        year, month = parse_month(from_month)
+        lower = [[("year", ">", year)], [("year", "=", year), ("month", ">=", month)]]
+    if to_month:
+        year, month = parse_month(to_month)
+        upper = [[("year", "<", year)], [("year", "=", year), ("month", "<=", month)]]
+    skipped = [("year", "not in", sorted({int(y) for y in skipped_years}))] if skipped_years else []
+
+    filters = [low + up + skipped for low, up in itertools.product(lower, upper)]
+    return filters if any(filters) else None
+
+
+def filter_expression(filters: Optional[Filters]) -> Optional[ds.Expression]:
+    return pq.filters_to_expression(filters) if filters else None
+
+
+def write_partitioned(batches: Iterable[pa.RecordBatch], output_dir: str, schema: pa.Schema,
+                      compression: str = "snappy", max_rows_per_group: int = 1024 * 1024) -> None:
+    """
+    Write record batches as a hive-partitioned dataset (year=YYYY/month=M), replacing the partitions written to.
+    """
+    ds.write_dataset(
+        batches,
+        output_dir,
+        schema=schema,
+        format="parquet",
+        partitioning=PARTITIONING,
+        existing_data_behavior="delete_matching",
+        file_options=ds.ParquetFileFormat().make_write_options(compression=compression),
+        max_rows_per_group=max_rows_per_group,
+        min_rows_per_group=min(max_rows_per_group, 128 * 1024),
+    )
+    logger.info("Partitioned dataset written", extra={"output_dir": output_dir})
@@ -1,5 +1,5 @@
 import logging
-from typing import Optional
+from typing import Iterator, List, Optional
 import pyarrow.parquet as pq
 import pyarrow as pa
 
@@ -8,6 +8,8 @@ from exceptions import (
     ValidationError
 )
 from interfaces import IParquetReader
+from parquet_dataset import canonical_columns, open_dataset
+from parquet_schema import to_v1
 
 logger = logging.getLogger(__name__)
 
@@ -15,6 +17,7 @@ logger = logging.getLogger(__name__)
 class ParquetReader(IParquetReader):
     """
     Read parquet file
+    Files written with the compact schema (version 2) are returned in the version 1 layout.
     """
 
     def __init__(self, parquet_path: Optional[str] = None) -> None:
@@ -31,7 +34,7 @@ class ParquetReader(IParquetReader):
 
         try:
             # Read the dataset (directory of Parquet files)
-            read_table = pq.read_table(parquet_path)
+            read_table = to_v1(pq.read_table(parquet_path))
         except (IOError, OSError, FileNotFoundError) as e:
             error = ParquetReadError(
                 f"Failed to read Parquet file: {parquet_path}",
@@ -55,3 +58,24 @@ class ParquetReader(IParquetReader):
         logger.debug("Parquet data preview", extra={"row_count": len(read_table.to_pandas())})
 
         return read_table
+
+    @staticmethod
+    def iter_batches(parquet_path: str, batch_size: int, columns: Optional[List[str]] = None) -> Iterator[pa.RecordBatch]:
+        """
+        Read a Parquet file or partitioned dataset batch by batch in the version 1 layout, whatever schema
+        version it was written in.
+        :param parquet_path: Path to the Parquet file or partitioned dataset directory
+        :param batch_size: Number of rows per batch
+        :param columns: Optional version 1 column names to read
+        :return: Generator of record batches
+        """
+        dataset = open_dataset(parquet_path)
+        names = canonical_columns(dataset.schema)
+        source_columns = names
+        if columns is not None:
+            # geo_location is stored as lat/lon in version 2 files
+            source_columns = [c for c in columns if c in names]
+            if "geo_location" in columns and "geo_location" not in names:
+                source_columns += [c for c in ("lat", "lon") if c in names]
+        for batch in dataset.to_batches(columns=source_columns, batch_size=batch_size):
+            yield to_v1(batch.replace_schema_metadata(dataset.schema.metadata))
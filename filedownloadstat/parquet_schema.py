@@ -0,0 +1,180 @@
+"""
+Schemas of the per-log and merged Parquet files.
+
+Version 1 is the original layout (string timestamp and "lat,lon" geo_location). Version 2 is an opt-in compact
+layout: typed timestamp[us, UTC], float32 lat/lon and dictionary-encoded low cardinality columns. Version 2 files
+carry their version in the schema metadata; readers convert them back with to_v1() so every consumer sees
+the version 1 columns regardless of how the file was written.
+"""
+import logging
+from typing import Dict, List, Optional, Union
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from exceptions import ValidationError
+from timestamp_decoder import TimestampDecoder
+
+logger = logging.getLogger(__name__)
+
+# pandas dtype of the string columns: Arrow-backed strings instead of Python objects
+STRING_DTYPE = pd.StringDtype("pyarrow")
+
+SCHEMA_VERSION_KEY = "filedownloadstat.schema_version"
+SCHEMA_VERSIONS = (1, 2)
+
+# Define schema with metadata
+SCHEMA_V1 = pa.schema([
+    pa.field('date', pa.date64(), metadata={'description': 'Date that the dataset was downloaded'}),
+    pa.field('year', pa.int16(), metadata={'description': 'Year that the dataset was downloaded'}),
+    pa.field('month', pa.int8(), metadata={'description': 'Month that the dataset was downloaded'}),
+    pa.field('user', pa.string(), metadata={'description': 'Hash representing the user'}),
+    pa.field('accession', pa.string(), metadata={'description': 'PRIDE accession started with PXD'}),
+    pa.field('filename', pa.string(), metadata={'description': 'Filename of the file downloaded'}),
+    pa.field('completed', pa.string(), metadata={'description': 'Check if the file download was completed'}),
+    pa.field('country', pa.string(), metadata={'description': 'Country of the file downloaded'}),
+    pa.field('method', pa.string(), metadata={'description': 'Download method such as FTP/Aspera/Globus'}),
+    pa.field('timestamp', pa.string(), metadata={'description': 'Original timestamp string from the log file'}),
+    pa.field('geoip_region_name', pa.string(), metadata={'description': 'GeoIP region name (e.g., state, province)'}),
+    pa.field('geoip_city_name', pa.string(), metadata={'description': 'GeoIP city name'}),
+    pa.field('geo_location', pa.string(), metadata={'description': 'Geographic location coordinates (latitude,longitude)'}),
+])
+
+DICTIONARY_TYPE = pa.dictionary(pa.int32(), pa.string())
+
+SCHEMA_V2 = pa.schema([
+    pa.field('timestamp', pa.timestamp('us', tz='UTC'), metadata={'description': 'Download time (UTC)'}),
+    pa.field('date', pa.date32(), metadata={'description': 'Date that the dataset was downloaded'}),
+    pa.field('year', pa.int16(), metadata={'description': 'Year that the dataset was downloaded'}),
+    pa.field('month', pa.int8(), metadata={'description': 'Month that the dataset was downloaded'}),
+    pa.field('user', pa.string(), metadata={'description': 'Hash representing the user'}),
+    pa.field('accession', pa.string(), metadata={'description': 'PRIDE accession started with PXD'}),
+    pa.field('filename', pa.string(), metadata={'description': 'Filename of the file downloaded'}),
+    pa.field('completed', DICTIONARY_TYPE, metadata={'description': 'Check if the file download was completed'}),
+    pa.field('country', DICTIONARY_TYPE, metadata={'description': 'Country of the file downloaded'}),
+    pa.field('method', DICTIONARY_TYPE, metadata={'description': 'Download method such as FTP/Aspera/Globus'}),
+    pa.field('geoip_region_name', DICTIONARY_TYPE, metadata={'description': 'GeoIP region name (e.g., state, province)'}),
+    pa.field('geoip_city_name', DICTIONARY_TYPE, metadata={'description': 'GeoIP city name'}),
+    pa.field('lat', pa.float32(), metadata={'description': 'Latitude of the GeoIP location'}),
+    pa.field('lon', pa.float32(), metadata={'description': 'Longitude of the GeoIP location'}),
+]).with_metadata({SCHEMA_VERSION_KEY: "2"})
+
+GEO_LOCATION_PATTERN = r"^\s*[-+]?\d+(\.\d+)?\s*,\s*[-+]?\d+(\.\d+)?\s*$"
+
+TableOrBatch = Union[pa.Table, pa.RecordBatch]
+
+
+def schema_version(schema: pa.Schema) -> int:
+    """
+    Schema version of a Parquet file schema (files without the version key are version 1).
+    """
+    metadata = schema.metadata or {}
+    version = metadata.get(SCHEMA_VERSION_KEY.encode("utf-8"))
+    return int(version) if version else 1
+
+
+def validate_schema_version(version: int) -> int:
+    version = int(version)
+    if version not in SCHEMA_VERSIONS:
+        raise ValidationError(f"schema_version must be one of {SCHEMA_VERSIONS}, got: {version}",
+                              field="schema_version", value=version)
+    return version
+
+
+def schema_for_version(version: int, metadata: Optional[Dict[str, str]] = None) -> pa.Schema:
+    """
+    Output schema of a version, with additional key-value metadata.
+    """
+    schema = SCHEMA_V2 if validate_schema_version(version) == 2 else SCHEMA_V1
+    if metadata:
+        existing = {key.decode(): value.decode() for key, value in (schema.metadata or {}).items()}
+        schema = schema.with_metadata({**existing, **metadata})
+    return schema
+
+
+def _columns(data: TableOrBatch) -> Dict[str, Union[pa.Array, pa.ChunkedArray]]:
+    return {name: data.column(name) for name in data.schema.names}
+
+
+def _build(data: TableOrBatch, columns: Dict[str, Union[pa.Array, pa.ChunkedArray]], schema: pa.Schema) -> TableOrBatch:
+    # Columns that were not read are left out, extra columns (eg: is_bot added by the bot classifier)
+    # are kept after the schema columns
+    fields = [field for field in schema if field.name in columns]
+    known_columns = set(SCHEMA_V1.names) | set(SCHEMA_V2.names)
+    fields += [data.schema.field(name) for name in data.schema.names if name not in known_columns]
+    arrays = [columns[field.name] for field in fields]
+    output_schema = pa.schema(fields, metadata=schema.metadata)
+    if isinstance(data, pa.Table):
+        return pa.Table.from_arrays(arrays, schema=output_schema)
+    return pa.RecordBatch.from_arrays(arrays, schema=output_schema)
+
+
+def to_v2(data: TableOrBatch) -> TableOrBatch:
+    """
+    Convert version 1 rows to the compact version 2 layout.
+    Unparsable geo_location values become null lat/lon.
+    """
+    columns = _columns(data)
+    geo_location = columns.pop("geo_location")
+
+    columns["timestamp"] = TimestampDecoder.decode_timestamp_column(columns["timestamp"])
+    columns["date"] = pc.cast(columns["date"], pa.date32())
+    for name in dictionary_columns(SCHEMA_V2):
+        columns[name] = pc.dictionary_encode(columns[name])
+
+    # "lat,lon" -> lat, lon
+    valid = pc.match_substring_regex(geo_location, pattern=GEO_LOCATION_PATTERN)
+    coordinates = pc.split_pattern(pc.if_else(valid, geo_location, pa.scalar(None, pa.string())), pattern=",",
+                                   max_splits=1)
+    columns["lat"] = pc.cast(pc.utf8_trim_whitespace(pc.list_element(coordinates, 0)), pa.float32())
+    columns["lon"] = pc.cast(pc.utf8_trim_whitespace(pc.list_element(coordinates, 1)), pa.float32())
+    return _build(data, columns, SCHEMA_V2)
+
+
+def to_v1(data: TableOrBatch) -> TableOrBatch:
+    """
+    Convert rows of any schema version to the version 1 layout. Version 1 input is returned unchanged.
+    Only the columns present are converted, so a column subset can be read. The timestamp string is rebuilt
+    with microsecond precision (eg: 2024-09-13T23:58:17.000000Z).
+    """
+    if schema_version(data.schema) == 1:
+        return data
+
+    columns = _columns(data)
+    if "timestamp" in columns:
+        columns["timestamp"] = pc.strftime(columns["timestamp"], format="%Y-%m-%dT%H:%M:%SZ")
+    if "date" in columns:
+        columns["date"] = pc.cast(columns["date"], pa.date64())
+    for name in dictionary_columns(SCHEMA_V2):
+        if name in columns:
+            columns[name] = pc.cast(columns[name], pa.string())
+    if "lat" in columns and "lon" in columns:
+        lat, lon = (pc.cast(columns.pop(name), pa.string()) for name in ("lat", "lon"))
+        columns["geo_location"] = pc.fill_null(pc.binary_join_element_wise(lat, lon, ","), "")
+    return _build(data, columns, SCHEMA_V1)
+
+
+def convert(data: TableOrBatch, version: int) -> TableOrBatch:
+    """
+    Convert rows to the given schema version.
+    """
+    if validate_schema_version(version) == schema_version(data.schema):
+        return data
+    v1 = to_v1(data)
+    return to_v2(v1) if version == 2 else v1
+
+
+def dictionary_columns(schema: pa.Schema) -> List[str]:
+    """
+    Names of the dictionary-encoded columns of a schema.
+    """
+    return [field.name for field in schema if pa.types.is_dictionary(field.type)]
+
+
+def to_pandas(table: pa.Table) -> pd.DataFrame:
+    """
+    DataFrame of a table with the string columns as STRING_DTYPE, kept in Arrow buffers instead of being
+    converted to Python objects.
+    """
+    return table.to_pandas(types_mapper={pa.string(): STRING_DTYPE, pa.large_string(): STRING_DTYPE}.get)
@@ -1,5 +1,5 @@
 import logging
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Union
 import pyarrow.parquet as pq
 import pyarrow as pa
 
@@ -8,40 +8,91 @@ from exceptions import (
     ValidationError
 )
 from interfaces import IParquetWriter
+from parquet_schema import SCHEMA_V1, convert, schema_for_version
 
 logger = logging.getLogger(__name__)
 
 
+class ColumnarBatchBuilder:
+    """
+    Accumulate parsed values per column and build record batches from them.
+    Appending never copies the values already buffered, and batches are built without per-row dicts.
+    """
+
+    def __init__(self, schema: pa.Schema) -> None:
+        self.schema: pa.Schema = schema
+        self.columns: Dict[str, List[Any]] = {name: [] for name in schema.names}
+        self.num_rows: int = 0
+
+    def append_rows(self, rows: List[Dict[str, Any]]) -> None:
+        """
+        Append rows given as dicts (missing keys become null).
+        """
+        for name, column in self.columns.items():
+            column.extend([row.get(name) for row in rows])
+        self.num_rows += len(rows)
+
+    def append_columns(self, columns: Dict[str, List[Any]]) -> None:
+        """
+        Append a batch given as a dict of equally long column lists (missing columns become null).
+        """
+        num_rows = len(next(iter(columns.values()), []))
+        for name, column in self.columns.items():
+            values = columns.get(name)
+            if values is None:
+                column.extend([None] * num_rows)
+            elif len(values) != num_rows:
+                raise ValidationError(f"Column {name} has {len(values)} values, expected {num_rows}",
+                                      field=name, value=len(values))
+            else:
+                column.extend(values)
+        self.num_rows += num_rows
+
+    def build(self) -> pa.RecordBatch:
+        """
+        Build a record batch from all buffered values and reset the builder.
+        """
+        batch = pa.RecordBatch.from_arrays(
+            [pa.array(self.columns[field.name], type=field.type) for field in self.schema],
+            schema=self.schema
+        )
+        self.columns = {name: [] for name in self.schema.names}
+        self.num_rows = 0
+        return batch
+
+
 class ParquetWriter(IParquetWriter):
     """
     Write parquet file
     """
-    # Define schema with metadata
-    schema = pa.schema([
-        pa.field('date', pa.date64(), metadata={'description': 'Date that the dataset was downloaded'}),
-        pa.field('year', pa.int16(), metadata={'description': 'Year that the dataset was downloaded'}),
-        pa.field('month', pa.int8(), metadata={'description': 'Month that the dataset was downloaded'}),
-        pa.field('user', pa.string(), metadata={'description': 'Hash representing the user'}),
-        pa.field('accession', pa.string(), metadata={'description': 'PRIDE accession started with PXD'}),
-        pa.field('filename', pa.string(), metadata={'description': 'Filename of the file downloaded'}),
-        pa.field('completed', pa.string(), metadata={'description': 'Check if the file download was completed'}),
-        pa.field('country', pa.string(), metadata={'description': 'Country of the file downloaded'}),
-        pa.field('method', pa.string(), metadata={'description': 'Download method such as FTP/Aspera/Globus'}),
-        pa.field('timestamp', pa.string(), metadata={'description': 'Original timestamp string from the log file'}),
-        pa.field('geoip_region_name', pa.string(), metadata={'description': 'GeoIP region name (e.g., state, province)'}),
-        pa.field('geoip_city_name', pa.string(), metadata={'description': 'GeoIP city name'}),
-        pa.field('geo_location', pa.string(), metadata={'description': 'Geographic location coordinates (latitude,longitude)'}),
-    ])
+    # Version 1 schema, the parsers produce rows in this schema
+    schema = SCHEMA_V1
 
     COMPRESSION = 'snappy'
+    DEFAULT_ROW_GROUP_ROWS = 1000000
+    DEFAULT_ROW_GROUP_BYTES = 128 * 1024 * 1024
 
-    def __init__(self, parquet_path: str, write_strategy: str = 'all', batch_size: int = 10000) -> None:
+    def __init__(
+        self,
+        parquet_path: str,
+        write_strategy: str = 'all',
+        batch_size: int = 10000,
+        metadata: Optional[Dict[str, str]] = None,
+        row_group_rows: int = DEFAULT_ROW_GROUP_ROWS,
+        row_group_bytes: int = DEFAULT_ROW_GROUP_BYTES,
+        schema_version: int = 1
+    ) -> None:
         """
         Initialize ParquetWriter.
 
         :param parquet_path: Path to the Parquet file/directory.
         :param write_strategy: Writing strategy ('all' or 'batch').
-        :param batch_size: Batch size for batch-wise writing.
+        :param batch_size: Batch size for batch-wise writing (number of rows converted to a record batch at a time).
+        :param metadata: Optional key-value metadata stored in the file schema (eg: source_log_file).
+        :param row_group_rows: Batches are accumulated and written as one row group once this many rows are buffered.
+        :param row_group_bytes: Batches are also written once their in-memory size reaches this many bytes.
+        :param schema_version: 1 writes ParquetWriter.schema, 2 converts the rows to the compact schema
+        (see parquet_schema.SCHEMA_V2) before writing.
         """
         if not parquet_path:
             raise ValidationError("parquet_path is required", field="parquet_path")
@@ -50,7 +101,17 @@ class ParquetWriter(IParquetWriter):
         self.write_strategy: str = write_strategy.lower()
         self.batch_size: int = batch_size
         self.parquet_writer: Optional[pq.ParquetWriter] = None
-        self.batch_data: List[Dict[str, Any]] = []
+        self.schema_version: int = int(schema_version)
+        self.schema = schema_for_version(self.schema_version, metadata)  # Schema of the written file
+        self.batch_builder: ColumnarBatchBuilder = ColumnarBatchBuilder(ParquetWriter.schema)
+        self.row_group_rows: int = int(row_group_rows)
+        self.row_group_bytes: int = int(row_group_bytes)
+        if self.row_group_rows <= 0 or self.row_group_bytes <= 0:
+            raise ValidationError("row_group_rows and row_group_bytes must be positive", field="row_group_rows",
+                                  value=(row_group_rows, row_group_bytes))
+        self.row_group_batches: List[pa.RecordBatch] = []
+        self.row_group_buffered_rows: int = 0
+        self.row_group_buffered_bytes: int = 0
 
     # METHOD 1
     def write_all(self, data: List[Dict[str, Any]]) -> bool:
@@ -61,7 +122,7 @@ class ParquetWriter(IParquetWriter):
         """
         try:
             # Convert data to PyArrow Table
-            table = pa.Table.from_pylist(data, schema=self.schema)
+            table = self._to_output_schema(pa.Table.from_pylist(data, schema=ParquetWriter.schema))
             if len(table) > 0:
                 # Write to Parquet
                 pq.write_to_dataset(
@@ -89,24 +150,35 @@ class ParquetWriter(IParquetWriter):
             raise error
 
     # METHOD 2
-    def write_batch(self, data: List[Dict[str, Any]]) -> bool:
+    def write_batch(self, data: Union[List[Dict[str, Any]], Dict[str, List[Any]], pa.RecordBatch]) -> bool:
         """
         Write data in batches to a Parquet file.
 
-        :param data: List of dictionaries representing the data.
+        :param data: List of dictionaries representing the data, a dict of column lists
+        (eg: from LogFileParser.parse_gzipped_tsv_columns) or a record batch in the writer schema.
         """
 
         try:
+            if isinstance(data, pa.RecordBatch):
+                # Keep the row order: rows buffered before the record batch are written first
+                if self.batch_builder.num_rows:
+                    self._write_current_batch()
+                return self.write_record_batch(data)
+
             # Add new data to the current batch
-            self.batch_data.extend(data)
-            data_written = False
+            if isinstance(data, dict):
+                self.batch_builder.append_columns(data)
+            else:
+                self.batch_builder.append_rows(data)
 
             # If batch size is reached, write the batch
-            while len(self.batch_data) >= self.batch_size:
+            if self.batch_builder.num_rows >= self.batch_size:
                 self._write_current_batch()
-                data_written = True
-            return data_written
+                return True
+            return False
 
+        except ParquetWriteError:
+            raise
         except (pa.ArrowInvalid, IOError, OSError) as e:
             error = ParquetWriteError(
                 f"Failed to write batch to Parquet file: {self.parquet_path}",
@@ -124,33 +196,89 @@ class ParquetWriter(IParquetWriter):
             logger.error("Error during write_batch", extra={"parquet_path": self.parquet_path, "error": str(e)}, exc_info=True)
             raise error
 
-    def _write_current_batch(self) -> None:
+    def write_columns(self, columns: Dict[str, List[Any]]) -> bool:
         """
-        Write the current batch to the Parquet file.
+        Write a batch of column lists (eg: from LogFileParser.parse_gzipped_tsv_columns), see write_batch.
+        """
+        return self.write_batch(columns)
+
+    # METHOD 3
+    def write_record_batch(self, batch: pa.RecordBatch) -> bool:
+        """
+        Write a record batch that is already in the writer schema (eg: from the arrow parse engine).
+
+        :param batch: RecordBatch in either schema version, converted to the output schema version when needed
         """
         try:
-            # Create a RecordBatch from the current batch data
-            batch = pa.RecordBatch.from_pylist(self.batch_data[:self.batch_size], schema=self.schema)
+            if batch.num_rows == 0:
+                return False
+            self._buffer_record_batch(batch)
+            return True
+        except (pa.ArrowInvalid, IOError, OSError) as e:
+            error = ParquetWriteError(
+                f"Failed to write record batch to Parquet file: {self.parquet_path}",
+                parquet_path=self.parquet_path,
+                batch_size=batch.num_rows,
+                original_error=str(e)
+            )
+            logger.error("Error during write_record_batch", extra={"parquet_path": self.parquet_path, "error": str(e)}, exc_info=True)
+            raise error
+
+    def _to_output_schema(self, data: Union[pa.Table, pa.RecordBatch]) -> Union[pa.Table, pa.RecordBatch]:
+        """
+        Convert rows to the schema version of the file.
+        """
+        return convert(data, self.schema_version).replace_schema_metadata(self.schema.metadata)
+
+    def _buffer_record_batch(self, batch: pa.RecordBatch) -> None:
+        """
+        Add a record batch to the current row group and write the row group once it reaches its target size.
+        Parse batches are usually small, writing each one as its own row group would bloat the footer.
+        """
+        batch = self._to_output_schema(batch)
+        self.row_group_batches.append(batch)
+        self.row_group_buffered_rows += batch.num_rows
+        self.row_group_buffered_bytes += batch.nbytes
+        if self.row_group_buffered_rows >= self.row_group_rows or self.row_group_buffered_bytes >= self.row_group_bytes:
+            self._write_row_group()
+
+    def _write_row_group(self) -> None:
+        """
+        Write the buffered record batches as a row group (split at row_group_rows rows).
+        """
+        if not self.row_group_batches:
+            return
+
+        # Initialize the writer lazily
+        if self.parquet_writer is None:
+            self.parquet_writer = pq.ParquetWriter(self.parquet_path, schema=self.schema,
+                                                   compression=self.COMPRESSION)
 
-            # Initialize the writer lazily
-            if self.parquet_writer is None:
-                self.parquet_writer = pq.ParquetWriter(self.parquet_path, schema=self.schema,
-                                                       compression=self.COMPRESSION)
+        table = pa.Table.from_batches(self.row_group_batches, schema=self.schema)
+        self.parquet_writer.write_table(table, row_group_size=self.row_group_rows)
+        self.row_group_batches = []
+        self.row_group_buffered_rows = 0
+        self.row_group_buffered_bytes = 0
 
-            # Write the batch
-            self.parquet_writer.write_batch(batch)
+    def _write_current_batch(self) -> None:
+        """
+        Write the current batch to the Parquet file.
+        """
+        try:
+            # Create a RecordBatch from the buffered columns
+            batch = self.batch_builder.build()
 
-            # Remove written data from the batch
-            self.batch_data = self.batch_data[self.batch_size:]
+            # Add the batch to the current row group
+            self._buffer_record_batch(batch)
 
         except (pa.ArrowInvalid, IOError, OSError) as e:
             error = ParquetWriteError(
                 f"Failed to write current batch: {self.parquet_path}",
                 parquet_path=self.parquet_path,
-                batch_size=len(self.batch_data[:self.batch_size]),
+                batch_size=self.batch_builder.num_rows,
                 original_error=str(e)
             )
-            logger.error("Error during _write_current_batch", extra={"parquet_path": self.parquet_path, "batch_size": len(self.batch_data[:self.batch_size]), "error": str(e)}, exc_info=True)
+            logger.error("Error during _write_current_batch", extra={"parquet_path": self.parquet_path, "batch_size": self.batch_builder.num_rows, "error": str(e)}, exc_info=True)
             raise error
         except Exception as e:
             error = ParquetWriteError(
@@ -158,7 +286,7 @@ class ParquetWriter(IParquetWriter):
                 parquet_path=self.parquet_path,
                 original_error=str(e)
             )
-            logger.error("Error during _write_current_batch", extra={"parquet_path": self.parquet_path, "batch_size": len(self.batch_data[:self.batch_size]), "error": str(e)}, exc_info=True)
+            logger.error("Error during _write_current_batch", extra={"parquet_path": self.parquet_path, "batch_size": self.batch_builder.num_rows, "error": str(e)}, exc_info=True)
             raise error
 
     def finalize(self) -> bool:
@@ -169,10 +297,15 @@ class ParquetWriter(IParquetWriter):
         data_written = False
         try:
             # Write remaining data if any
-            if self.batch_data and self.write_strategy == 'batch':
+            if self.batch_builder.num_rows and self.write_strategy == 'batch':
                 self._write_current_batch()
                 data_written = True
 
+            # Write the last (partial) row group
+            if self.row_group_batches:
+                self._write_row_group()
+                data_written = True
+
             # Close the writer
             if self.parquet_writer:
                 self.parquet_writer.close()
@@ -1,23 +1,57 @@
 import logging
 from pathlib import Path
-from typing import List, Optional
-
+from typing import Any, Dict, List, Optional, Tuple
+
+from aggregate_cube import (
+    USER_COLUMN,
+    USERS_BY_COUNTRY_YEAR_KEYS,
+    USERS_BY_DATE_KEYS,
+    AggregateCube,
+    UserSketch,
+    is_cube,
+)
+from exceptions import ValidationError
 from stat_types import ProjectStat, RegionalStat, TrendsStat, UserStat, BotStat
+from parquet_dataset import PARTITION_COLUMNS, is_partitioned, partition_filters
+from parquet_schema import SCHEMA_V1, STRING_DTYPE, dictionary_columns
 from report_util import Report
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import dask
 import dask.dataframe as dd
 
 logger = logging.getLogger(__name__)
 
+# Dask schedulers of the report computation
+REPORT_SCHEDULERS = ("threads", "processes", "synchronous")
+DEFAULT_SCHEDULER = "threads"
+# Target (uncompressed) size of a Dask partition of the Parquet input, made of whole row groups
+DEFAULT_PARTITION_SIZE = "64MiB"
+
+
+def _user_sketch_rows(pdf: pd.DataFrame, keys: List[str]) -> pd.DataFrame:
+    """Distinct user sketches of a partition, as the rows of UserSketch.to_table."""
+    sketch = UserSketch(keys)
+    sketch.add(pa.Table.from_pandas(pdf[keys + [USER_COLUMN]], preserve_index=False))
+    return sketch.to_table().to_pandas()
+
+
+def _merge_sketch_rows(rows: pd.DataFrame) -> UserSketch:
+    """Merge the partition sketches of _user_sketch_rows."""
+    return UserSketch.from_table(pa.Table.from_pandas(rows, preserve_index=False))
+
+
 class ReportStat:
+    """
+    Report statistics. The aggregates are computed from the raw records with Dask or read from an aggregate
+    cube (see aggregate_cube) into the same pandas frames, which the stat sections render.
+    """
 
     @staticmethod
-    def project_stat(df: dd.DataFrame, baseurl: str) -> None:
+    def project_stat(stats: Dict[str, pd.DataFrame], baseurl: str) -> None:
         # --------------- 1. yearly_downloads ---------------
-        yearly_downloads = df.groupby(["year", "method"]).size().reset_index()
-        yearly_downloads.columns = ["year", "method", "count"]
-        yearly_downloads = yearly_downloads.compute()
-
+        yearly_downloads = stats["yearly_downloads"]
         yearly_totals = yearly_downloads.groupby("year", as_index=False)["count"].sum()
         yearly_totals["method"] = "Total"
 
@@ -25,18 +59,9 @@ class ReportStat:
         ProjectStat.yearly_download(combined_data)
 
         # --------------- 2. Monthly_downloads ---------------
-        df_with_my = df.assign(
-            month_year=df['year'].astype(str) + '-' + df['month'].astype(str).str.zfill(2)
-        )
-
-        total_downloads = df_with_my.groupby('month_year').size().reset_index()
-        total_downloads.columns = ['month_year', 'count']
-        total_downloads = total_downloads.compute()
+        total_downloads = stats["monthly_totals"].copy()
         total_downloads['method'] = 'Total'
-
-        downloads_by_method = df_with_my.groupby(['month_year', 'method']).size().reset_index()
-        downloads_by_method.columns = ['month_year', 'method', 'count']
-        downloads_by_method = downloads_by_method.compute()
+        downloads_by_method = stats["monthly_downloads"]
 
         unique_month_years = sorted(set(total_downloads['month_year'].unique()) |
                                      set(downloads_by_method['month_year'].unique()))
@@ -52,10 +77,7 @@ class ReportStat:
         ProjectStat.cumulative_download(monthly_downloads)
 
         # --------------- 4.1 download count histogram ---------------
-        download_counts = df.groupby("accession").size().reset_index()
-        download_counts.columns = ["accession", "download_count"]
-        download_counts = download_counts.compute()
-
+        download_counts = stats["download_counts"]
         filtered_download_counts = download_counts[download_counts["download_count"] <= 10000]
         download_distribution = filtered_download_counts.groupby("download_count").size().reset_index(
             name="num_projects")
@@ -66,66 +88,210 @@ class ReportStat:
         ProjectStat.top_downloaded_projects(download_counts, baseurl)
 
     @staticmethod
-    def trends_stat(df: dd.DataFrame) -> None:
-        daily_data = df.groupby(['date', 'method']).size().reset_index()
-        daily_data.columns = ['date', 'method', 'count']
-        daily_data = daily_data.compute()
+    def trends_stat(stats: Dict[str, pd.DataFrame]) -> None:
+        daily_data = stats["daily_downloads"].copy()
         daily_data['date'] = pd.to_datetime(daily_data['date'])
         TrendsStat.download_over_trends(daily_data)
 
     @staticmethod
-    def regional_stats(df: dd.DataFrame) -> None:
-        choropleth_data = df.groupby(['country', 'year']).size().reset_index()
-        choropleth_data.columns = ['country', 'year', 'count']
-        choropleth_data = choropleth_data.compute()
-        choropleth_data = choropleth_data.sort_values(by='year')
+    def regional_stats(stats: Dict[str, pd.DataFrame]) -> None:
+        choropleth_data = stats["country_downloads"].sort_values(by='year')
         RegionalStat.download_by_country(choropleth_data)
 
     @staticmethod
-    def user_stats(df: dd.DataFrame) -> None:
-        user_data = df.groupby(['date', 'year', 'month'])['user'].nunique().reset_index()
-        user_data = user_data.compute()
+    def user_stats(stats: Dict[str, pd.DataFrame]) -> None:
+        user_data = stats["daily_users"].copy()
         user_data['date'] = pd.to_datetime(user_data['date'])
         UserStat.unique_users_over_time(user_data)
 
-        country_user_data = df.groupby(['country', 'year'])['user'].nunique().reset_index()
-        country_user_data = country_user_data.compute()
-        country_user_data = country_user_data.sort_values(by='year')
+        country_user_data = stats["country_users"].sort_values(by='year')
         UserStat.users_by_country(country_user_data)
 
     @staticmethod
-    def bot_stats(df: dd.DataFrame) -> None:
-        """Generate bot classification statistics. Requires is_bot, is_hub, is_organic columns."""
-        # Derive classification in Dask using map_partitions
-        def add_classification(pdf):
-            pdf = pdf.copy()
-            pdf['classification'] = 'organic'
-            pdf.loc[pdf['is_hub'] == True, 'classification'] = 'hub'
-            pdf.loc[pdf['is_bot'] == True, 'classification'] = 'bot'
-            return pdf
-
-        df_classified = df.map_partitions(add_classification)
-
+    def bot_stats(stats: Dict[str, pd.DataFrame]) -> None:
+        """Generate bot classification statistics. Requires the classification aggregates."""
         # 1. Overall distribution
-        classification_counts = df_classified.groupby('classification').size().reset_index()
-        classification_counts.columns = ['classification', 'count']
-        classification_counts = classification_counts.compute()
-        BotStat.classification_distribution(classification_counts)
+        BotStat.classification_distribution(stats["classification_counts"])
 
         # 2. Classification by year
-        yearly_classification = df_classified.groupby(['year', 'classification']).size().reset_index()
-        yearly_classification.columns = ['year', 'classification', 'count']
-        yearly_classification = yearly_classification.compute()
-        BotStat.classification_by_year(yearly_classification)
+        BotStat.classification_by_year(stats["yearly_classification"])
 
         # 3. Organic downloads by country
-        organic_df = df_classified[df_classified['classification'] == 'organic']
-        country_organic = organic_df.groupby('country').size().reset_index()
-        country_organic.columns = ['country', 'count']
-        country_organic = country_organic.compute()
-        country_organic = country_organic.sort_values('count', ascending=False)
+        country_organic = stats["organic_by_country"].sort_values('count', ascending=False)
         BotStat.organic_downloads_by_country(country_organic)
 
+    @staticmethod
+    def raw_stats(
+        df: dd.DataFrame,
+        with_bot_stats: bool,
+        scheduler: str = DEFAULT_SCHEDULER,
+        workers: Optional[int] = None,
+        exact_users: bool = True
+    ) -> Tuple[Dict[str, pd.DataFrame], Dict[str, Any]]:
+        """
+        Aggregates of the report computed from the raw records.
+        All aggregates are one task graph evaluated by a single dask.compute, so the Parquet data is read
+        (and filtered) once for every section and summary number.
+        :param scheduler: Dask scheduler (one of REPORT_SCHEDULERS)
+        :param workers: Number of scheduler workers (default: Dask's default, the number of CPUs)
+        :param exact_users: Count the distinct users exactly (nunique). Otherwise every partition is summarised
+            in HyperLogLog sketches, which are merged instead of shuffling the users
+        :return: Aggregate frames of the stat sections and the summary numbers
+        """
+        stats = {}
+        yearly_downloads = df.groupby(["year", "method"]).size().reset_index()
+        yearly_downloads.columns = ["year", "method", "count"]
+        stats["yearly_downloads"] = yearly_downloads
+
+        df_with_my = df.assign(
+            month_year=df['year'].astype(STRING_DTYPE) + '-' + df['month'].astype(STRING_DTYPE).str.zfill(2)
+        )
+        total_downloads = df_with_my.groupby('month_year').size().reset_index()
+        total_downloads.columns = ['month_year', 'count']
+        stats["monthly_totals"] = total_downloads
+
+        downloads_by_method = df_with_my.groupby(['month_year', 'method']).size().reset_index()
+        downloads_by_method.columns = ['month_year', 'method', 'count']
+        stats["monthly_downloads"] = downloads_by_method
+
+        download_counts = df.groupby("accession").size().reset_index()
+        download_counts.columns = ["accession", "download_count"]
+        stats["download_counts"] = download_counts
+
+        daily_data = df.groupby(['date', 'method']).size().reset_index()
+        daily_data.columns = ['date', 'method', 'count']
+        stats["daily_downloads"] = daily_data
+
+        daily_totals = df.groupby('date').size().reset_index()
+        daily_totals.columns = ['date', 'count']
+
+        choropleth_data = df.groupby(['country', 'year']).size().reset_index()
+        choropleth_data.columns = ['country', 'year', 'count']
+        stats["country_downloads"] = choropleth_data
+
+        if exact_users:
+            stats["daily_users"] = df.groupby(['date', 'year', 'month'])['user'].nunique().reset_index()
+            stats["country_users"] = df.groupby(['country', 'year'])['user'].nunique().reset_index()
+        else:
+            sketches = {
+                name: df.map_partitions(_user_sketch_rows, keys, meta=_user_sketch_rows(df._meta, keys))
+                for name, keys in [("daily_users", USERS_BY_DATE_KEYS), ("country_users", USERS_BY_COUNTRY_YEAR_KEYS)]
+            }
+
+        if with_bot_stats:
+            # Derive classification in Dask using map_partitions
+            def add_classification(pdf):
+                pdf = pdf.copy()
+                pdf['classification'] = pd.Series('organic', index=pdf.index, dtype=STRING_DTYPE)
+                pdf.loc[pdf['is_hub'] == True, 'classification'] = 'hub'
+                pdf.loc[pdf['is_bot'] == True, 'classification'] = 'bot'
+                return pdf
+
+            df_classified = df.map_partitions(add_classification)
+
+            classification_counts = df_classified.groupby('classification').size().reset_index()
+            classification_counts.columns = ['classification', 'count']
+            stats["classification_counts"] = classification_counts
+
+            yearly_classification = df_classified.groupby(['year', 'classification']).size().reset_index()
+            yearly_classification.columns = ['year', 'classification', 'count']
+            stats["yearly_classification"] = yearly_classification
+
+            organic_df = df_classified[df_classified['classification'] == 'organic']
+            country_organic = organic_df.groupby('country').size().reset_index()
+            country_organic.columns = ['country', 'count']
+            stats["organic_by_country"] = country_organic
+
+        # Summary statistics as reductions of the same graph (no full materialization)
+        summary = {
+            "total_downloads": df.shape[0],
+            "unique_projects": df['accession'].nunique(),
+            "unique_countries": df['country'].nunique(),
+        }
+        if exact_users:
+            summary["unique_users"] = df['user'].nunique()
+        else:
+            stats.update(sketches)
+
+        logger.info("Computing report aggregates", extra={"scheduler": scheduler, "workers": workers,
+                                                          "exact_users": exact_users})
+        computed = dask.compute(stats, summary, daily_totals, scheduler=scheduler, num_workers=workers)
+        stats, summary, daily_totals = computed
+        if not exact_users:
+            users_by_date = _merge_sketch_rows(stats["daily_users"])
+            stats["daily_users"] = users_by_date.estimates()
+            stats["country_users"] = _merge_sketch_rows(stats["country_users"]).estimates()
+            summary["unique_users"] = users_by_date.total()
+            summary["unique_users_error"] = users_by_date.relative_error
+        # The date range is taken from the (small) daily totals
+        summary["min_date"] = daily_totals["date"].min()
+        summary["max_date"] = daily_totals["date"].max()
+        return stats, summary
+
+    @staticmethod
+    def cube_stats(
+        cube: AggregateCube,
+        with_bot_stats: bool,
+        skipped_years_list: List[int],
+        exact_users: bool = True
+    ) -> Tuple[Dict[str, pd.DataFrame], Dict[str, Any]]:
+        """
+        Aggregates of the report derived from an aggregate cube. Distinct users are HyperLogLog estimates.
+        :param exact_users: Whether exact distinct user counts are requested; a cube only holds sketches, so
+            the report must then be computed from the Parquet records instead
+        :return: Aggregate frames of the stat sections and the summary numbers
+        """
+        if exact_users:
+            raise ValidationError("An aggregate cube only holds estimates of the distinct users; report from the "
+                                  "Parquet records for exact counts, or use approximate users",
+                                  field="exact_users", value=exact_users)
+        counts = cube.counts.dropna(subset=["year", "month"])
+        counts = counts.astype({c: SCHEMA_V1.field(c).type.to_pandas_dtype() for c in PARTITION_COLUMNS})
+        users_by_date = cube.users_by_date
+        users_by_country_year = cube.users_by_country_year
+        if skipped_years_list:
+            counts = counts[~counts["year"].isin(skipped_years_list)]
+            users_by_date = users_by_date.exclude("year", skipped_years_list)
+            users_by_country_year = users_by_country_year.exclude("year", skipped_years_list)
+        counts = counts.assign(
+            month_year=counts['year'].astype(STRING_DTYPE) + '-' + counts['month'].astype(STRING_DTYPE).str.zfill(2)
+        )
+
+        def downloads(keys: List[str], data: pd.DataFrame = counts) -> pd.DataFrame:
+            return data.groupby(keys, as_index=False)["count"].sum()
+
+        stats = {
+            "yearly_downloads": downloads(["year", "method"]),
+            "monthly_totals": downloads(["month_year"]),
+            "monthly_downloads": downloads(["month_year", "method"]),
+            "download_counts": downloads(["accession"]).rename(columns={"count": "download_count"}),
+            "daily_downloads": downloads(["date", "method"]),
+            "country_downloads": downloads(["country", "year"]),
+            "daily_users": users_by_date.estimates(),
+            "country_users": users_by_country_year.estimates(),
+        }
+
+        if with_bot_stats:
+            classified = counts.assign(classification=pd.Series('organic', index=counts.index, dtype=STRING_DTYPE))
+            classified.loc[classified['is_hub'] == True, 'classification'] = 'hub'
+            classified.loc[classified['is_bot'] == True, 'classification'] = 'bot'
+            stats["classification_counts"] = downloads(["classification"], classified)
+            stats["yearly_classification"] = downloads(["year", "classification"], classified)
+            stats["organic_by_country"] = downloads(
+                ["country"], classified[classified['classification'] == 'organic']
+            )
+
+        summary = {
+            "total_downloads": int(counts["count"].sum()),
+            "unique_projects": counts["accession"].nunique(),
+            "unique_users": users_by_date.total(),
+            "unique_users_error": users_by_date.relative_error,
+            "unique_countries": counts["country"].nunique(),
+            "min_date": counts["date"].min(),
+            "max_date": counts["date"].max(),
+        }
+        return stats, summary
+
     @staticmethod
     def run_file_download_stat(
         file: str,
@@ -134,47 +300,96 @@ class ReportStat:
         baseurl: str,
         report_copy_filepath: Optional[str],
         skipped_years_list: List[int],
-        enable_bot_classification: bool = False
+        enable_bot_classification: bool = False,
+        from_month: Optional[str] = None,
+        to_month: Optional[str] = None,
+        scheduler: str = DEFAULT_SCHEDULER,
+        workers: Optional[int] = None,
+        partition_size: str = DEFAULT_PARTITION_SIZE,
+        row_groups_per_partition: Optional[int] = None,
+        exact_users: bool = True
     ) -> None:
         """
         Run the log file statistics generation and save the visualizations in an HTML output file.
+        The input is an aggregate cube directory (see build_cube), a merged Parquet file or a hive-partitioned
+        dataset directory. For Parquet input, the year and month window is pushed down as read filters so
+        skipped partitions (and row groups) are not read; a cube already holds the month window it was built with.
+        :param scheduler: Dask scheduler of the Parquet input aggregation (one of REPORT_SCHEDULERS)
+        :param workers: Number of Dask workers (default: the number of CPUs)
+        :param partition_size: Target size of a Dask partition (eg: "64MiB"). A merged Parquet file is split
+            into partitions of whole row groups, so the aggregation runs on all the workers
+        :param row_groups_per_partition: Number of row groups per Dask partition, instead of partition_size
+        :param exact_users: Count the distinct users of Parquet input exactly instead of with HyperLogLog sketches.
+            A cube only holds sketches, so cube input requires exact_users=False
         """
-        logger.info("Loading data from Parquet", extra={"file": file})
-
-        # Only read the columns needed for reporting to reduce memory usage
-        report_columns = ['date', 'year', 'month', 'user', 'accession',
-                          'country', 'method']
-        if enable_bot_classification:
-            report_columns += ['is_bot', 'is_hub', 'is_organic']
-
-        df = dd.read_parquet(file, columns=report_columns)
-
-        # Filter out rows where 'year' is in skipped_years_list
-        if skipped_years_list:
-            df = df[~df["year"].isin(skipped_years_list)]
-
-        logger.info("Running report generation with Dask (lazy evaluation)")
-
-        ReportStat.project_stat(df, baseurl)
-        ReportStat.trends_stat(df)
-        ReportStat.regional_stats(df)
-        ReportStat.user_stats(df)
+        if scheduler not in REPORT_SCHEDULERS:
+            raise ValidationError(f"scheduler must be one of {REPORT_SCHEDULERS}, got: {scheduler}",
+                                  field="scheduler", value=scheduler)
+        if row_groups_per_partition is not None and row_groups_per_partition <= 0:
+            raise ValidationError("row_groups_per_partition must be positive",
+                                  field="row_groups_per_partition", value=row_groups_per_partition)
+        has_bot_columns = False
+        if is_cube(file):
+            logger.info("Loading aggregate cube", extra={"cube_dir": file})
+            if from_month or to_month:
+                logger.warning("The month window of a cube input is applied by build_cube",
+                               extra={"from_month": from_month, "to_month": to_month})
+            cube = AggregateCube.read(file)
+            has_bot_columns = cube.has_bot_columns
+            stats, summary = ReportStat.cube_stats(cube, enable_bot_classification and has_bot_columns,
+                                                   skipped_years_list, exact_users=exact_users)
+        else:
+            logger.info("Loading data from Parquet", extra={"file": file})
+
+            # Only read the columns needed for reporting to reduce memory usage
+            report_columns = ['date', 'year', 'month', 'user', 'accession',
+                              'country', 'method']
+            if enable_bot_classification:
+                report_columns += ['is_bot', 'is_hub', 'is_organic']
+
+            if row_groups_per_partition:
+                split_options = {"split_row_groups": row_groups_per_partition}
+            else:
+                split_options = {"split_row_groups": "adaptive", "blocksize": partition_size}
+            df = dd.read_parquet(file, columns=report_columns,
+                                 filters=partition_filters(skipped_years_list, from_month, to_month),
+                                 **split_options)
+            logger.info("Parquet input split into Dask partitions",
+                        extra={"partition_count": df.npartitions, **split_options})
+
+            # Compact schema (version 2): dictionary columns are read as categoricals, use Arrow-backed strings
+            # (the dtype of the version 1 string columns) so the groupings match version 1 files
+            categorical_columns = [c for c in dictionary_columns(pq.ParquetDataset(file).schema)
+                                   if c in report_columns and c not in PARTITION_COLUMNS]
+            if categorical_columns:
+                df = df.astype({c: STRING_DTYPE for c in categorical_columns})
+            # Partition columns of a partitioned dataset are read back as categoricals
+            if is_partitioned(file):
+                df = df.astype({c: SCHEMA_V1.field(c).type.to_pandas_dtype() for c in PARTITION_COLUMNS})
+
+            # Filter out rows where 'year' is in skipped_years_list
+            if skipped_years_list:
+                df = df[~df["year"].isin(skipped_years_list)]
+
+            logger.info("Running report generation with Dask (lazy evaluation)")
+            has_bot_columns = all(col in df.columns for col in ['is_bot', 'is_hub', 'is_organic'])
+            stats, summary = ReportStat.raw_stats(df, enable_bot_classification and has_bot_columns,
+                                                  scheduler=scheduler, workers=workers, exact_users=exact_users)
+
+        ReportStat.project_stat(stats, baseurl)
+        ReportStat.trends_stat(stats)
+        ReportStat.regional_stats(stats)
+        ReportStat.user_stats(stats)
 
         # Generate bot classification stats if the annotated columns are present
-        has_bot_columns = all(col in df.columns for col in ['is_bot', 'is_hub', 'is_organic'])
         if enable_bot_classification and has_bot_columns:
-            ReportStat.bot_stats(df)
+            ReportStat.bot_stats(stats)
             logger.info("Bot classification stats generated")
         elif enable_bot_classification:
             logger.warning("Bot classification enabled but is_bot/is_hub/is_organic columns not found in parquet")
 
-        # Compute summary statistics using Dask (no full materialization)
-        total_downloads = df.shape[0].compute()
-        unique_projects = df['accession'].nunique().compute()
-        unique_users = df['user'].nunique().compute()
-        unique_countries = df['country'].nunique().compute()
-        min_date = pd.to_datetime(df['date'].min().compute()).strftime("%Y-%m-%d")
-        max_date = pd.to_datetime(df['date'].max().compute()).strftime("%Y-%m-%d")
+        min_date = pd.to_datetime(summary["min_date"]).strftime("%Y-%m-%d")
+        max_date = pd.to_datetime(summary["max_date"]).strftime("%Y-%m-%d")
         date_range = f"{min_date} to {max_date}"
 
         template_path = Path(__file__).resolve().parent.parent / "template" / report_template
@@ -183,10 +398,11 @@ class ReportStat:
         Report.generate_report(
             template_path, output,
             enable_bot_classification=enable_bot_classification,
-            total_downloads=total_downloads,
-            unique_projects=unique_projects,
-            unique_users=unique_users,
-            unique_countries=unique_countries,
+            total_downloads=summary["total_downloads"],
+            unique_projects=summary["unique_projects"],
+            unique_users=summary["unique_users"],
+            unique_users_error=summary.get("unique_users_error"),
+            unique_countries=summary["unique_countries"],
             date_range=date_range,
         )
 
@@ -23,7 +23,7 @@ class Report(IReportGenerator):
     def generate_report(template_path: Path, output: Path, enable_bot_classification: bool = False,
                         total_downloads: int = 0, unique_projects: int = 0,
                         unique_users: int = 0, unique_countries: int = 0,
-                        date_range: str = "") -> None:
+                        date_range: str = "", unique_users_error: Optional[float] = None) -> None:
 
         # Read the template HTML file
         with open(template_path, "r",
@@ -32,6 +32,10 @@ class Report(IReportGenerator):
 
         # Build summary section
         run_timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S UTC")
+        # Distinct users counted with HyperLogLog sketches are shown with their relative standard error
+        unique_users_text = f"{unique_users:,}"
+        if unique_users_error is not None:
+            unique_users_text = f"~{unique_users:,} (estimate, &plusmn;{unique_users_error:.1%})"
         summary_html = (
             f'<table style="width:100%; border-collapse:collapse; margin:10px 0;">'
             f'<tr><td style="padding:8px; border-bottom:1px solid #ddd;"><strong>Report Generated</strong></td>'
@@ -43,7 +47,7 @@ class Report(IReportGenerator):
             f'<tr><td style="padding:8px; border-bottom:1px solid #ddd;"><strong>Unique Projects</strong></td>'
             f'<td style="padding:8px; border-bottom:1px solid #ddd;">{unique_projects:,}</td></tr>'
             f'<tr><td style="padding:8px; border-bottom:1px solid #ddd;"><strong>Unique Users</strong></td>'
-            f'<td style="padding:8px; border-bottom:1px solid #ddd;">{unique_users:,}</td></tr>'
+            f'<td style="padding:8px; border-bottom:1px solid #ddd;">{unique_users_text}</td></tr>'
             f'<tr><td style="padding:8px; border-bottom:1px solid #ddd;"><strong>Unique Countries</strong></td>'
             f'<td style="padding:8px; border-bottom:1px solid #ddd;">{unique_countries:,}</td></tr>'
             f'<tr><td style="padding:8px; border-bottom:1px solid #ddd;"><strong>Bot Classification</strong></td>'
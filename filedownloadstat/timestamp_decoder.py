@@ -0,0 +1,93 @@
+import logging
+import re
+from datetime import datetime, date
+from typing import Dict, Tuple
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+logger = logging.getLogger(__name__)
+
+
+class TimestampDecoder:
+    """
+    Decode log file timestamps into the date, year and month columns.
+    eg: 2024-09-13T23:58:17.000Z / 2024-09-14T07:14:07.419698061Z
+
+    decode() is used by the row parser and memoizes the YYYY-MM-DD prefix, since every line of a daily log
+    shares the same day. decode_column() decodes a whole Arrow column at once for the columnar engine.
+    """
+
+    DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+    SECONDS_FORMAT = "%Y-%m-%dT%H:%M:%S"
+    MAX_CACHED_DAYS = 4096
+    # Cleaned timestamps that strptime accepts for sure; only these are resolved from the day cache
+    CACHEABLE_REGEX = re.compile(r"\d{4}-\d{2}-\d{2}T(?:[01]\d|2[0-3]):[0-5]\d:[0-5]\d(?:\.\d{1,6})?")
+
+    def __init__(self) -> None:
+        self._day_cache: Dict[str, Tuple[date, int, int]] = {}
+
+    @staticmethod
+    def clean_timestamp(timestamp: str) -> str:
+        """
+        Cleans and adjusts the timestamp format for parsing.
+        :param timestamp: Raw timestamp string
+        :return: Cleaned timestamp string
+        """
+        if '.' in timestamp:
+            timestamp = timestamp[:26] + 'Z'  # Trim to microseconds and re-add 'Z'
+        return timestamp.rstrip('Z')  # Remove 'Z' for parsing
+
+    def decode(self, timestamp: str) -> Tuple[date, int, int]:
+        """
+        Decode a single timestamp. The first timestamp of each day is fully validated with strptime,
+        later well-formed timestamps of the same day are resolved from the cache (others are still parsed, so
+        malformed timestamps raise as before).
+        :param timestamp: Raw timestamp string
+        :return: (date, year, month)
+        """
+        cleaned = self.clean_timestamp(timestamp)
+        cacheable = self.CACHEABLE_REGEX.fullmatch(cleaned) is not None
+        day_prefix = timestamp[:10]
+        decoded = self._day_cache.get(day_prefix) if cacheable else None
+        if decoded is None:
+            fmt = self.DATETIME_FORMAT if '.' in cleaned else self.SECONDS_FORMAT
+            parsed_time = datetime.strptime(cleaned, fmt)
+            decoded = (parsed_time.date(), parsed_time.year, parsed_time.month)
+            if cacheable:
+                if len(self._day_cache) >= self.MAX_CACHED_DAYS:
+                    self._day_cache.clear()
+                self._day_cache[day_prefix] = decoded
+        return decoded
+
+    @classmethod
+    def decode_column(cls, timestamps: pa.Array) -> Tuple[pa.Array, pa.Array, pa.Array]:
+        """
+        Decode a whole column of timestamps. Fractional seconds (milli or nanoseconds) are ignored,
+        malformed timestamps decode to null.
+        :param timestamps: String array of raw timestamps
+        :return: (date64 array, int16 year array, int8 month array)
+        """
+        seconds = pc.utf8_slice_codeunits(pc.utf8_trim_whitespace(timestamps), 0, 19)
+        parsed_time = pc.strptime(seconds, format=cls.SECONDS_FORMAT, unit="s", error_is_null=True)
+        return (
+            pc.cast(pc.cast(parsed_time, pa.date32()), pa.date64()),
+            pc.cast(pc.year(parsed_time), pa.int16()),
+            pc.cast(pc.month(parsed_time), pa.int8()),
+        )
+
+    @classmethod
+    def decode_timestamp_column(cls, timestamps: pa.Array) -> pa.Array:
+        """
+        Decode a whole column of timestamps into timestamp[us, UTC], keeping up to microsecond precision
+        (nanosecond fractions are truncated). Malformed timestamps decode to null.
+        :param timestamps: String array of raw timestamps
+        :return: timestamp[us, UTC] array
+        """
+        trimmed = pc.utf8_trim_whitespace(timestamps)
+        seconds = pc.strptime(pc.utf8_slice_codeunits(trimmed, 0, 19), format=cls.SECONDS_FORMAT, unit="us",
+                              error_is_null=True)
+        fraction = pc.struct_field(pc.extract_regex(trimmed, pattern=r"^.{19}\.(?P<fraction>\d+)"), [0])
+        fraction = pc.utf8_slice_codeunits(pc.utf8_rpad(fraction, width=6, padding="0"), 0, 6)
+        microseconds = pc.cast(pc.fill_null(pc.cast(fraction, pa.int64()), 0), pa.duration("us"))
+        return pc.cast(pc.add(seconds, microseconds), pa.timestamp("us", tz="UTC"))
@@ -15,6 +15,36 @@ params.output_file='parsed_data.parquet'
 params.log_file=''
 params.api_endpoint_file_download_per_project=''
 params.protocols=''
+params.log_file_parse_engine='row'
+params.log_file_pipelined_read=false
+params.log_file_read_chunk_size=1048576
+params.log_file_read_queue_depth=8
+params.log_files_per_task=1
+params.work_unit_target_bytes=0
+params.log_file_workers=1
+params.parquet_store_dir=''
+params.parquet_store_content_hash=false
+params.aggregate_store_dir=''
+params.log_scan_workers=8
+params.parquet_row_group_rows=1000000
+params.parquet_row_group_bytes=134217728
+params.parquet_schema_version=1
+params.partitioned_merge=false
+params.merge_workers=4
+params.analysis_workers=0
+params.build_cube=false
+params.report_scheduler='threads'
+params.report_workers=0
+params.report_partition_size='64MiB'
+params.report_approximate_users=false
+params.all_data_format='json'
+params.all_data_compression='none'
+params.all_data_split_by_year=false
+params.from_month=''
+params.to_month=''
+params.parse_time_filters=false
+params.accession_allowlist=''
+params.accession_denylist=''
 params.enable_bot_classification=true
 params.bot_classification_method='rules'
 params.bot_contamination=0.15
@@ -53,6 +83,36 @@ Completeness        : ${params.completeness}
 Public/Private      : ${params.public_private}
 Report Template     : ${params.report_template}
 Batch Size          : ${params.log_file_batch_size}
+Parse Engine        : ${params.log_file_parse_engine}
+Pipelined Read      : ${params.log_file_pipelined_read}
+Read chunk size     : ${params.log_file_read_chunk_size}
+Read queue depth    : ${params.log_file_read_queue_depth}
+Log files per task  : ${params.log_files_per_task}
+Work unit size      : ${params.work_unit_target_bytes}
+Log file workers    : ${params.log_file_workers}
+Parquet store dir   : ${params.parquet_store_dir}
+Store content hash  : ${params.parquet_store_content_hash}
+Aggregate store dir : ${params.aggregate_store_dir}
+Log scan workers    : ${params.log_scan_workers}
+Row group rows      : ${params.parquet_row_group_rows}
+Row group bytes     : ${params.parquet_row_group_bytes}
+Parquet schema      : ${params.parquet_schema_version}
+Partitioned merge   : ${params.partitioned_merge}
+Merge workers       : ${params.merge_workers}
+Analysis workers    : ${params.analysis_workers}
+Build cube          : ${params.build_cube}
+Report scheduler    : ${params.report_scheduler}
+Report workers      : ${params.report_workers}
+Report partition    : ${params.report_partition_size}
+Approximate users   : ${params.report_approximate_users}
+All data format     : ${params.all_data_format}
+All data compression: ${params.all_data_compression}
+All data per year   : ${params.all_data_split_by_year}
+From month          : ${params.from_month}
+To month            : ${params.to_month}
+Parse-time filters  : ${params.parse_time_filters}
+Accession allowlist : ${params.accession_allowlist}
+Accession denylist  : ${params.accession_denylist}
 Resource Base URL   : ${params.resource_base_url}
 Report copy location: ${params.report_copy_filepath}
 Skipped Years       : ${params.skipped_years}
@@ -68,6 +128,40 @@ api_endpoint_file_downloads_per_file    : ${params.api_endpoint_file_downloads_p
 
  """
 
+// Parse-time filters of process_log_file(s), with parse_time_filters: rows outside the report window or the
+// accession lists, and log files outside the window, are never written
+def parseFilterArgs() {
+    def args = []
+    if (params.parse_time_filters) {
+        if (params.skipped_years) {
+            args << "--skipped_years ${params.skipped_years.join(',')}"
+        }
+        if (params.from_month) {
+            args << "--from_month ${params.from_month}"
+        }
+        if (params.to_month) {
+            args << "--to_month ${params.to_month}"
+        }
+        if (params.accession_allowlist) {
+            args << "--accession_allowlist ${params.accession_allowlist}"
+        }
+        if (params.accession_denylist) {
+            args << "--accession_denylist ${params.accession_denylist}"
+        }
+    }
+    return args.join(' ')
+}
+
+// all_data export: a file (eg: all_data.ndjson.gz), or a directory with one file per year
+def allDataOutput() {
+    if (params.all_data_split_by_year) {
+        return 'all_data'
+    }
+    def extension = [json: '.json', ndjson: '.ndjson', parquet: '.parquet'][params.all_data_format]
+    def compression = params.all_data_format == 'parquet' ? '' : [none: '', gzip: '.gz', zstd: '.zst'][params.all_data_compression]
+    return "all_data${extension}${compression}"
+}
+
 process get_log_files {
 
     label 'process_very_low'
@@ -79,12 +173,35 @@ process get_log_files {
     path "file_list.txt"
 
     script:
+    def storeArgs = params.parquet_store_dir ? "--store_dir ${params.parquet_store_dir}" : ''
+    def contentHashFlag = params.parquet_store_content_hash ? '--content_hash' : ''
     """
     python3 ${workflow.projectDir}/filedownloadstat/file_download_stat.py  get_log_files \
         --root_dir $root_dir \
         --output "file_list.txt" \
         --protocols "${params.protocols.join(',')}" \
-        --public "${params.public_private.join(',')}"
+        --public "${params.public_private.join(',')}" \
+        --scan_workers ${params.log_scan_workers} \
+        ${storeArgs} ${contentHashFlag}
+    """
+}
+
+process plan_work_units {
+
+    label 'process_very_low'
+
+    input:
+    path file_list
+
+    output:
+    path "work_units.txt"
+
+    script:
+    """
+    python3 ${workflow.projectDir}/filedownloadstat/file_download_stat.py  plan_work_units \
+        --file_list ${file_list} \
+        --output "work_units.txt" \
+        --target_bytes ${params.work_unit_target_bytes}
     """
 }
 
@@ -119,6 +236,7 @@ process process_log_file {
     path "*.parquet",optional: true  // Output files with unique names
 
     script:
+    def pipelinedFlag = params.log_file_pipelined_read ? "--pipelined" : ""
     """
     # Extract a unique identifier from the log file name
     filename=\$(basename ${file_path} .log.tsv.gz)
@@ -129,10 +247,55 @@ process process_log_file {
         -c "${params.completeness.join(",")}" \
         -b ${params.log_file_batch_size} \
         -a ${params.accession_pattern.join(",")} \
+        -e ${params.log_file_parse_engine} \
+        ${pipelinedFlag} \
+        --read_chunk_size ${params.log_file_read_chunk_size} \
+        --read_queue_depth ${params.log_file_read_queue_depth} \
+        --row_group_rows ${params.parquet_row_group_rows} \
+        --row_group_bytes ${params.parquet_row_group_bytes} \
+        --schema_version ${params.parquet_schema_version} \
+        ${parseFilterArgs()} \
         > process_log_file.log 2>&1
     """
 }
 
+process process_log_files {
+
+    label 'process_low'
+    label 'error_retry_max'
+
+    input:
+    val file_paths  // A group of log files parsed in one task
+
+    output:
+    path "*.parquet",optional: true  // One parquet file per log file
+
+    script:
+    def pipelinedFlag = params.log_file_pipelined_read ? "--pipelined" : ""
+    """
+    # Write the file paths to a temporary file, because otherwise Argument list(file list) will be too long
+    echo "${file_paths.join('\n')}" > log_files_list.txt
+
+    python3 ${workflow.projectDir}/filedownloadstat/file_download_stat.py  process_log_files \
+        -f log_files_list.txt \
+        -o . \
+        -r "${params.resource_identifiers.join(",")}" \
+        -c "${params.completeness.join(",")}" \
+        -b ${params.log_file_batch_size} \
+        -a ${params.accession_pattern.join(",")} \
+        -e ${params.log_file_parse_engine} \
+        -w ${params.log_file_workers} \
+        ${pipelinedFlag} \
+        --read_chunk_size ${params.log_file_read_chunk_size} \
+        --read_queue_depth ${params.log_file_read_queue_depth} \
+        --row_group_rows ${params.parquet_row_group_rows} \
+        --row_group_bytes ${params.parquet_row_group_bytes} \
+        --schema_version ${params.parquet_schema_version} \
+        ${parseFilterArgs()} \
+        > process_log_files.log 2>&1
+    """
+}
+
 process merge_parquet_files {
 
     label 'process_low'
@@ -140,11 +303,15 @@ process merge_parquet_files {
 
     input:
     val all_parquet_files  // A comma-separated string of file paths
+    path file_list         // Log files parsed in this run, recorded in the parquet store
 
     output:
     path("output_parquet"), emit: output_parquet
 
     script:
+    def storeArgs = params.parquet_store_dir ? "--store_dir ${params.parquet_store_dir} --file_list ${file_list}" : ''
+    def contentHashFlag = params.parquet_store_content_hash ? '--content_hash' : ''
+    def partitionedFlag = params.partitioned_merge ? '--partitioned' : ''
     """
     # Write the file paths to a temporary file, because otherwise Argument list(file list) will be too long
     echo "${all_parquet_files.join('\n')}" > all_parquet_files_list.txt
@@ -152,7 +319,39 @@ process merge_parquet_files {
     python3 ${workflow.projectDir}/filedownloadstat/file_download_stat.py  merge_parquet_files \
         --input_dir all_parquet_files_list.txt \
         --output_parquet "output_parquet" \
-        --profile $workflow.profile
+        --profile $workflow.profile \
+        --workers ${params.merge_workers} \
+        --row_group_rows ${params.parquet_row_group_rows} \
+        --row_group_bytes ${params.parquet_row_group_bytes} \
+        ${storeArgs} ${contentHashFlag} ${partitionedFlag}
+    """
+}
+
+process update_aggregate_store {
+
+    label 'process_low'
+    label 'error_retry_medium'
+
+    input:
+    val all_parquet_files  // Per-log parquet files produced in this run
+    path file_list         // Log files parsed in this run, recorded in the parquet store
+
+    output:
+    path("aggregate_cube"), emit: aggregate_cube
+
+    script:
+    def contentHashFlag = params.parquet_store_content_hash ? '--content_hash' : ''
+    """
+    echo "${all_parquet_files.join('\n')}" > all_parquet_files_list.txt
+
+    python3 ${workflow.projectDir}/filedownloadstat/file_download_stat.py  update_aggregate_store \
+        --input_dir all_parquet_files_list.txt \
+        --store_dir ${params.parquet_store_dir} \
+        --aggregate_store_dir ${params.aggregate_store_dir} \
+        --cube_dir aggregate_cube \
+        --file_list ${file_list} \
+        --profile $workflow.profile \
+        ${contentHashFlag}
     """
 }
 
@@ -179,6 +378,34 @@ process classify_bot_downloads {
     """
 }
 
+process build_cube {
+
+    label 'error_retry_max'
+
+    input:
+    val output_parquet
+
+    output:
+    path("aggregate_cube"), emit: aggregate_cube
+    path("all_data*"), emit: all_data
+
+    script:
+    def monthArgs = (params.from_month ? "--from_month ${params.from_month} " : '') + (params.to_month ? "--to_month ${params.to_month}" : '')
+    def analysisWorkers = params.analysis_workers ?: task.cpus
+    def splitByYearFlag = params.all_data_split_by_year ? '--all_data_split_by_year' : ''
+    """
+    python3 ${workflow.projectDir}/filedownloadstat/file_download_stat.py  build_cube \
+        --output_parquet ${output_parquet} \
+        --cube_dir aggregate_cube \
+        --all_data ${allDataOutput()} \
+        --all_data_format ${params.all_data_format} \
+        --all_data_compression ${params.all_data_compression} \
+        --profile $workflow.profile \
+        --workers ${analysisWorkers} \
+        ${splitByYearFlag} ${monthArgs}
+    """
+}
+
 process analyze_parquet_files {
 
     label 'error_retry_max'
@@ -191,9 +418,13 @@ process analyze_parquet_files {
     path("file_level_download_counts.json"), emit: file_level_download_counts
     path("project_level_yearly_download_counts.json"), emit: project_level_yearly_download_counts
     path("project_level_top_download_counts.json"), emit: project_level_top_download_counts
-    path("all_data.json"), emit: all_data
+    path("all_data*"), optional: true, emit: all_data  // Exported by build_cube when the input is the cube
 
     script:
+    def monthArgs = (params.from_month ? "--from_month ${params.from_month} " : '') + (params.to_month ? "--to_month ${params.to_month}" : '')
+    def analysisWorkers = params.analysis_workers ?: task.cpus
+    def allDataArgs = (params.build_cube || params.aggregate_store_dir) ? '' :
+        "--all_data ${allDataOutput()} " + (params.all_data_split_by_year ? '--all_data_split_by_year' : '')
     """
     python3 ${workflow.projectDir}/filedownloadstat/file_download_stat.py  analyze_parquet_files \
         --output_parquet ${output_parquet} \
@@ -201,8 +432,11 @@ process analyze_parquet_files {
         --file_level_download_counts file_level_download_counts.json \
         --project_level_yearly_download_counts project_level_yearly_download_counts.json \
         --project_level_top_download_counts project_level_top_download_counts.json \
-        --all_data all_data.json \
-        --profile $workflow.profile
+        --all_data_format ${params.all_data_format} \
+        --all_data_compression ${params.all_data_compression} \
+        --profile $workflow.profile \
+        --workers ${analysisWorkers} \
+        ${allDataArgs} ${monthArgs}
     """
 }
 
@@ -218,6 +452,9 @@ process run_file_download_stat {
 
     script:
     def botFlag = params.enable_bot_classification ? "--enable_bot_classification" : ""
+    def reportWorkers = params.report_workers ?: task.cpus
+    def usersFlag = params.report_approximate_users ? "--approximate_users" : ""
+    def monthArgs = (params.from_month ? "--from_month ${params.from_month} " : '') + (params.to_month ? "--to_month ${params.to_month}" : '')
     """
     python3 ${workflow.projectDir}/filedownloadstat/file_download_stat.py  run_file_download_stat \
         --file ${output_parquet} \
@@ -226,7 +463,10 @@ process run_file_download_stat {
         --baseurl ${params.resource_base_url} \
         --report_copy_filepath ${params.report_copy_filepath} \
         --skipped_years "${params.skipped_years.join(',')}" \
-        ${botFlag}
+        --scheduler ${params.report_scheduler} \
+        --workers ${reportWorkers} \
+        --partition_size ${params.report_partition_size} \
+        ${botFlag} ${usersFlag} ${monthArgs}
     """
 }
 
@@ -361,6 +601,12 @@ process update_file_level_download_counts {
 }
 
 workflow {
+    // The parquet store keeps per-log files across runs and its manifest marks their logs as ingested:
+    // rows dropped by parse-time filters would never be parsed again once the filters change
+    if (params.parse_time_filters && params.parquet_store_dir) {
+        error "parse_time_filters cannot be used with parquet_store_dir"
+    }
+
     // Step 1: Gather file names
     def root_dir = params.root_dir
     def file_paths = get_log_files(root_dir)
@@ -374,30 +620,70 @@ workflow {
         .set { file_path }          // Save the channel
 
     // Step 2: Process each log file and generate Parquet files
-    def all_parquet_files = process_log_file(file_path)
+    // Several log files per task amortize the interpreter startup over many small logs
+    def all_parquet_files
+    if (params.work_unit_target_bytes > 0) {
+        // Balanced work units: log files bin-packed by compressed size
+        def work_units = plan_work_units(file_paths)
+            .splitText()
+            .map { it.trim().split('\t') as List }
+        all_parquet_files = process_log_files(work_units)
+    } else if (params.log_files_per_task > 1) {
+        all_parquet_files = process_log_files(file_path.collate(params.log_files_per_task))
+    } else {
+        all_parquet_files = process_log_file(file_path)
+    }
 
     // Collect all parquet files into a single channel for analysis
+    // With a parquet store, no changed log files is not an error: the store is merged as it is
     all_parquet_files
         .collect()                  // Collect all parquet files into a single list
+        .ifEmpty([])
         .set { parquet_file_list }  // Save the collected files as a new channel
 
-    merge_parquet_files(parquet_file_list)
-
-    // Step 2.5: Optionally classify downloads into bots, hubs, and organic users
-    if (params.enable_bot_classification) {
-        classify_bot_downloads(merge_parquet_files.out.output_parquet)
+    def stat_input
+    def report_input
+    if (params.aggregate_store_dir) {
+        // Incremental aggregates: only the days of this run's log files are aggregated again, the history is
+        // neither merged nor scanned (no all_data export and no bot classification, which need the records)
+        if (!params.parquet_store_dir) {
+            error "aggregate_store_dir requires parquet_store_dir"
+        }
+        // The aggregate store only keeps sketches of the distinct users, there are no records to count them exactly
+        if (!params.report_approximate_users) {
+            error "aggregate_store_dir requires report_approximate_users"
+        }
+        update_aggregate_store(parquet_file_list, file_paths)
+        stat_input = update_aggregate_store.out.aggregate_cube
+        report_input = stat_input
+    } else {
+        merge_parquet_files(parquet_file_list, file_paths)
+
+        // Step 2.5: Optionally classify downloads into bots, hubs, and organic users
+        if (params.enable_bot_classification) {
+            classify_bot_downloads(merge_parquet_files.out.output_parquet)
+        }
+
+        // Use annotated parquet if bot classification is enabled, otherwise use merged parquet
+        def parquet_for_analysis = params.enable_bot_classification
+            ? classify_bot_downloads.out.annotated_parquet
+            : merge_parquet_files.out.output_parquet
+
+        // Step 2.8: Optionally aggregate the records into a cube (and export all_data) in a single scan,
+        // so the analysis and the report read the small cube instead of the records
+        if (params.build_cube) {
+            build_cube(parquet_for_analysis)
+        }
+        stat_input = params.build_cube ? build_cube.out.aggregate_cube : parquet_for_analysis
+        // The cube only holds estimates of the distinct users: exact counts are computed from the records
+        report_input = params.report_approximate_users ? stat_input : parquet_for_analysis
     }
 
-    // Use annotated parquet if bot classification is enabled, otherwise use merged parquet
-    def parquet_for_analysis = params.enable_bot_classification
-        ? classify_bot_downloads.out.annotated_parquet
-        : merge_parquet_files.out.output_parquet
-
     // Step 3: Analyze Parquet files
-    analyze_parquet_files(parquet_for_analysis)
+    analyze_parquet_files(stat_input)
 
     // Step 4: Generate Statistics for file downloads (with bot stats if enabled)
-    run_file_download_stat(parquet_for_analysis)
+    run_file_download_stat(report_input)
 
     // Step 4.5: Push report to Slack
     push_to_slack(run_file_download_stat.out.html_report)
@@ -0,0 +1,111 @@
+"""
+Unit tests for the aggregate cube.
+"""
+import unittest
+import tempfile
+import os
+import shutil
+import dask.dataframe as dd
+import pyarrow as pa
+from datetime import date
+from filedownloadstat.aggregate_cube import AggregateCube, CubeBuilder, UserSketch, is_cube
+from filedownloadstat.parquet_schema import to_pandas
+from filedownloadstat.report_stat import ReportStat
+
+
+class TestAggregateCube(unittest.TestCase):
+
+    def setUp(self):
+        """Set up test fixtures."""
+        self.temp_dir = tempfile.mkdtemp()
+        self.batch = pa.RecordBatch.from_pydict({
+            "date": pa.array([date(2023, 1, 1), date(2023, 1, 1), date(2023, 1, 2), date(2024, 3, 1)], pa.date32()),
+            "year": pa.array([2023, 2023, 2023, 2024], pa.int16()),
+            "month": pa.array([1, 1, 1, 3], pa.int8()),
+            "user": ["user1", "user1", "user2", "user1"],
+            "accession": ["PXD000001", "PXD000001", "PXD000002", "PXD000001"],
+            "filename": ["file1.raw", "file1.raw", "file2.raw", "file1.raw"],
+            "country": ["United Kingdom", "United Kingdom", None, "Germany"],
+            "method": ["http", "http", "ftp", "http"],
+        })
+
+    def tearDown(self):
+        """Clean up test fixtures."""
+        if os.path.exists(self.temp_dir):
+            shutil.rmtree(self.temp_dir)
+
+    def test_user_sketch_merge(self):
+        """Test merged sketches estimate the distinct users of all their rows."""
+        users = pa.array([f"user{i}" for i in range(20000)])
+        years = pa.array([2023] * 10000 + [2024] * 10000, pa.int16())
+        batch = pa.RecordBatch.from_arrays([years, users], names=["year", "user"])
+
+        sketch = UserSketch(["year"])
+        for offset in range(0, 20000, 5000):
+            part = UserSketch(["year"])
+            part.add(batch.slice(offset, 5000))
+            sketch.merge(part)
+
+        estimates = sketch.estimates()
+        self.assertEqual(estimates["year"].tolist(), [2023, 2024])
+        for estimate in estimates["user"].tolist() + [sketch.total() / 2]:
+            self.assertAlmostEqual(estimate / 10000, 1, delta=0.05)
+        self.assertEqual(sketch.exclude("year", [2024]).estimates()["year"].tolist(), [2023])
+        self.assertAlmostEqual(sketch.relative_error, 0.01625)
+
+    def test_write_and_read(self):
+        """Test the cube counts every download, keeps null dimensions and is read back as written."""
+        builder = CubeBuilder()
+        builder.add(self.batch)
+        cube_dir = os.path.join(self.temp_dir, "aggregate_cube")
+        builder.build().write(cube_dir)
+        self.assertTrue(is_cube(cube_dir))
+        self.assertFalse(is_cube(self.temp_dir))
+
+        cube = AggregateCube.read(cube_dir)
+        self.assertEqual(cube.counts["count"].sum(), 4)
+        self.assertEqual(cube.counts["country"].isna().sum(), 1)
+        self.assertEqual(cube.file_counts.to_dict(orient="records"), [
+            {"accession": "PXD000001", "filename": "file1.raw", "count": 3},
+            {"accession": "PXD000002", "filename": "file2.raw", "count": 1},
+        ])
+        self.assertEqual(cube.users_by_date.estimates()["user"].tolist(), [1, 1, 1])
+        self.assertEqual(cube.users_by_country_year.estimates().to_dict(orient="records"), [
+            {"country": "Germany", "year": 2024, "user": 1},
+            {"country": "United Kingdom", "year": 2023, "user": 1},
+        ])
+        self.assertEqual(cube.users_by_date.total(), 2)
+        self.assertFalse(cube.has_bot_columns)
+
+    def test_report_users_are_exact_by_default(self):
+        """Test the default report counts the distinct users exactly, which a cube (sketches only) refuses."""
+        days = [date(2023, 1, 1 + i % 28) for i in range(3000)]
+        batch = pa.RecordBatch.from_pydict({
+            "date": pa.array(days, pa.date32()),
+            "year": pa.array([2023] * 3000, pa.int16()),
+            "month": pa.array([1] * 3000, pa.int8()),
+            "user": [f"user{i % 301}" for i in range(3000)],
+            "accession": ["PXD000001"] * 3000,
+            "filename": ["file1.raw"] * 3000,
+            "country": ["United Kingdom"] * 3000,
+            "method": ["http"] * 3000,
+        })
+        df = dd.from_pandas(to_pandas(pa.Table.from_batches([batch])), npartitions=4)
+
+        _, summary = ReportStat.raw_stats(df, False, scheduler="synchronous")
+        self.assertEqual(summary["unique_users"], 301)
+        self.assertNotIn("unique_users_error", summary)
+
+        builder = CubeBuilder()
+        builder.add(batch)
+        cube = builder.build()
+        with self.assertRaises(Exception) as context:
+            ReportStat.cube_stats(cube, False, [])
+        self.assertIn("estimates of the distinct users", str(context.exception))
+        _, summary = ReportStat.cube_stats(cube, False, [], exact_users=False)
+        self.assertAlmostEqual(summary["unique_users"] / 301, 1, delta=0.05)
+        self.assertIn("unique_users_error", summary)
+
+
+if __name__ == '__main__':
+    unittest.main()
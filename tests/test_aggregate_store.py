@@ -0,0 +1,108 @@
+"""
+Unit tests for AggregateStore class.
+"""
+import unittest
+import tempfile
+import os
+import shutil
+import weakref
+from datetime import timedelta
+from unittest.mock import patch
+import pyarrow as pa
+import pyarrow.parquet as pq
+from datetime import date
+from filedownloadstat import aggregate_store
+from filedownloadstat.aggregate_store import AggregateStore
+
+
+class TestAggregateStore(unittest.TestCase):
+
+    def setUp(self):
+        """Set up test fixtures."""
+        self.temp_dir = tempfile.mkdtemp()
+        self.store_dir = os.path.join(self.temp_dir, "aggregates")
+        self.log_1 = self._write("log1.parquet", [date(2024, 1, 1), date(2024, 1, 2)], ["PXD000001", "PXD000002"])
+        self.log_2 = self._write("log2.parquet", [date(2024, 1, 2)], ["PXD000001"])
+
+    def tearDown(self):
+        """Clean up test fixtures."""
+        if os.path.exists(self.temp_dir):
+            shutil.rmtree(self.temp_dir)
+
+    def _write(self, name, dates, accessions):
+        """Write a per-log parquet file with one download per date."""
+        path = os.path.join(self.temp_dir, name)
+        pq.write_table(pa.table({
+            "date": pa.array(dates, pa.date64()),
+            "year": pa.array([d.year for d in dates], pa.int16()),
+            "month": pa.array([d.month for d in dates], pa.int8()),
+            "user": [f"user{i}" for i in range(len(dates))],
+            "accession": accessions,
+            "filename": ["file.raw"] * len(dates),
+            "country": ["United Kingdom"] * len(dates),
+            "method": ["http"] * len(dates),
+        }), path)
+        return path
+
+    def _project_counts(self, store):
+        counts = store.cube().counts
+        return counts.groupby("accession")["count"].sum().to_dict()
+
+    def test_update_only_rebuilds_changed_days(self):
+        """Test unchanged files are not folded again and a replaced file replaces its contribution."""
+        store = AggregateStore(self.store_dir)
+        self.assertEqual(store.update([self.log_1, self.log_2]), ["2024-01-01", "2024-01-02"])
+        self.assertEqual(store.dates(), ["2024-01-01", "2024-01-02"])
+        self.assertEqual(self._project_counts(store), {"PXD000001": 2, "PXD000002": 1})
+
+        # The index is persistent: nothing changed, nothing is rebuilt
+        store = AggregateStore(self.store_dir)
+        self.assertEqual(store.update([self.log_1, self.log_2]), [])
+
+        # Reprocessed log: its day is rebuilt without counting the previous version
+        self._write("log2.parquet", [date(2024, 1, 2), date(2024, 1, 2)], ["PXD000003", "PXD000003"])
+        os.utime(self.log_2, ns=(0, 0))
+        self.assertEqual(store.update([self.log_1, self.log_2]), ["2024-01-02"])
+        self.assertEqual(self._project_counts(store), {"PXD000001": 1, "PXD000002": 1, "PXD000003": 2})
+
+    def test_removed_file(self):
+        """Test the days of a file that is not part of the dataset any more are dropped."""
+        store = AggregateStore(self.store_dir)
+        store.update([self.log_1, self.log_2])
+        self.assertEqual(store.update([self.log_2]), ["2024-01-01", "2024-01-02"])
+        self.assertEqual(store.dates(), ["2024-01-02"])
+        cube = store.cube()
+        self.assertEqual(cube.file_counts.to_dict(orient="records"),
+                         [{"accession": "PXD000001", "filename": "file.raw", "count": 1}])
+        self.assertEqual(cube.users_by_date.total(), 1)
+
+    def test_rebuild_many_days_in_chunks(self):
+        """Test a rebuild of many days writes every day while holding the builders of one chunk at a time."""
+        days = [date(2023, 1, 1) + timedelta(days=i) for i in range(100)]
+        logs = [self._write(f"history{i}.parquet", days[i::3], ["PXD000001"] * len(days[i::3])) for i in range(3)]
+        live_builders = weakref.WeakSet()
+        peak = []
+
+        def tracked_builder(*args, **kwargs):
+            builder = aggregate_store.CubeBuilder.__wrapped__(*args, **kwargs)
+            live_builders.add(builder)
+            peak.append(len(live_builders))
+            return builder
+
+        tracked_builder.__wrapped__ = aggregate_store.CubeBuilder
+        with patch.object(aggregate_store, "CubeBuilder", tracked_builder):
+            store = AggregateStore(self.store_dir, rebuild_chunk_days=7)
+            self.assertEqual(len(store.update(logs)), 100)
+
+        self.assertLessEqual(max(peak), 7)
+        self.assertEqual(store.dates(), [day.isoformat() for day in days])
+        self.assertEqual(self._project_counts(store), {"PXD000001": 100})
+
+    def test_rebuild_chunk_days_must_be_positive(self):
+        """Test the rebuild chunk size is validated."""
+        with self.assertRaises(Exception):
+            AggregateStore(self.store_dir, rebuild_chunk_days=0)
+
+
+if __name__ == '__main__':
+    unittest.main()
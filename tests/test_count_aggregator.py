@@ -0,0 +1,63 @@
+"""
+Unit tests for CountAggregator class.
+"""
+import unittest
+import pyarrow as pa
+from filedownloadstat.count_aggregator import CountAggregator
+from filedownloadstat.parquet_schema import STRING_DTYPE
+
+
+class TestCountAggregator(unittest.TestCase):
+
+    def setUp(self):
+        """Set up test fixtures."""
+        self.batches = [
+            pa.RecordBatch.from_pydict({
+                "accession": ["PXD000002", "PXD000001", "PXD000002", None],
+                "year": pa.array([2024, 2023, 2024, 2024], pa.int16()),
+                "is_bot": [True, False, False, True],
+            }),
+            pa.RecordBatch.from_pydict({
+                "accession": ["PXD000001", "PXD000003"],
+                "year": pa.array([2024, 2024], pa.int16()),
+                "is_bot": [True, None],
+            }),
+        ]
+
+    def test_counts_across_batches(self):
+        """Test counts are summed across batches, sorted by the keys, and rows with null keys are dropped."""
+        aggregator = CountAggregator(["accession", "year"])
+        for batch in self.batches:
+            aggregator.add(batch)
+
+        result = aggregator.result()
+        self.assertEqual(result.to_dict(orient="records"), [
+            {"accession": "PXD000001", "year": 2023, "count": 1},
+            {"accession": "PXD000001", "year": 2024, "count": 1},
+            {"accession": "PXD000002", "year": 2024, "count": 2},
+            {"accession": "PXD000003", "year": 2024, "count": 1},
+        ])
+        # String keys stay Arrow-backed instead of Python objects
+        self.assertEqual(result["accession"].dtype, STRING_DTYPE)
+
+    def test_sums_with_incremental_merges(self):
+        """Test column sums when every partial aggregate is merged into the running total."""
+        aggregator = CountAggregator(["accession"], ["is_bot"])
+        aggregator.MAX_PENDING_PARTIALS = 1
+        for batch in self.batches * 3:
+            aggregator.add(batch)
+
+        result = aggregator.result()
+        self.assertEqual(result["accession"].tolist(), ["PXD000001", "PXD000002", "PXD000003"])
+        self.assertEqual(result["count"].tolist(), [6, 6, 3])
+        self.assertEqual(result["is_bot_sum"].tolist(), [3, 3, 0])
+
+    def test_empty_result(self):
+        """Test the result of an aggregator without rows has the output columns."""
+        result = CountAggregator(["accession"]).result()
+        self.assertEqual(list(result.columns), ["accession", "count"])
+        self.assertEqual(len(result), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
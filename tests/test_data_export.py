@@ -0,0 +1,97 @@
+"""
+Unit tests for DataExporter class.
+"""
+import unittest
+import tempfile
+import os
+import gzip
+import json
+import shutil
+import pyarrow as pa
+import pyarrow.parquet as pq
+from datetime import date
+from filedownloadstat.data_export import DataExporter, encode_json_rows
+
+
+class TestDataExport(unittest.TestCase):
+
+    def setUp(self):
+        """Set up test fixtures."""
+        self.temp_dir = tempfile.mkdtemp()
+        self.batches = [
+            pa.RecordBatch.from_pydict({
+                "date": pa.array([date(2023, 1, 1), date(2024, 2, 1)], pa.date64()),
+                "year": pa.array([2023, 2024], pa.int16()),
+                "accession": ["PXD000001", 'quote " backslash \\ newline \n Zürich'],
+                "is_bot": [True, None],
+            }),
+            pa.RecordBatch.from_pydict({
+                "date": pa.array([date(2024, 3, 1)], pa.date64()),
+                "year": pa.array([2024], pa.int16()),
+                "accession": ["PXD000003"],
+                "is_bot": [False],
+            }),
+        ]
+        self.records = [
+            {"date": 1672531200000, "year": 2023, "accession": "PXD000001", "is_bot": True},
+            {"date": 1706745600000, "year": 2024, "accession": 'quote " backslash \\ newline \n Zürich', "is_bot": None},
+            {"date": 1709251200000, "year": 2024, "accession": "PXD000003", "is_bot": False},
+        ]
+
+    def tearDown(self):
+        """Clean up test fixtures."""
+        if os.path.exists(self.temp_dir):
+            shutil.rmtree(self.temp_dir)
+
+    def _export(self, name, *args, **kwargs):
+        path = os.path.join(self.temp_dir, name)
+        with DataExporter(path, *args, **kwargs) as exporter:
+            for batch in self.batches:
+                exporter.write(batch)
+        return path
+
+    def test_encode_json_rows(self):
+        """Test rows are encoded as JSON objects with dates in epoch milliseconds."""
+        lines = encode_json_rows(self.batches[0]).to_pybytes().decode("utf-8").splitlines()
+        self.assertEqual([json.loads(line) for line in lines], self.records[:2])
+
+    def test_json_array(self):
+        """Test the default export is a single JSON array."""
+        path = self._export("all_data.json")
+        with open(path) as f:
+            self.assertEqual(json.load(f), self.records)
+
+    def test_empty_json_array(self):
+        """Test an export without records is an empty JSON array."""
+        path = os.path.join(self.temp_dir, "all_data.json")
+        DataExporter(path).close()
+        with open(path) as f:
+            self.assertEqual(json.load(f), [])
+
+    def test_compressed_ndjson(self):
+        """Test gzip compressed newline-delimited JSON."""
+        path = self._export("all_data.ndjson.gz", "ndjson", "gzip")
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            self.assertEqual([json.loads(line) for line in f], self.records)
+
+    def test_split_by_year(self):
+        """Test one file per year."""
+        path = self._export("all_data", "ndjson", "zstd", split_by_year=True)
+        self.assertEqual(sorted(os.listdir(path)), ["2023.ndjson.zst", "2024.ndjson.zst"])
+        with pa.input_stream(os.path.join(path, "2024.ndjson.zst"), compression="zstd") as f:
+            lines = f.read().decode("utf-8").splitlines()
+        self.assertEqual([json.loads(line) for line in lines], self.records[1:])
+
+    def test_parquet_passthrough(self):
+        """Test the Parquet export keeps the batches as they are."""
+        path = self._export("all_data.parquet", "parquet")
+        self.assertEqual(pq.read_table(path).to_pylist(), pa.Table.from_batches(self.batches).to_pylist())
+
+    def test_invalid_format(self):
+        """Test an unknown export format is rejected."""
+        with self.assertRaises(Exception):
+            DataExporter(os.path.join(self.temp_dir, "all_data.csv"), "csv")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+"""
+Unit tests for PipelinedGzipReader class.
+"""
+import unittest
+import tempfile
+import os
+import gzip
+from filedownloadstat.gzip_reader import PipelinedGzipReader
+
+
+class TestPipelinedGzipReader(unittest.TestCase):
+
+    def setUp(self):
+        """Set up test fixtures."""
+        self.temp_dir = tempfile.mkdtemp()
+        self.test_file = os.path.join(self.temp_dir, "test.tsv.gz")
+
+    def tearDown(self):
+        """Clean up test fixtures."""
+        import shutil
+        if os.path.exists(self.temp_dir):
+            shutil.rmtree(self.temp_dir)
+
+    def test_iter_lines_matches_gzip_open(self):
+        """Test pipelined lines match the lines read by gzip.open, across chunk boundaries."""
+        lines = [f"line {i}\tvalue {i * 7}" for i in range(5000)]
+        with gzip.open(self.test_file, 'wt') as f:
+            f.write("\n".join(lines) + "\n")
+
+        reader = PipelinedGzipReader(self.test_file, chunk_size=512, queue_depth=2)
+        self.assertEqual([line.decode("utf-8") for line in reader.iter_lines()], lines)
+
+    def test_iter_chunks_are_bounded_for_compressible_input(self):
+        """Test a highly compressible file is inflated in chunks of at most chunk_size bytes."""
+        with open(self.test_file, 'wb') as f:
+            f.write(gzip.compress(b"x" * 2000000 + b"\n"))
+            f.write(gzip.compress(b"y" * 300000))
+
+        chunks = list(PipelinedGzipReader(self.test_file, chunk_size=65536, queue_depth=2).iter_chunks())
+        self.assertLessEqual(max(len(chunk) for chunk in chunks), 65536)
+        self.assertEqual(b"".join(chunks), b"x" * 2000000 + b"\n" + b"y" * 300000)
+
+    def test_iter_lines_with_multi_member_file(self):
+        """Test concatenated gzip members are read as one stream."""
+        with open(self.test_file, 'wb') as f:
+            f.write(gzip.compress(b"first\nsecond\n"))
+            f.write(gzip.compress(b"third\n"))
+
+        reader = PipelinedGzipReader(self.test_file)
+        self.assertEqual(list(reader.iter_lines()), [b"first", b"second", b"third"])
+
+    def test_iter_lines_with_truncated_file_raises_error(self):
+        """Test a truncated gzip file raises EOFError like gzip.open."""
+        data = gzip.compress(("x" * 100000).encode("utf-8"))
+        with open(self.test_file, 'wb') as f:
+            f.write(data[:len(data) // 2])
+
+        reader = PipelinedGzipReader(self.test_file)
+        with self.assertRaises(EOFError):
+            list(reader.iter_lines())
+
+    def test_iter_lines_with_invalid_file_raises_error(self):
+        """Test a file that is not gzipped raises an OSError like gzip.open."""
+        with open(self.test_file, 'wb') as f:
+            f.write(b"not gzipped content")
+
+        reader = PipelinedGzipReader(self.test_file)
+        with self.assertRaises(OSError):
+            list(reader.iter_lines())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+"""
+Unit tests for IngestionManifest class.
+"""
+import unittest
+import tempfile
+import os
+import gzip
+import shutil
+import pyarrow.parquet as pq
+from filedownloadstat.ingestion_manifest import IngestionManifest
+from filedownloadstat.log_file_util import FileUtil
+from filedownloadstat.log_file_parser import RowFilter
+
+
+class TestIngestionManifest(unittest.TestCase):
+
+    def setUp(self):
+        """Set up test fixtures."""
+        self.temp_dir = tempfile.mkdtemp()
+        self.store_dir = os.path.join(self.temp_dir, "store")
+        self.file_util = FileUtil()
+
+    def tearDown(self):
+        """Clean up test fixtures."""
+        if os.path.exists(self.temp_dir):
+            shutil.rmtree(self.temp_dir)
+
+    def _write_log_file(self, name, accession):
+        log_file = os.path.join(self.temp_dir, "http", "public", name)
+        os.makedirs(os.path.dirname(log_file), exist_ok=True)
+        with gzip.open(log_file, 'wt') as f:
+            f.write(f"2023-01-01T00:00:00.000Z\tuser_hash\t123\t/pride/data/archive/2023/01/{accession}/file.raw\tOUT\thash\tComplete\tUnited Kingdom\tCambridgeshire\tCambridge\t52.2053,0.1218\thttp\tpublic\n")
+        return log_file
+
+    def _parse(self, log_file):
+        output_file = os.path.join(self.temp_dir, os.path.basename(log_file) + ".parquet")
+        self.file_util.process_log_file(log_file, output_file, ["/pride/data/archive"], ["complete"], 1000, ["PXD\\d{6}"])
+        return output_file
+
+    def _list_log_files(self, manifest):
+        file_list = os.path.join(self.temp_dir, "file_list.txt")
+        self.file_util.process_access_methods(self.temp_dir, file_list, ["http"], ["public"], manifest=manifest)
+        return FileUtil.read_log_file_list(file_list)
+
+    def test_parquet_file_records_source_log_file(self):
+        """Test per-log parquet files carry the path of their source log in the schema metadata."""
+        log_file = self._write_log_file("a.tsv.gz", "PXD000001")
+        self.assertEqual(IngestionManifest.source_log_file(self._parse(log_file)), log_file)
+
+    def test_unchanged_log_files_are_skipped(self):
+        """Test only new or changed log files are listed once the store holds the others."""
+        log_a = self._write_log_file("a.tsv.gz", "PXD000001")
+        log_b = self._write_log_file("b.tsv.gz", "PXD000002")
+        stored = IngestionManifest(self.store_dir).ingest([self._parse(log_a), self._parse(log_b)])
+        self.assertEqual(len(stored), 2)
+
+        self.assertEqual(self._list_log_files(IngestionManifest(self.store_dir)), [])
+
+        log_c = self._write_log_file("c.tsv.gz", "PXD000003")
+        self._write_log_file("a.tsv.gz", "PXD000004")
+        os.utime(log_a, ns=(1, 1))
+        self.assertEqual(sorted(self._list_log_files(IngestionManifest(self.store_dir))), [log_a, log_c])
+
+    def test_reingested_log_file_replaces_stored_parquet(self):
+        """Test a re-parsed log replaces its stored parquet file instead of adding a second one."""
+        log_file = self._write_log_file("a.tsv.gz", "PXD000001")
+        IngestionManifest(self.store_dir).ingest([self._parse(log_file)])
+
+        self._write_log_file("a.tsv.gz", "PXD000002")
+        stored = IngestionManifest(self.store_dir).ingest([self._parse(log_file)])
+
+        self.assertEqual(len(stored), 1)
+        self.assertEqual(pq.read_table(stored[0]).column("accession").to_pylist(), ["PXD000002"])
+
+    def test_log_file_without_rows_drops_stored_parquet(self):
+        """Test a processed log that no longer produces a parquet file is recorded and its old data dropped."""
+        log_file = self._write_log_file("a.tsv.gz", "PXD000001")
+        IngestionManifest(self.store_dir).ingest([self._parse(log_file)])
+
+        manifest = IngestionManifest(self.store_dir)
+        self.assertEqual(manifest.ingest([], [log_file]), [])
+        stat = os.stat(log_file)
+        self.assertTrue(IngestionManifest(self.store_dir).is_current(log_file, stat.st_size, stat.st_mtime_ns))
+
+    def test_records_log_file_state_from_the_scan(self):
+        """Test the manifest records the size and mtime listed by the scan, not the log's state at merge time."""
+        log_file = self._write_log_file("a.tsv.gz", "PXD000001")
+        os.utime(log_file, ns=(1_000_000_000, 1_000_000_000))
+        self.assertEqual(self._list_log_files(IngestionManifest(self.store_dir)), [log_file])
+        parquet_file = self._parse(log_file)
+
+        # The log is appended to after the scan, its new rows were not parsed
+        with gzip.open(log_file, 'at') as f:
+            f.write("more rows\n")
+        IngestionManifest(self.store_dir).ingest([parquet_file], [log_file])
+
+        self.assertEqual(IngestionManifest(self.store_dir).entries[log_file].mtime_ns, 1_000_000_000)
+        self.assertEqual(self._list_log_files(IngestionManifest(self.store_dir)), [log_file])
+
+    def test_row_filtered_parquet_file_is_not_stored(self):
+        """Test per-log files parsed with parse-time filters are refused, as their log would not be parsed again."""
+        log_file = self._write_log_file("a.tsv.gz", "PXD000001")
+        output_file = os.path.join(self.temp_dir, "a.parquet")
+        self.file_util.process_log_file(log_file, output_file, ["/pride/data/archive"], ["complete"], 1000,
+                                        ["PXD\\d{6}"], row_filter=RowFilter(accession_denylist=["PXD000002"]))
+        self.assertTrue(IngestionManifest.is_row_filtered(output_file))
+        self.assertFalse(IngestionManifest.is_row_filtered(self._parse(log_file)))
+
+        with self.assertRaises(Exception) as context:
+            IngestionManifest(self.store_dir).ingest([output_file], [log_file])
+        self.assertIn("parse-time filters", str(context.exception))
+        self.assertEqual(IngestionManifest(self.store_dir).entries, {})
+
+    def test_content_hash_skips_touched_log_file(self):
+        """Test a log whose mtime changed but content did not is skipped with content hashing."""
+        log_file = self._write_log_file("a.tsv.gz", "PXD000001")
+        IngestionManifest(self.store_dir, use_content_hash=True).ingest([self._parse(log_file)])
+        os.utime(log_file, ns=(1, 1))
+        stat = os.stat(log_file)
+
+        self.assertFalse(IngestionManifest(self.store_dir).is_current(log_file, stat.st_size, stat.st_mtime_ns))
+        self.assertTrue(IngestionManifest(self.store_dir, use_content_hash=True)
+                        .is_current(log_file, stat.st_size, stat.st_mtime_ns))
+
+
+if __name__ == '__main__':
+    unittest.main()
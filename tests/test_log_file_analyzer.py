@@ -0,0 +1,47 @@
+"""
+Unit tests for LogFileAnalyzer class.
+"""
+import unittest
+import tempfile
+import os
+import gzip
+import shutil
+from filedownloadstat.log_file_analyzer import LogFileAnalyzer
+from filedownloadstat.log_file_util import FileUtil
+
+
+class TestLogFileAnalyzer(unittest.TestCase):
+
+    def setUp(self):
+        """Set up test fixtures."""
+        self.temp_dir = tempfile.mkdtemp()
+        self.cwd = os.getcwd()
+        # The analyzer writes its intermediate plots to the working directory
+        os.chdir(self.temp_dir)
+
+    def tearDown(self):
+        """Clean up test fixtures."""
+        os.chdir(self.cwd)
+        if os.path.exists(self.temp_dir):
+            shutil.rmtree(self.temp_dir)
+
+    def test_run_log_file_stat_on_file_list(self):
+        """Test the log file statistics are generated from a file list written by process_access_methods."""
+        for protocol in ["http", "ftp"]:
+            day_dir = os.path.join(self.temp_dir, "logs", protocol, "public", "2023", "01", "01")
+            os.makedirs(day_dir, exist_ok=True)
+            with gzip.open(os.path.join(day_dir, f"{protocol}.tsv.gz"), 'wt') as f:
+                f.write("test content")
+        file_list = os.path.join(self.temp_dir, "file_list.txt")
+        FileUtil().process_access_methods(os.path.join(self.temp_dir, "logs"), file_list, ["http", "ftp"], ["public"])
+        output_file = os.path.join(self.temp_dir, "log_file_stat.html")
+
+        LogFileAnalyzer.run_log_file_stat(file_list, output_file)
+
+        with open(output_file, "r") as f:
+            content = f.read()
+        self.assertIn("File Size Distribution by Protocol", content)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,9 +4,13 @@ Tests for new fields and error handling.
 """
 import unittest
 import os
+import gzip
+import tempfile
 import yaml
-from datetime import datetime
-from filedownloadstat.log_file_parser import LogFileParser
+from datetime import datetime, date
+import pyarrow as pa
+from filedownloadstat.log_file_parser import LogFileParser, PathMatcher, LinePrefilter
+from filedownloadstat.timestamp_decoder import TimestampDecoder
 
 
 class TestLogParserExtended(unittest.TestCase):
@@ -175,6 +179,139 @@ class TestLogParserExtended(unittest.TestCase):
         self.assertIsNotNone(parsed)
         self.assertEqual(parsed["completed"], "partial")
 
+    def test_path_matcher_extracts_accession_and_filename(self):
+        """Test PathMatcher returns accession and filename from a single match."""
+        matcher = PathMatcher(["/pride/data/archive", "/xfer/public/pride"], ["PXD\\d{6}", "MSV\\d{9}"])
+
+        self.assertEqual(
+            matcher.match("/pride/data/archive/2016/12/PXD004242/filename.raw"),
+            ("PXD004242", "filename.raw")
+        )
+        self.assertEqual(
+            matcher.match("/xfer/public/pride/data/archive/2023/11/MSV000012345/file.mgf"),
+            ("MSV000012345", "file.mgf")
+        )
+
+    def test_path_matcher_rejects_non_matching_paths(self):
+        """Test PathMatcher rejects foreign resources, missing accessions and empty filenames."""
+        matcher = PathMatcher(["/pride/data/archive"], ["PXD\\d{6}"])
+
+        self.assertIsNone(matcher.match("/biostudies/S-BSST1/PXD004242/file.raw"))
+        self.assertIsNone(matcher.match("/pride/data/archive/2016/12/other/file.raw"))
+        self.assertIsNone(matcher.match("/pride/data/archive/2016/12/PXD004242/"))
+
+    def test_path_matcher_rejects_invalid_pattern(self):
+        """Test an invalid accession pattern is reported by name instead of disabling every pattern."""
+        with self.assertRaises(Exception) as context:
+            PathMatcher(["/pride/data/archive"], ["PXD\\d{6}", "MSV[0-9"])
+        self.assertIn("MSV[0-9", str(context.exception))
+
+    def test_timestamp_decoder_decode(self):
+        """Test TimestampDecoder.decode handles millisecond and nanosecond timestamps."""
+        decoder = TimestampDecoder()
+        self.assertEqual(decoder.decode("2024-09-13T23:58:17.000Z"), (date(2024, 9, 13), 2024, 9))
+        self.assertEqual(decoder.decode("2024-09-14T07:14:07.419698061Z"), (date(2024, 9, 14), 2024, 9))
+        # Served from the day cache
+        self.assertEqual(decoder.decode("2024-09-14T23:59:59.999Z"), (date(2024, 9, 14), 2024, 9))
+        with self.assertRaises(ValueError):
+            decoder.decode("not-a-timestamp")
+        # A cached day does not make malformed timestamps of that day valid
+        for malformed in ("2024-09-14Tgarbage", "2024-09-14T25:00:00.000Z"):
+            with self.assertRaises(ValueError):
+                decoder.decode(malformed)
+
+    def test_timestamp_decoder_decode_column(self):
+        """Test TimestampDecoder.decode_column decodes a whole column and nulls malformed values."""
+        dates, years, months = TimestampDecoder.decode_column(pa.array([
+            "2024-09-13T23:58:17.000Z",
+            "2024-09-14T07:14:07.419698061Z",
+            "not-a-timestamp",
+        ]))
+        self.assertEqual(dates.to_pylist()[:2], [date(2024, 9, 13), date(2024, 9, 14)])
+        self.assertIsNone(dates.to_pylist()[2])
+        self.assertEqual(years.to_pylist(), [2024, 2024, None])
+        self.assertEqual(months.to_pylist(), [9, 9, None])
+
+    def test_parse_gzipped_tsv_pipelined_matches_default_reader(self):
+        """Test the pipelined reader yields the same rows as gzip.open."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            log_file = os.path.join(temp_dir, "test.tsv.gz")
+            with gzip.open(log_file, 'wt') as f:
+                for i in range(50):
+                    f.write(f"2023-01-01T00:00:{i % 60:02d}.000Z\tuser{i}\t123\t/pride/data/archive/2023/01/PXD{i:06d}/file.raw"
+                            f"\tOUT\thash\tComplete\tUnited Kingdom\tCambridgeshire\tCambridge\t52.2053,0.1218\thttp\tpublic\n")
+
+            results = []
+            for pipelined in (False, True):
+                parser = LogFileParser(
+                    log_file,
+                    resource_list=["/pride/data/archive"],
+                    completeness_list=["complete"],
+                    accession_pattern_list=["PXD\\d{6}"],
+                    pipelined=pipelined,
+                    read_chunk_size=64
+                )
+                results.append([row for batch in parser.parse_gzipped_tsv(batch_size=7) for row in batch])
+
+        self.assertEqual(len(results[0]), 50)
+        self.assertEqual(results[0], results[1])
+
+    def test_line_prefilter(self):
+        """Test LinePrefilter rejects lines without a resource identifier or completeness token."""
+        prefilter = LinePrefilter(["/pride/data/archive", "/xfer/public/pride"], {"complete"})
+
+        self.assertTrue(prefilter.accepts(b"2023-01-01T00:00:00.000Z\tu\t1\t/pride/data/archive/PXD000001/f.raw\tOUT\th\tComplete"))
+        self.assertTrue(prefilter.accepts(b"2023-01-01T00:00:00.000Z\tu\t1\t/xfer/public/pride/PXD000001/f.raw\tOUT\th\tCOMPLETE"))
+        self.assertFalse(prefilter.accepts(b"2023-01-01T00:00:00.000Z\tu\t1\t/biostudies/S-BSST1/f.raw\tOUT\th\tComplete"))
+        self.assertFalse(prefilter.accepts(b"2023-01-01T00:00:00.000Z\tu\t1\t/pride/data/archive/PXD000001/f.raw\tOUT\th\tPartial"))
+
+    def test_parse_gzipped_tsv_with_literal_tab_separators(self):
+        """Test files using literal '\\t' separators are still parsed."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            log_file = os.path.join(temp_dir, "test.tsv.gz")
+            with gzip.open(log_file, 'wt') as f:
+                f.write("2023-01-01T00:00:00.000Z\\tuser\\t123\\t/pride/data/archive/2023/01/PXD000001/file.raw"
+                        "\\tOUT\\thash\\tComplete\\tUnited Kingdom\\tCambridgeshire\\tCambridge\\t52.2053,0.1218\\thttp\\tpublic\n")
+                f.write("2023-01-01T00:00:00.000Z\\tuser\\t123\\t/other/resource/PXD000002/file.raw"
+                        "\\tOUT\\thash\\tComplete\\tUnited Kingdom\\tCambridgeshire\\tCambridge\\t52.2053,0.1218\\thttp\\tpublic\n")
+
+            parser = LogFileParser(
+                log_file,
+                resource_list=["/pride/data/archive"],
+                completeness_list=["complete"],
+                accession_pattern_list=["PXD\\d{6}"]
+            )
+            rows = [row for batch in parser.parse_gzipped_tsv(batch_size=10) for row in batch]
+
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]["accession"], "PXD000001")
+        self.assertEqual(rows[0]["country"], "United Kingdom")
+
+
+    def test_parse_gzipped_tsv_columns_matches_row_batches(self):
+        """Test column batches hold the same values as the row batches."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            log_file = os.path.join(temp_dir, "test.tsv.gz")
+            with gzip.open(log_file, 'wt') as f:
+                for i in range(25):
+                    f.write(f"2023-01-{i % 28 + 1:02d}T00:00:00.000Z\tuser{i}\t123\t/pride/data/archive/2023/01/PXD{i:06d}/file{i}.raw"
+                            "\tOUT\thash\tComplete\tUnited Kingdom\t{geoip_region_name}\tCambridge\t52.2053,0.1218\thttp\tpublic\n")
+
+            parser = LogFileParser(
+                log_file,
+                resource_list=["/pride/data/archive"],
+                completeness_list=["complete"],
+                accession_pattern_list=["PXD\\d{6}"]
+            )
+            row_batches = list(parser.parse_gzipped_tsv(batch_size=10))
+            column_batches = list(parser.parse_gzipped_tsv_columns(batch_size=10))
+
+        self.assertEqual([len(batch["user"]) for batch in column_batches], [10, 10, 5])
+        self.assertEqual(
+            [pa.Table.from_pydict(batch).to_pylist() for batch in column_batches],
+            [pa.Table.from_pylist(batch).to_pylist() for batch in row_batches]
+        )
+
 
 if __name__ == '__main__':
     unittest.main()
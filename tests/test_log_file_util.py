@@ -6,8 +6,48 @@ import tempfile
 import os
 import gzip
 from pathlib import Path
+import pyarrow.parquet as pq
 from filedownloadstat.log_file_util import FileUtil
+from filedownloadstat.log_file_parser import RowFilter
 from filedownloadstat.exceptions import LogFileNotFoundError, LogFileCorruptedError
+from filedownloadstat.interfaces import ILogParser, IParquetWriter
+from filedownloadstat.parquet_writer import ParquetWriter
+
+
+class RowsParser(ILogParser):
+    """Minimal ILogParser with only the abstract methods."""
+
+    def __init__(self, file_path, resource_list, completeness_list, accession_pattern_list):
+        self.rows = [{"accession": "PXD000001", "year": 2023}, {"accession": "PXD000002", "year": 2024}]
+
+    def parse_gzipped_tsv(self, batch_size):
+        yield from (self.rows[i:i + batch_size] for i in range(0, len(self.rows), batch_size))
+
+    def parse_row(self, row, line_no):
+        return None
+
+
+class RowsWriter(IParquetWriter):
+    """Minimal IParquetWriter with only the abstract methods, collecting the written rows."""
+
+    def __init__(self):
+        self.rows = []
+
+    def write_all(self, data):
+        return self.write_batch(data)
+
+    def write_batch(self, data):
+        self.rows.extend(data)
+        return bool(data)
+
+    def finalize(self):
+        return False
+
+
+def tagged_writer(**kwargs):
+    """Picklable writer factory marking the files it writes."""
+    kwargs["metadata"] = {**kwargs["metadata"], "writer": "tagged"}
+    return ParquetWriter(**kwargs)
 
 
 class TestFileUtil(unittest.TestCase):
@@ -82,6 +122,49 @@ class TestFileUtil(unittest.TestCase):
             content = f.read()
             self.assertIn("file.tsv.gz", content)
 
+    def test_process_access_methods_lists_all_methods_concurrently(self):
+        """Test process_access_methods keeps the file list format and order across protocols."""
+        expected = []
+        for protocol in ["http", "ftp"]:
+            for day in ["02", "01"]:
+                day_dir = os.path.join(self.temp_dir, protocol, "public", "2023", "01", day)
+                os.makedirs(day_dir, exist_ok=True)
+                test_file = os.path.join(day_dir, f"{protocol}_{day}.tsv.gz")
+                with gzip.open(test_file, 'wt') as f:
+                    f.write("test content")
+                expected.append((protocol, day, test_file))
+        expected.sort(key=lambda item: (item[0] != "http", item[2]))
+        output_file = os.path.join(self.temp_dir, "file_list.txt")
+
+        self.file_util.process_access_methods(self.temp_dir, output_file, ["http", "ftp"], ["public", "private"],
+                                              scan_workers=3)
+
+        with open(output_file, 'r') as f:
+            lines = [line.rstrip("\n").split("\t") for line in f]
+        self.assertEqual(lines, [
+            [path, os.path.basename(path), str(os.path.getsize(path)), protocol] for protocol, _, path in expected
+        ])
+
+    def test_process_access_methods_keeps_baseline_layout(self):
+        """Test the file list has one block per (protocol, public/private) pair, repeated pairs included."""
+        paths = {}
+        for protocol in ["http", "ftp"]:
+            day_dir = os.path.join(self.temp_dir, protocol, "public", "2023", "01", "01")
+            os.makedirs(day_dir, exist_ok=True)
+            paths[protocol] = os.path.join(day_dir, f"{protocol}.tsv.gz")
+            with gzip.open(paths[protocol], 'wt') as f:
+                f.write("test content")
+        output_file = os.path.join(self.temp_dir, "file_list.txt")
+
+        self.file_util.process_access_methods(self.temp_dir, output_file, ["http", "ftp", "http"], ["public"])
+
+        with open(output_file, 'r') as f:
+            content = f.read()
+        self.assertEqual(content, "".join(
+            f"{paths[protocol]}\t{protocol}.tsv.gz\t{os.path.getsize(paths[protocol])}\t{protocol}\n"
+            for protocol in ["http", "ftp", "http"]
+        ))
+
     def test_process_log_file_with_nonexistent_file_raises_error(self):
         """Test process_log_file raises LogFileNotFoundError for nonexistent file."""
         nonexistent_file = os.path.join(self.temp_dir, "nonexistent.tsv.gz")
@@ -122,6 +205,185 @@ class TestFileUtil(unittest.TestCase):
             # This is acceptable if file doesn't match filters
             pass
 
+    def test_process_log_file_arrow_engine_matches_row_engine(self):
+        """Test the arrow engine writes the same rows and schema as the row engine."""
+        test_file = os.path.join(self.temp_dir, "test.tsv.gz")
+        with gzip.open(test_file, 'wt') as f:
+            f.write("2023-01-01T00:00:00.000Z\tuser_hash\t123\t/pride/data/archive/2023/01/PXD000001/file.raw\tOUT\thash\tComplete\tUnited Kingdom\t{geoip_region_name}\tCambridge\t52.2053,0.1218\thttp\tpublic\n")
+            f.write("2024-09-14T07:14:07.419698061Z\tuser_hash\t123\t/xfer/public/pride/data/archive/2024/09/PXD000002/file.mgf\tOUT\thash\tComplete\tGermany\tBavaria\tMunich\t48.1351,11.5820\tgridftp-globus\tpublic\n")
+            f.write("2023-01-01T00:00:00.000Z\\tuser_hash\\t123\\t/pride/data/archive/2023/01/PXD000003/file.raw\\tOUT\\thash\\tComplete\\tFrance\\t\\t\\t\\thttp\\tpublic\n")
+            f.write("2023-01-01T00:00:00.000Z\tuser_hash\t123\t/pride/data/archive/2023/01/PXD000004/file.raw\tOUT\thash\tPartial\tSpain\tMadrid\tMadrid\t40.4,-3.7\thttp\tpublic\n")
+            f.write("2023-01-01T00:00:00.000Z\tuser_hash\t123\t/biostudies/S-BSST1/file.raw\tOUT\thash\tComplete\tSpain\tMadrid\tMadrid\t40.4,-3.7\thttp\tpublic\n")
+
+        tables = {}
+        for engine in ("row", "arrow"):
+            output_file = os.path.join(self.temp_dir, f"{engine}.parquet")
+            self.file_util.process_log_file(
+                test_file,
+                output_file,
+                ["/pride/data/archive", "/xfer/public/pride"],
+                ["complete"],
+                1000,
+                ["PXD\\d{6}"],
+                engine=engine
+            )
+            tables[engine] = pq.read_table(output_file)
+
+        self.assertEqual(tables["row"].num_rows, 3)
+        self.assertTrue(tables["row"].schema.equals(tables["arrow"].schema))
+        sort_keys = [("accession", "ascending")]
+        self.assertEqual(
+            tables["row"].sort_by(sort_keys).to_pylist(),
+            tables["arrow"].sort_by(sort_keys).to_pylist()
+        )
+
+    def test_process_log_file_with_interface_only_parser_and_writer(self):
+        """Test injected parsers and writers that implement only the abstract interface methods."""
+        log_file = self._write_log_file("http/public/a.log.tsv.gz", "PXD000001")
+        writer = RowsWriter()
+        file_util = FileUtil(parser_factory=RowsParser, writer_factory=lambda **kwargs: writer)
+
+        file_util.process_log_file(log_file, os.path.join(self.temp_dir, "a.parquet"), ["/pride/data/archive"],
+                                   ["complete"], 1, ["PXD\\d{6}"])
+
+        self.assertEqual(writer.rows, [{"accession": "PXD000001", "year": 2023}, {"accession": "PXD000002", "year": 2024}])
+
+    def _write_log_file(self, relative_path, accession):
+        log_file = os.path.join(self.temp_dir, relative_path)
+        os.makedirs(os.path.dirname(log_file), exist_ok=True)
+        with gzip.open(log_file, 'wt') as f:
+            f.write(f"2023-01-01T00:00:00.000Z\tuser_hash\t123\t/pride/data/archive/2023/01/{accession}/file.raw\tOUT\thash\tComplete\tUnited Kingdom\tCambridgeshire\tCambridge\t52.2053,0.1218\thttp\tpublic\n")
+        return log_file
+
+    def test_process_log_files_writes_one_parquet_per_log(self):
+        """Test process_log_files writes one parquet file per log file, with unique names."""
+        log_files = [
+            self._write_log_file("http/public/2023/01/01/a.log.tsv.gz", "PXD000001"),
+            self._write_log_file("ftp/public/2023/01/01/a.log.tsv.gz", "PXD000002"),
+            self._write_log_file("ftp/public/2023/01/02/b.log.tsv.gz", "PXD000003"),
+            self._write_log_file("ftp/public/2023/01/03/a_1.log.tsv.gz", "PXD000004"),
+        ]
+        output_dir = os.path.join(self.temp_dir, "parquet")
+
+        written = self.file_util.process_log_files(
+            log_files, output_dir, ["/pride/data/archive"], ["complete"], 1000, ["PXD\\d{6}"], workers=2
+        )
+
+        self.assertEqual(sorted(os.path.basename(p) for p in written),
+                         ["a.parquet", "a_1.parquet", "a_1_1.parquet", "b.parquet"])
+        accessions = sorted(pq.read_table(p).column("accession")[0].as_py() for p in written)
+        self.assertEqual(accessions, ["PXD000001", "PXD000002", "PXD000003", "PXD000004"])
+
+    def test_process_log_files_workers_use_injected_factories(self):
+        """Test worker processes parse with the factories of the FileUtil, and unpicklable ones are refused."""
+        log_files = [
+            self._write_log_file("http/public/a.log.tsv.gz", "PXD000001"),
+            self._write_log_file("http/public/b.log.tsv.gz", "PXD000002"),
+        ]
+        output_dir = os.path.join(self.temp_dir, "parquet")
+
+        written = FileUtil(writer_factory=tagged_writer).process_log_files(
+            log_files, output_dir, ["/pride/data/archive"], ["complete"], 1000, ["PXD\\d{6}"], workers=2
+        )
+        self.assertEqual(len(written), 2)
+        for parquet_file in written:
+            self.assertEqual(pq.read_schema(parquet_file).metadata[b"writer"], b"tagged")
+
+        with self.assertRaises(Exception) as context:
+            FileUtil(writer_factory=lambda **kwargs: tagged_writer(**kwargs)).process_log_files(
+                log_files, output_dir, ["/pride/data/archive"], ["complete"], 1000, ["PXD\\d{6}"], workers=2
+            )
+        self.assertIn("picklable", str(context.exception))
+
+    def test_process_log_files_combined_output(self):
+        """Test process_log_files combines all rows into a single parquet file."""
+        log_files = [
+            self._write_log_file("http/public/a.log.tsv.gz", "PXD000001"),
+            self._write_log_file("http/public/b.log.tsv.gz", "PXD000002"),
+        ]
+        output_dir = os.path.join(self.temp_dir, "parquet")
+        combined_output = os.path.join(self.temp_dir, "combined.parquet")
+
+        written = self.file_util.process_log_files(
+            log_files, output_dir, ["/pride/data/archive"], ["complete"], 1000, ["PXD\\d{6}"],
+            combined_output=combined_output
+        )
+
+        self.assertEqual(written, [combined_output])
+        self.assertEqual(pq.read_table(combined_output).num_rows, 2)
+        self.assertEqual(os.listdir(output_dir), [])
+
+    def test_process_log_files_combined_output_coalesces_row_groups(self):
+        """Test the combined parquet file is rewritten into writer-sized row groups, not one per log."""
+        log_files = [
+            self._write_log_file(f"http/public/{name}.log.tsv.gz", f"PXD00000{i}")
+            for i, name in enumerate(["a", "b", "c", "d"])
+        ]
+        combined_output = os.path.join(self.temp_dir, "combined.parquet")
+
+        self.file_util.process_log_files(
+            log_files, os.path.join(self.temp_dir, "parquet"), ["/pride/data/archive"], ["complete"], 1000,
+            ["PXD\\d{6}"], writer_options={"row_group_rows": 3}, combined_output=combined_output
+        )
+
+        metadata = pq.ParquetFile(combined_output).metadata
+        self.assertEqual(metadata.num_rows, 4)
+        self.assertEqual([metadata.row_group(i).num_rows for i in range(metadata.num_row_groups)], [3, 1])
+
+    def test_process_log_file_row_filter(self):
+        """Test rows outside the date window and accession sets are dropped by both engines, and log files dated
+        outside the window are not read."""
+        log_file = os.path.join(self.temp_dir, "http/public/2023/12/31/a.log.tsv.gz")
+        os.makedirs(os.path.dirname(log_file), exist_ok=True)
+        rows = [("2023-12-31", "PXD000001"), ("2024-01-01", "PXD000001"), ("2024-01-01", "PXD000002"),
+                ("2024-01-01", "PXD000003"), ("2022-12-31", "PXD000001")]
+        with gzip.open(log_file, 'wt') as f:
+            for day, accession in rows:
+                f.write(f"{day}T23:59:59.000Z\tuser_hash\t123\t/pride/data/archive/2023/01/{accession}/file.raw\tOUT\thash\tComplete\tUnited Kingdom\tCambridgeshire\tCambridge\t52.2053,0.1218\thttp\tpublic\n")
+        row_filter = RowFilter(skipped_years=[2022], from_month="2024-01",
+                               accession_allowlist=["PXD000001", "PXD000002"], accession_denylist=["PXD000002"])
+
+        for engine in FileUtil.PARSE_ENGINES:
+            output_file = os.path.join(self.temp_dir, f"{engine}.parquet")
+            self.file_util.process_log_file(log_file, output_file, ["/pride/data/archive"], ["complete"], 1000,
+                                            ["PXD\\d{6}"], engine=engine, row_filter=row_filter)
+            table = pq.read_table(output_file)
+            self.assertEqual(table.column("accession").to_pylist(), ["PXD000001"])
+            self.assertEqual(str(table.column("date")[0].as_py()), "2024-01-01")
+
+        # The log of 2023-12-31 may hold rows of 2024-01-01, it is only skipped from February
+        output_file = os.path.join(self.temp_dir, "skipped.parquet")
+        self.file_util.process_log_file(log_file, output_file, ["/pride/data/archive"], ["complete"], 1000,
+                                        ["PXD\\d{6}"], row_filter=RowFilter(from_month="2024-02"))
+        self.assertFalse(os.path.exists(output_file))
+
+    def test_process_log_file_without_resource_identifiers(self):
+        """Test no rows are written by either engine when no resource identifier is given."""
+        log_file = self._write_log_file("http/public/2023/01/01/a.log.tsv.gz", "PXD000001")
+        for engine in FileUtil.PARSE_ENGINES:
+            output_file = os.path.join(self.temp_dir, f"{engine}.parquet")
+            self.file_util.process_log_file(log_file, output_file, [], ["complete"], 1000, ["PXD\\d{6}"],
+                                            engine=engine)
+            self.assertFalse(os.path.exists(output_file))
+
+    def test_plan_work_units_balances_compressed_bytes(self):
+        """Test plan_work_units isolates large logs and balances the small ones."""
+        file_list = os.path.join(self.temp_dir, "file_list.txt")
+        sizes = {"huge.tsv.gz": 5000, "big.tsv.gz": 1000}
+        sizes.update({f"small{i}.tsv.gz": 100 for i in range(20)})
+        with open(file_list, 'w') as f:
+            for name, size in sizes.items():
+                f.write(f"/logs/http/public/{name}\t{name}\t{size}\thttp\n")
+        output_file = os.path.join(self.temp_dir, "work_units.txt")
+
+        work_units = self.file_util.plan_work_units(file_list, output_file, 1000)
+
+        self.assertEqual(work_units[:2], [["/logs/http/public/huge.tsv.gz"], ["/logs/http/public/big.tsv.gz"]])
+        self.assertEqual([len(unit) for unit in work_units[2:]], [10, 10])
+        self.assertEqual(sorted(p for unit in work_units for p in unit), sorted(f"/logs/http/public/{n}" for n in sizes))
+        with open(output_file, 'r') as f:
+            self.assertEqual([line.rstrip("\n").split("\t") for line in f], work_units)
+
 
 if __name__ == '__main__':
     unittest.main()
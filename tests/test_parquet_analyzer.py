@@ -149,6 +149,30 @@ class TestParquetAnalyzer(unittest.TestCase):
         analyzer.persist_project_level_yearly_download_counts(df, output_file)
         self.assertTrue(os.path.exists(output_file))
 
+    def test_persist_yearly_and_file_counts_match_pandas(self):
+        """Test the vectorized JSON has the bytes of pandas to_json, including escaped accessions."""
+        analyzer = ParquetAnalyzer()
+        for accessions in (['PXD000002', 'PXD/0001', 'PXD000002'], ['PXD000002', 'Zürich', 'PXD000002']):
+            df = pd.DataFrame({
+                'accession': accessions,
+                'year': pd.array([2024, 2023, 2023], dtype='int16'),
+                'count': [1, 2, 3]
+            })
+            expected = pd.DataFrame([
+                {"accession": accession, "yearlyDownloads": group[["year", "count"]].to_dict(orient="records")}
+                for accession, group in df.groupby("accession")
+            ]).to_json(orient="records")
+            output_file = os.path.join(self.output_dir, "yearly_counts.json")
+            analyzer.persist_project_level_yearly_download_counts(df, output_file)
+            with open(output_file) as f:
+                self.assertEqual(f.read(), expected)
+
+            file_df = df.rename(columns={"year": "filename"}).astype({"filename": str})
+            output_file = os.path.join(self.output_dir, "file_counts.json")
+            analyzer.persist_file_level_download_counts(file_df, output_file)
+            with open(output_file) as f:
+                self.assertEqual(f.read(), file_df.to_json(orient="records"))
+
     def test_persist_top_download_counts(self):
         """Test persist_top_download_counts."""
         analyzer = ParquetAnalyzer()
@@ -235,6 +259,70 @@ class TestParquetAnalyzer(unittest.TestCase):
         analyzer.merge_parquet_files(file_list_path, output_file)
         self.assertTrue(os.path.exists(output_file))
 
+    def test_merge_parquet_files_coalesces_row_groups(self):
+        """Test merged inputs keep their order and are written as large row groups."""
+        analyzer = ParquetAnalyzer()
+        source = pq.read_table(self.test_parquet_path)
+        file_list_path = os.path.join(self.temp_dir, "file_list.txt")
+        with open(file_list_path, 'w') as f:
+            for i in range(5):
+                path = os.path.join(self.temp_dir, f"part{i}.parquet")
+                pq.write_table(source.slice(i % len(source), 1), path)
+                f.write(f"{path}\n")
+
+        output_file = os.path.join(self.output_dir, "merged.parquet")
+        analyzer.merge_parquet_files(file_list_path, output_file, workers=2, row_group_rows=4)
+
+        merged = pq.ParquetFile(output_file)
+        self.assertEqual([merged.metadata.row_group(i).num_rows for i in range(merged.num_row_groups)], [4, 1])
+        self.assertEqual(merged.schema_arrow.names, source.schema.names)
+        self.assertEqual(merged.read().column("filename").to_pylist(),
+                         [source.column("filename")[i % len(source)].as_py() for i in range(5)])
+
+    def test_analyze_parquet_files_row_groups_in_parallel(self):
+        """Test the outputs do not depend on the number of workers analyzing the row groups."""
+        multi_row_group_path = os.path.join(self.temp_dir, "row_groups.parquet")
+        table = pq.read_table(self.test_parquet_path)
+        pq.write_table(pa.concat_tables([table] * 4), multi_row_group_path, row_group_size=2)
+
+        results = []
+        for workers in (1, 3):
+            outputs = [os.path.join(self.output_dir, f"{name}_{workers}.json")
+                       for name in ("project", "file", "yearly", "top", "all")]
+            ParquetAnalyzer(batch_size=1).analyze_parquet_files(multi_row_group_path, *outputs, workers=workers)
+            contents = []
+            for output in outputs:
+                with open(output) as f:
+                    contents.append(f.read())
+            results.append(contents)
+
+        self.assertEqual(results[0], results[1])
+        project_counts = {row["accession"]: row["count"] for row in json.loads(results[1][0])}
+        self.assertEqual(project_counts, {"PXD000001": 8, "PXD000002": 4})
+        self.assertEqual(len(json.loads(results[1][4])), 12)
+
+    def test_analyze_aggregate_cube(self):
+        """Test the outputs from an aggregate cube are the ones from the records, and all_data is exported by build_cube."""
+        analyzer = ParquetAnalyzer()
+        cube_dir = os.path.join(self.temp_dir, "aggregate_cube")
+        all_data = os.path.join(self.output_dir, "all_data.json")
+        analyzer.build_cube(self.test_parquet_path, cube_dir, all_data)
+        with open(all_data) as f:
+            self.assertEqual(len(json.load(f)), 3)
+
+        results = []
+        for name, source in (("raw", self.test_parquet_path), ("cube", cube_dir)):
+            outputs = [os.path.join(self.output_dir, f"{output}_{name}.json")
+                       for output in ("project", "file", "yearly", "top")]
+            analyzer.analyze_parquet_files(source, *outputs, None)
+            contents = []
+            for output in outputs:
+                with open(output) as f:
+                    contents.append(f.read())
+            results.append(contents)
+
+        self.assertEqual(results[0], results[1])
+
     def test_merge_parquet_files_with_no_files_raises_error(self):
         """Test merge_parquet_files raises ParquetMergeError when no files found."""
         analyzer = ParquetAnalyzer()
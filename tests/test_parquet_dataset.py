@@ -0,0 +1,104 @@
+"""
+Unit tests for the partitioned Parquet dataset.
+"""
+import unittest
+import tempfile
+import os
+import json
+import shutil
+from datetime import date
+from filedownloadstat.parquet_dataset import partition_filters
+from filedownloadstat.parquet_writer import ParquetWriter
+from filedownloadstat.parquet_reader import ParquetReader
+from filedownloadstat.parquet_analyzer import ParquetAnalyzer
+
+
+class TestParquetDataset(unittest.TestCase):
+
+    def setUp(self):
+        """Set up test fixtures."""
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Clean up test fixtures."""
+        if os.path.exists(self.temp_dir):
+            shutil.rmtree(self.temp_dir)
+
+    def _row(self, year, month, accession):
+        return {
+            "date": date(year, month, 1),
+            "year": year,
+            "month": month,
+            "user": "user1",
+            "accession": accession,
+            "filename": "file1.raw",
+            "completed": "complete",
+            "country": "United Kingdom",
+            "method": "http",
+            "timestamp": f"{year}-{month:02d}-01T00:00:00.000Z",
+            "geoip_region_name": "Cambridgeshire",
+            "geoip_city_name": "Cambridge",
+            "geo_location": "52.2053,0.1218"
+        }
+
+    def _merge(self, partitioned, version=1):
+        path = os.path.join(self.temp_dir, f"input_v{version}.parquet")
+        writer = ParquetWriter(path, write_strategy='batch', batch_size=10, schema_version=version)
+        writer.write_batch([self._row(2023, 12, "PXD000001"), self._row(2024, 1, "PXD000002"),
+                            self._row(2024, 6, "PXD000003")])
+        writer.finalize()
+        file_list = os.path.join(self.temp_dir, "files.txt")
+        with open(file_list, "w") as f:
+            f.write(path + "\n")
+        output = os.path.join(self.temp_dir, "partitioned" if partitioned else "merged.parquet")
+        ParquetAnalyzer().merge_parquet_files(file_list, output, partitioned=partitioned)
+        return output
+
+    def _analyze(self, merged, **filters):
+        outputs = [os.path.join(self.temp_dir, f"{name}.json") for name in ("project", "file", "yearly", "top", "all")]
+        ParquetAnalyzer().analyze_parquet_files(merged, *outputs, **filters)
+        with open(outputs[0]) as f:
+            return {entry["accession"]: entry["count"] for entry in json.load(f)}
+
+    def test_partition_filters(self):
+        """Test the month window and skipped years are combined in disjunctive normal form."""
+        self.assertIsNone(partition_filters())
+        self.assertEqual(partition_filters(skipped_years=[2022]), [[("year", "not in", [2022])]])
+        self.assertEqual(partition_filters(from_month="2024-01", to_month="2024-06"), [
+            [("year", ">", 2024), ("year", "<", 2024)],
+            [("year", ">", 2024), ("year", "=", 2024), ("month", "<=", 6)],
+            [("year", "=", 2024), ("month", ">=", 1), ("year", "<", 2024)],
+            [("year", "=", 2024), ("month", ">=", 1), ("year", "=", 2024), ("month", "<=", 6)],
+        ])
+        with self.assertRaises(Exception):
+            partition_filters(from_month="2024-13")
+
+    def test_partitioned_merge_layout(self):
+        """Test the partitioned merge writes one directory per year and month."""
+        merged = self._merge(partitioned=True)
+
+        self.assertEqual(sorted(os.listdir(merged)), ["year=2023", "year=2024"])
+        self.assertEqual(sorted(os.listdir(os.path.join(merged, "year=2024"))), ["month=1", "month=6"])
+        rows = [row for batch in ParquetReader.iter_batches(merged, 10) for row in batch.to_pylist()]
+        self.assertEqual(sorted(row["accession"] for row in rows), ["PXD000001", "PXD000002", "PXD000003"])
+        self.assertEqual(list(rows[0].keys())[:3], ["date", "year", "month"])
+
+    def test_analysis_matches_single_file(self):
+        """Test analysis of the partitioned dataset matches the single file, with and without a window."""
+        for version in (1, 2):
+            single = self._analyze(self._merge(partitioned=False, version=version))
+            partitioned = self._analyze(self._merge(partitioned=True, version=version))
+            self.assertEqual(single, partitioned)
+            self.assertEqual(single, {"PXD000001": 1, "PXD000002": 1, "PXD000003": 1})
+
+            window = {"from_month": "2024-01", "to_month": "2024-03"}
+            self.assertEqual(self._analyze(self._merge(partitioned=True, version=version), **window),
+                             {"PXD000002": 1})
+            self.assertEqual(self._analyze(self._merge(partitioned=False, version=version), **window),
+                             {"PXD000002": 1})
+            self.assertEqual(self._analyze(self._merge(partitioned=True, version=version), skipped_years=[2023]),
+                             {"PXD000002": 1, "PXD000003": 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+"""
+Unit tests for the Parquet schema versions.
+"""
+import unittest
+import tempfile
+import os
+import json
+import shutil
+import pyarrow.parquet as pq
+import pyarrow as pa
+from datetime import date
+from filedownloadstat.parquet_schema import SCHEMA_V1, SCHEMA_V2, schema_version, to_v1, to_v2
+from filedownloadstat.parquet_writer import ParquetWriter
+from filedownloadstat.parquet_reader import ParquetReader
+from filedownloadstat.parquet_analyzer import ParquetAnalyzer
+
+
+class TestParquetSchema(unittest.TestCase):
+
+    def setUp(self):
+        """Set up test fixtures."""
+        self.temp_dir = tempfile.mkdtemp()
+        self.rows = [
+            {
+                "date": date(2024, 9, 14),
+                "year": 2024,
+                "month": 9,
+                "user": "user1",
+                "accession": "PXD000001",
+                "filename": "file1.raw",
+                "completed": "complete",
+                "country": "United Kingdom",
+                "method": "http",
+                "timestamp": "2024-09-14T07:14:07.419698061Z",
+                "geoip_region_name": "Cambridgeshire",
+                "geoip_city_name": "Cambridge",
+                "geo_location": "52.2053,0.1218"
+            },
+            {
+                "date": date(2024, 9, 15),
+                "year": 2024,
+                "month": 9,
+                "user": "user2",
+                "accession": "PXD000002",
+                "filename": "file2.raw",
+                "completed": "complete",
+                "country": "China",
+                "method": "ftp",
+                "timestamp": "2024-09-15T00:00:01.000Z",
+                "geoip_region_name": "",
+                "geoip_city_name": "",
+                "geo_location": ""
+            },
+        ]
+
+    def tearDown(self):
+        """Clean up test fixtures."""
+        if os.path.exists(self.temp_dir):
+            shutil.rmtree(self.temp_dir)
+
+    def _write(self, name, version):
+        path = os.path.join(self.temp_dir, name)
+        writer = ParquetWriter(path, write_strategy='batch', batch_size=10, schema_version=version)
+        writer.write_batch(self.rows)
+        writer.finalize()
+        return path
+
+    def test_to_v2_types_and_values(self):
+        """Test the compact schema parses the timestamp and the coordinates."""
+        v2 = to_v2(pa.Table.from_pylist(self.rows, schema=SCHEMA_V1))
+
+        self.assertEqual(schema_version(v2.schema), 2)
+        self.assertTrue(v2.schema.equals(SCHEMA_V2))
+        self.assertEqual(str(v2.column("timestamp")[0]), "2024-09-14 07:14:07.419698+00:00")
+        self.assertAlmostEqual(v2.column("lat")[0].as_py(), 52.2053, places=4)
+        self.assertIsNone(v2.column("lon")[1].as_py())
+
+    def test_to_v1_round_trip(self):
+        """Test version 2 rows read back in the version 1 layout."""
+        v1 = to_v1(to_v2(pa.Table.from_pylist(self.rows, schema=SCHEMA_V1)))
+
+        self.assertTrue(v1.schema.equals(SCHEMA_V1))
+        self.assertEqual(v1.column("timestamp").to_pylist(),
+                         ["2024-09-14T07:14:07.419698Z", "2024-09-15T00:00:01.000000Z"])
+        self.assertEqual(v1.column("geo_location").to_pylist(), ["52.2053,0.1218", ""])
+        for name in ["date", "user", "country", "method", "geoip_region_name", "geoip_city_name"]:
+            self.assertEqual(v1.column(name).to_pylist(), [row[name] for row in self.rows])
+
+    def test_writer_and_reader_with_version_2(self):
+        """Test the writer stores the compact schema and the reader returns the version 1 layout."""
+        path = self._write("v2.parquet", 2)
+
+        self.assertEqual(schema_version(pq.read_schema(path)), 2)
+        self.assertTrue(ParquetReader().read(path).schema.equals(SCHEMA_V1))
+        batches = list(ParquetReader.iter_batches(path, 1, columns=["accession", "geo_location"]))
+        self.assertEqual([batch.to_pylist() for batch in batches], [
+            [{"accession": "PXD000001", "geo_location": "52.2053,0.1218"}],
+            [{"accession": "PXD000002", "geo_location": ""}],
+        ])
+
+    def test_analyzer_accepts_both_versions(self):
+        """Test merge and analysis give the same counts for version 1 and version 2 files."""
+        results = {}
+        for version in (1, 2):
+            path = self._write(f"v{version}.parquet", version)
+            file_list = os.path.join(self.temp_dir, f"files_v{version}.txt")
+            with open(file_list, "w") as f:
+                f.write(path + "\n")
+            merged = os.path.join(self.temp_dir, f"merged_v{version}.parquet")
+            analyzer = ParquetAnalyzer()
+            analyzer.merge_parquet_files(file_list, merged)
+            self.assertEqual(schema_version(pq.read_schema(merged)), version)
+
+            outputs = [os.path.join(self.temp_dir, f"{name}_v{version}.json")
+                       for name in ("project", "file", "yearly", "top", "all")]
+            analyzer.analyze_parquet_files(merged, *outputs)
+            results[version] = []
+            for output in outputs[:4]:
+                with open(output) as f:
+                    results[version].append(json.load(f))
+
+        self.assertEqual(results[1], results[2])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -162,6 +162,61 @@ class TestParquetWriter(unittest.TestCase):
             writer.write_all(test_data)
 
 
+    def _rows(self, count):
+        return [
+            {
+                "date": date(2023, 1, 1),
+                "year": 2023,
+                "month": 1,
+                "user": f"user_{i}",
+                "accession": "PXD000001",
+                "filename": "test.raw",
+                "completed": "complete",
+                "country": "United Kingdom",
+                "method": "http",
+                "timestamp": "2023-01-01T00:00:00.000Z",
+                "geoip_region_name": "Cambridgeshire",
+                "geoip_city_name": "Cambridge",
+                "geo_location": "52.2053,0.1218"
+            }
+            for i in range(count)
+        ]
+
+    def test_small_batches_are_accumulated_into_row_groups(self):
+        """Test the row-group size is independent of the parse batch size."""
+        writer = ParquetWriter(self.test_parquet_path, write_strategy='batch', batch_size=10, row_group_rows=100)
+        for _ in range(25):
+            writer.write_batch(self._rows(10))
+        writer.finalize()
+
+        metadata = pq.ParquetFile(self.test_parquet_path).metadata
+        self.assertEqual(metadata.num_rows, 250)
+        self.assertEqual([metadata.row_group(i).num_rows for i in range(metadata.num_row_groups)], [100, 100, 50])
+
+    def test_row_group_bytes_target(self):
+        """Test a row group is written once the buffered batches reach the byte target."""
+        writer = ParquetWriter(self.test_parquet_path, write_strategy='batch', batch_size=10, row_group_bytes=1)
+        for _ in range(3):
+            writer.write_batch(self._rows(10))
+        writer.finalize()
+
+        self.assertEqual(pq.ParquetFile(self.test_parquet_path).metadata.num_row_groups, 3)
+
+
+    def test_write_batch_accepts_columns_and_record_batches(self):
+        """Test rows, column dicts and record batches can be mixed and keep their order."""
+        writer = ParquetWriter(self.test_parquet_path, write_strategy='batch', batch_size=100)
+        rows = self._rows(6)
+        columns = {name: [row[name] for row in rows[2:4]] for name in ParquetWriter.schema.names}
+        writer.write_batch(rows[:2])
+        writer.write_batch(columns)
+        writer.write_batch(pa.RecordBatch.from_pylist(rows[4:], schema=ParquetWriter.schema))
+        writer.finalize()
+
+        table = pq.read_table(self.test_parquet_path)
+        self.assertEqual(table.column("user").to_pylist(), [f"user_{i}" for i in range(6)])
+
+
 if __name__ == '__main__':
     unittest.main()
 